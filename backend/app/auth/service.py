@@ -1,6 +1,7 @@
 """
 Services d'authentification
 """
+import time
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
@@ -10,15 +11,28 @@ from fastapi.security import OAuth2PasswordBearer
 from bson import ObjectId
 
 from app.config import settings
+from app.utils.cache import LRUCache
 from app.utils.db import users_collection
+from app.utils.workers import BoundedExecutor, WorkerPoolFull
 from app.auth.models import UserCreate, UserInDB, User, TokenData
 
 # Configuration du hachage des mots de passe
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Pool dédié au hachage bcrypt, pour ne pas bloquer la boucle d'événements
+password_hasher = BoundedExecutor(
+    "password-hash",
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    max_queue=settings.PASSWORD_HASH_MAX_QUEUE
+)
+
 # Configuration de l'authentification OAuth2
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_PREFIX}/auth/token")
 
+# Caches des tokens JWT vérifiés et des utilisateurs authentifiés (clé : email + expiration du token)
+token_cache = LRUCache(maxsize=settings.AUTH_CACHE_SIZE)
+user_cache = LRUCache(maxsize=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_USER_CACHE_TTL)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
     Vérifie si un mot de passe en clair correspond à un mot de passe haché
@@ -44,6 +58,29 @@ def get_password_hash(password: str) -> str:
     """
     return pwd_context.hash(password)
 
+async def run_password_task(func, *args):
+    """
+    Exécute une opération de hachage dans le pool dédié
+
+    Args:
+        func: Fonction de hachage ou de vérification
+        *args: Arguments de la fonction
+
+    Returns:
+        Le résultat de la fonction
+
+    Raises:
+        HTTPException: Si le pool de hachage est saturé
+    """
+    try:
+        return await password_hasher.run(func, *args)
+    except WorkerPoolFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service momentanément surchargé, veuillez réessayer",
+            headers={"Retry-After": "1"},
+        )
+
 async def get_user(email: str) -> Optional[UserInDB]:
     """
     Récupère un utilisateur par son email
@@ -74,7 +111,7 @@ async def authenticate_user(email: str, password: str) -> Optional[User]:
     user = await get_user(email)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    if not await run_password_task(verify_password, password, user.hashed_password):
         return None
     
     # Conversion de UserInDB en User (sans le mot de passe haché)
@@ -125,21 +162,33 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
         detail="Identifiants invalides",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
+    payload = token_cache.get(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        except JWTError:
             raise credentials_exception
-        token_data = TokenData(email=email, is_admin=payload.get("is_admin", False))
-    except JWTError:
+        # Le token vérifié est conservé au plus jusqu'à son expiration
+        remaining = payload.get("exp", 0) - time.time()
+        if remaining > 0:
+            token_cache.set(token, payload, ttl=min(remaining, settings.AUTH_USER_CACHE_TTL))
+
+    email: str = payload.get("sub")
+    if email is None:
         raise credentials_exception
-    
+    token_data = TokenData(email=email, is_admin=payload.get("is_admin", False))
+
+    cache_key = (token_data.email, payload.get("exp"))
+    current_user = user_cache.get(cache_key)
+    if current_user is not None:
+        return current_user
+
     user = await get_user(email=token_data.email)
     if user is None:
         raise credentials_exception
     
     # Conversion de UserInDB en User (sans le mot de passe haché)
-    return User(
+    current_user = User(
         id=user.id,
         email=user.email,
         full_name=user.full_name,
@@ -147,6 +196,21 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
         created_at=user.created_at,
         updated_at=user.updated_at
     )
+    user_cache.set(cache_key, current_user)
+    return current_user
+
+def invalidate_user(email: str) -> None:
+    """
+    Retire un utilisateur du cache des utilisateurs authentifiés
+
+    À appeler après toute modification ou suppression d'un utilisateur.
+
+    Args:
+        email: Email de l'utilisateur
+    """
+    for key in user_cache.keys():
+        if key[0] == email:
+            user_cache.pop(key)
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
     """
@@ -210,7 +274,7 @@ async def create_user(user_create: UserCreate) -> User:
     user_data = {
         "email": user_create.email,
         "full_name": user_create.full_name,
-        "hashed_password": get_password_hash(user_create.password),
+        "hashed_password": await run_password_task(get_password_hash, user_create.password),
         "is_admin": user_create.is_admin,
         "created_at": now,
         "updated_at": now
@@ -0,0 +1,52 @@
+"""
+Routes pour les chatbots
+"""
+from datetime import datetime
+from typing import Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+
+from app.auth.models import User
+from app.auth.service import get_admin_user
+from app.clients.models import StatsSummary
+from app.clients.stats import stats_rollups
+from app.utils.db import chatbots_collection
+
+router = APIRouter()
+
+@router.get("/{chatbot_id}/stats", response_model=StatsSummary)
+async def chatbot_stats(
+    chatbot_id: str,
+    granularity: str = Query("day", pattern="^(hour|day|month)$"),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    admin_user: User = Depends(get_admin_user)
+):
+    """
+    Statistiques d'un chatbot, lues dans les compteurs pré-agrégés (réservé aux administrateurs)
+
+    Args:
+        chatbot_id: Identifiant du chatbot
+        granularity: Granularité de la série (hour, day ou month)
+        date_from: Début de l'intervalle
+        date_to: Fin de l'intervalle
+        admin_user: Utilisateur administrateur (injecté par la dépendance)
+
+    Returns:
+        Totaux, série par période et répartition par LLM
+
+    Raises:
+        HTTPException: Si le chatbot est introuvable ou si l'intervalle demandé est trop long
+    """
+    try:
+        chatbot = await chatbots_collection.find_one({"_id": ObjectId(chatbot_id)}, {"client_id": 1})
+    except InvalidId:
+        chatbot = None
+    if not chatbot:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chatbot introuvable")
+    try:
+        return await stats_rollups.summary(chatbot["client_id"], granularity, date_from, date_to, chatbot_id=chatbot_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
@@ -0,0 +1,177 @@
+"""
+Alertes de consommation du quota mensuel des clients
+
+Chaque seuil (par exemple 80 %, 100 % et 120 % du quota) ne donne lieu qu'à une
+seule alerte par client et par mois : l'état est enregistré atomiquement dans la
+collection quota_alerts, partagée entre les workers. Les alertes sont regroupées
+en un email récapitulatif envoyé périodiquement, hors du chemin des requêtes de chat.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from app.config import settings
+from app.utils.db import quota_alerts_collection
+from app.utils.email import send_quota_digest_email
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def current_month() -> str:
+    """
+    Retourne le mois courant
+
+    Returns:
+        Le mois au format AAAA-MM
+    """
+    return datetime.utcnow().strftime("%Y-%m")
+
+class QuotaAlerter:
+    """
+    Détection des franchissements de seuils de quota et envoi des alertes récapitulatives
+    """
+
+    def __init__(self, thresholds: List[int] = settings.QUOTA_ALERT_THRESHOLDS,
+                 interval: float = settings.QUOTA_ALERT_DIGEST_INTERVAL):
+        self.thresholds = sorted(thresholds)
+        self.interval = interval
+        self._seen: Set[Tuple[str, str, int]] = set()
+        self._pending: Dict[Tuple[str, str, int], Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+        # Traitement périodique en cours, protégé de l'annulation de la tâche d'envoi
+        self._writing: Optional[asyncio.Task] = None
+
+    def notify_usage(self, client: Dict[str, Any], used: int) -> None:
+        """
+        Signale la consommation courante d'un client
+
+        Cette méthode ne fait aucune entrée/sortie : les seuils franchis sont
+        mis en attente et traités par la tâche d'envoi des alertes.
+
+        Args:
+            client: Document du client (client_id, name, monthly_quota)
+            used: Nombre de requêtes consommées ce mois-ci
+        """
+        quota = client.get("monthly_quota") or settings.DEFAULT_MONTHLY_QUOTA
+        month = current_month()
+        for threshold in self.thresholds:
+            if used * 100 < quota * threshold:
+                break
+            key = (client["client_id"], month, threshold)
+            if key in self._seen:
+                continue
+            self._seen.add(key)
+            self._pending[key] = {
+                "client_id": client["client_id"],
+                "name": client.get("name", client["client_id"]),
+                "month": month,
+                "threshold": threshold,
+                "monthly_quota": quota,
+                "used": used,
+            }
+
+    async def start(self) -> None:
+        """Démarre la tâche d'envoi des alertes"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Envoie les alertes en attente puis arrête la tâche"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._writing is not None:
+            await asyncio.gather(self._writing, return_exceptions=True)
+            self._writing = None
+        await self.flush()
+
+    async def flush(self) -> int:
+        """
+        Enregistre les alertes en attente et envoie un récapitulatif des nouvelles
+
+        Une alerte déjà enregistrée (par ce worker ou un autre) n'est pas renvoyée.
+        Si le récapitulatif ne peut pas être placé dans la boîte d'envoi, les
+        alertes sont désenregistrées et retentées au prochain traitement.
+
+        Returns:
+            Nombre d'alertes envoyées
+        """
+        pending, self._pending = list(self._pending.values()), {}
+        # Alertes enregistrées par ce traitement, désenregistrées tant que leur récapitulatif n'est pas placé
+        claimed: List[Dict[str, Any]] = []
+        handled = 0
+        try:
+            for alert in pending:
+                # Une insertion interrompue a pu aboutir : l'alerte est considérée comme enregistrée
+                claimed.append(alert)
+                try:
+                    await quota_alerts_collection.insert_one(dict(alert, created_at=datetime.utcnow()))
+                except DuplicateKeyError:
+                    claimed.pop()
+                except Exception as e:
+                    # Nouvelle tentative lors du prochain traitement
+                    logger.error(f"Erreur lors de l'enregistrement d'une alerte de quota: {str(e)}")
+                    claimed.pop()
+                    self._retry(alert)
+                handled += 1
+
+            new_alerts = list(claimed)
+            if new_alerts:
+                try:
+                    sent = await send_quota_digest_email(new_alerts)
+                except Exception as e:
+                    logger.error(f"Erreur lors de l'envoi du récapitulatif des alertes de quota: {str(e)}")
+                    sent = False
+                if not sent:
+                    await self._release(new_alerts)
+                    return 0
+                claimed = []
+                logger.info(f"{len(new_alerts)} alerte(s) de quota envoyée(s)")
+        except BaseException:
+            # Traitement annulé : les alertes non traitées et celles sans récapitulatif sont retentées
+            for alert in pending[handled:]:
+                self._retry(alert)
+            if claimed:
+                await asyncio.shield(self._release(claimed))
+            raise
+
+        # Oubli des seuils des mois précédents
+        month = current_month()
+        self._seen = {key for key in self._seen if key[1] == month}
+        return len(new_alerts)
+
+    def _retry(self, alert: Dict[str, Any]) -> None:
+        """Remet une alerte en attente pour le prochain traitement"""
+        self._pending[(alert["client_id"], alert["month"], alert["threshold"])] = alert
+
+    async def _release(self, alerts: List[Dict[str, Any]]) -> None:
+        """Supprime l'enregistrement d'alertes non envoyées et les remet en attente"""
+        try:
+            await quota_alerts_collection.delete_many({"$or": [
+                {"client_id": a["client_id"], "month": a["month"], "threshold": a["threshold"]}
+                for a in alerts
+            ]})
+        except Exception as e:
+            # Enregistrements conservés : ces alertes ne seront pas renvoyées
+            logger.error(f"Erreur lors de la suppression des alertes de quota non envoyées: {str(e)}")
+            return
+        for alert in alerts:
+            self._retry(alert)
+
+    async def _run(self) -> None:
+        """Traite périodiquement les alertes en attente"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                # Un traitement interrompu laisserait des alertes enregistrées sans récapitulatif
+                self._writing = asyncio.ensure_future(self.flush())
+                await asyncio.shield(self._writing)
+            except Exception as e:
+                logger.error(f"Erreur lors de l'envoi des alertes de quota: {str(e)}")
+
+# Instance partagée des alertes de quota
+quota_alerter = QuotaAlerter()
@@ -1,51 +1,75 @@
 """
-Modèles pour l'authentification
+Modèles pour les clients
 """
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 
-class UserBase(BaseModel):
-    """Modèle de base pour les utilisateurs"""
-    email: EmailStr
-    full_name: Optional[str] = None
-    is_admin: bool = False
+from app.config import settings
 
-class UserCreate(UserBase):
-    """Modèle pour la création d'un utilisateur"""
-    password: str
+class ClientBase(BaseModel):
+    """Modèle de base pour les clients"""
+    name: str
+    domain: Optional[str] = None
+    contact_email: EmailStr
+    contact_name: Optional[str] = None
+    contact_phone: Optional[str] = None
+    monthly_quota: int = Field(default=settings.DEFAULT_MONTHLY_QUOTA, ge=0)
+    active: bool = True
 
-class UserUpdate(BaseModel):
-    """Modèle pour la mise à jour d'un utilisateur"""
-    email: Optional[EmailStr] = None
-    full_name: Optional[str] = None
-    password: Optional[str] = None
+class ClientCreate(ClientBase):
+    """Modèle pour la création d'un client"""
+    pass
 
-class UserInDB(UserBase):
-    """Modèle pour un utilisateur en base de données"""
+class ClientUpdate(BaseModel):
+    """Modèle pour la mise à jour d'un client"""
+    name: Optional[str] = None
+    domain: Optional[str] = None
+    contact_email: Optional[EmailStr] = None
+    contact_name: Optional[str] = None
+    contact_phone: Optional[str] = None
+    monthly_quota: Optional[int] = Field(default=None, ge=0)
+    active: Optional[bool] = None
+
+class Client(ClientBase):
+    """Modèle pour un client"""
     id: str
-    hashed_password: str
+    client_id: str
     created_at: datetime
     updated_at: datetime
 
     class Config:
         from_attributes = True
 
-class User(UserBase):
-    """Modèle pour un utilisateur"""
-    id: str
-    created_at: datetime
-    updated_at: datetime
+class StatsCounters(BaseModel):
+    """Modèle pour les compteurs de statistiques d'une période ou d'un total"""
+    messages: int = 0
+    user_messages: int = 0
+    bot_messages: int = 0
+    conversations: int = 0
+    tokens: int = 0
+    cost: float = 0.0
+    avg_response_time: Optional[float] = None  # En millisecondes
 
-    class Config:
-        from_attributes = True
+class StatsPoint(StatsCounters):
+    """Modèle pour les compteurs d'une période"""
+    period: datetime
 
-class Token(BaseModel):
-    """Modèle pour un token d'authentification"""
-    access_token: str
-    token_type: str
+class StatsSummary(BaseModel):
+    """Modèle pour les statistiques d'un client ou d'un chatbot sur un intervalle"""
+    granularity: str
+    date_from: datetime
+    date_to: datetime
+    totals: StatsCounters
+    series: List[StatsPoint]
+    by_llm: Dict[str, StatsCounters]
+    by_chatbot: Dict[str, StatsCounters]
 
-class TokenData(BaseModel):
-    """Données contenues dans un token"""
-    email: Optional[str] = None
-    is_admin: bool = False
+class ClientReport(BaseModel):
+    """Modèle pour le rapport mensuel d'un client"""
+    client_id: str
+    name: str
+    month: str
+    monthly_quota: int
+    requests: int  # Requêtes consommées sur le quota
+    stats: StatsSummary
@@ -0,0 +1,214 @@
+"""
+Suivi des quotas mensuels des clients
+
+La consommation de chaque client est tenue en mémoire, ce qui permet de décider
+en O(1) si le quota est dépassé (et s'il faut basculer vers le LLM de secours)
+sans interroger MongoDB à chaque message. Les incréments sont agrégés puis écrits
+périodiquement dans llm_usage par lots (bulk_write), ainsi qu'à l'arrêt.
+
+Chaque worker écrit ses propres incréments ($inc) et relit après chaque écriture le
+total mensuel des clients actifs : la vue de la consommation globale, tous workers
+confondus, a donc au plus un intervalle d'écriture de retard.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from app.config import settings
+from app.utils.db import llm_usage_collection
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def month_start(now: Optional[datetime] = None) -> datetime:
+    """
+    Retourne le premier jour du mois courant à minuit
+
+    Args:
+        now: Date de référence (maintenant par défaut)
+
+    Returns:
+        Le début du mois
+    """
+    now = now or datetime.utcnow()
+    return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+class QuotaEngine:
+    """
+    Compteurs mensuels de requêtes par client avec écriture différée dans llm_usage
+    """
+
+    def __init__(self, interval: float = settings.QUOTA_FLUSH_INTERVAL):
+        self.interval = interval
+        # Total mensuel lu en base, par (client_id, mois)
+        self._stored: Dict[Tuple[str, datetime], int] = {}
+        # Requêtes de ce worker en cours d'écriture, puis pas encore écrites
+        self._flushing: Dict[Tuple[str, datetime], int] = defaultdict(int)
+        self._unflushed: Dict[Tuple[str, datetime], int] = defaultdict(int)
+        # Incréments à écrire dans llm_usage, par (client_id, jour, llm)
+        self._deltas: Dict[Tuple[str, datetime, str], Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        # Écriture périodique en cours, menée à son terme même si la tâche d'écriture est annulée
+        self._writing: Optional[asyncio.Task] = None
+
+    async def used(self, client_id: str) -> int:
+        """
+        Retourne le nombre de requêtes consommées par un client ce mois-ci
+
+        Seul le premier appel du mois pour un client interroge MongoDB.
+
+        Args:
+            client_id: Identifiant du client
+
+        Returns:
+            Nombre de requêtes du mois
+        """
+        key = (client_id, month_start())
+        if key not in self._stored:
+            totals = await self._load_totals([client_id], key[1])
+            self._stored.setdefault(key, totals.get(client_id, 0))
+        return self._stored[key] + self._flushing[key] + self._unflushed[key]
+
+    async def requests_between(self, client_id: str, start: datetime, end: datetime) -> int:
+        """
+        Retourne le nombre de requêtes écrites dans llm_usage pour un client sur un intervalle
+
+        Args:
+            client_id: Identifiant du client
+            start: Premier jour inclus
+            end: Dernier jour exclu
+
+        Returns:
+            Nombre de requêtes (hors incréments pas encore écrits)
+        """
+        cursor = llm_usage_collection.aggregate([
+            {"$match": {"client_id": client_id, "date": {"$gte": start, "$lt": end}}},
+            {"$group": {"_id": None, "requests": {"$sum": "$requests"}}},
+        ])
+        totals = await cursor.to_list(1)
+        return totals[0]["requests"] if totals else 0
+
+    async def is_over_quota(self, client: Dict[str, Any]) -> bool:
+        """
+        Indique si un client a atteint son quota mensuel
+
+        Args:
+            client: Document du client
+
+        Returns:
+            True si le quota est atteint
+        """
+        quota = client.get("monthly_quota") or settings.DEFAULT_MONTHLY_QUOTA
+        return await self.used(client["client_id"]) >= quota
+
+    def record(self, client_id: str, llm_name: str, tokens: int = 0, cache_hit: bool = False) -> None:
+        """
+        Comptabilise une requête LLM (sans entrée/sortie)
+
+        Les réponses servies depuis le cache sont comptabilisées à part et ne
+        consomment pas de requête sur le quota.
+
+        Args:
+            client_id: Identifiant du client
+            llm_name: LLM utilisé
+            tokens: Nombre de tokens consommés (ou économisés pour un succès de cache)
+            cache_hit: Si la réponse provient du cache
+        """
+        now = datetime.utcnow()
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        delta = self._deltas[(client_id, today, llm_name)]
+        if cache_hit:
+            delta["cache_hits"] += 1
+            delta["tokens_saved"] += tokens
+        else:
+            delta["requests"] += 1
+            delta["tokens"] += tokens
+            self._unflushed[(client_id, month_start(now))] += 1
+
+    async def start(self) -> None:
+        """Démarre la tâche d'écriture périodique"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Arrête la tâche d'écriture et écrit les incréments restants"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._writing is not None:
+            await asyncio.gather(self._writing, return_exceptions=True)
+            self._writing = None
+        await self.flush()
+
+    async def flush(self) -> int:
+        """
+        Écrit les incréments en attente dans llm_usage puis relit les totaux des clients actifs
+
+        Returns:
+            Nombre de documents llm_usage mis à jour
+        """
+        async with self._lock:
+            deltas, self._deltas = self._deltas, defaultdict(lambda: defaultdict(int))
+            self._flushing, self._unflushed = self._unflushed, defaultdict(int)
+            operations = [
+                UpdateOne(
+                    {"client_id": client_id, "date": day, "llm": llm_name},
+                    {"$inc": dict(increments)},
+                    upsert=True
+                )
+                for (client_id, day, llm_name), increments in deltas.items()
+            ]
+            if operations:
+                try:
+                    await llm_usage_collection.bulk_write(operations, ordered=False)
+                except Exception:
+                    self._merge_back(deltas)
+                    raise
+
+            # Relecture des totaux, qui incluent désormais les incréments écrits et ceux des autres workers
+            month = month_start()
+            client_ids = list({client_id for client_id, key_month in self._stored if key_month == month} |
+                              {client_id for client_id, key_month in self._flushing if key_month == month})
+            totals = await self._load_totals(client_ids, month)
+            self._stored = {(client_id, month): totals.get(client_id, 0) for client_id in client_ids}
+            self._flushing = defaultdict(int)
+            return len(operations)
+
+    def _merge_back(self, deltas: Dict[Tuple[str, datetime, str], Dict[str, int]]) -> None:
+        """Réintègre des incréments non écrits pour une prochaine tentative"""
+        for key, increments in deltas.items():
+            for field, value in increments.items():
+                self._deltas[key][field] += value
+        for key, value in self._flushing.items():
+            self._unflushed[key] += value
+        self._flushing = defaultdict(int)
+
+    async def _load_totals(self, client_ids: List[str], month: datetime) -> Dict[str, int]:
+        """Calcule en une agrégation le total mensuel de requêtes de plusieurs clients"""
+        if not client_ids:
+            return {}
+        cursor = llm_usage_collection.aggregate([
+            {"$match": {"client_id": {"$in": client_ids}, "date": {"$gte": month}}},
+            {"$group": {"_id": "$client_id", "requests": {"$sum": "$requests"}}},
+        ])
+        return {doc["_id"]: doc["requests"] async for doc in cursor}
+
+    async def _run(self) -> None:
+        """Écrit périodiquement les incréments en attente"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                # Une écriture interrompue perdrait les incréments déjà retirés des compteurs
+                self._writing = asyncio.ensure_future(self.flush())
+                await asyncio.shield(self._writing)
+            except Exception as e:
+                logger.error(f"Erreur lors de l'écriture de la consommation LLM: {str(e)}")
+
+# Instance partagée du suivi des quotas
+quota_engine = QuotaEngine()
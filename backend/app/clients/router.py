@@ -1,16 +1,26 @@
 """
 Routes d'authentification
 """
-from datetime import timedelta
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 
 from app.auth.models import User, UserCreate, Token
 from app.auth.service import authenticate_user, create_access_token, get_current_active_user, create_user, get_admin_user
+from app.clients.models import ClientReport, StatsSummary
+from app.clients.quota import month_start, quota_engine
+from app.clients.stats import stats_rollups
 from app.config import settings
+from app.conversations.export import FORMATS, RowEncoder
+from app.utils.db import clients_collection
 
 router = APIRouter()
 
+REPORT_COLUMNS = ("period", "messages", "user_messages", "bot_messages", "conversations", "tokens",
+                  "cost", "avg_response_time")
+
 @router.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     """
@@ -70,3 +80,123 @@ async def register_user(user_create: UserCreate, admin_user: User = Depends(get_
         HTTPException: Si l'email est déjà utilisé
     """
     return await create_user(user_create)
+
+@router.get("/{client_id}/stats", response_model=StatsSummary)
+async def client_stats(
+    client_id: str,
+    granularity: str = Query("day", pattern="^(hour|day|month)$"),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    admin_user: User = Depends(get_admin_user)
+):
+    """
+    Statistiques d'un client, lues dans les compteurs pré-agrégés (réservé aux administrateurs)
+
+    Args:
+        client_id: Identifiant du client
+        granularity: Granularité de la série (hour, day ou month)
+        date_from: Début de l'intervalle
+        date_to: Fin de l'intervalle
+        admin_user: Utilisateur administrateur (injecté par la dépendance)
+
+    Returns:
+        Totaux, série par période et répartition par LLM et par chatbot
+
+    Raises:
+        HTTPException: Si l'intervalle demandé est trop long
+    """
+    try:
+        return await stats_rollups.summary(client_id, granularity, date_from, date_to)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.get("/{client_id}/report", response_model=ClientReport)
+async def client_report(
+    client_id: str,
+    month: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"),
+    admin_user: User = Depends(get_admin_user)
+):
+    """
+    Rapport mensuel d'un client (réservé aux administrateurs)
+
+    Args:
+        client_id: Identifiant du client
+        month: Mois au format AAAA-MM (mois courant par défaut)
+        admin_user: Utilisateur administrateur (injecté par la dépendance)
+
+    Returns:
+        Quota, consommation et statistiques quotidiennes du mois
+
+    Raises:
+        HTTPException: Si le client est introuvable ou si le mois est invalide
+    """
+    client = await clients_collection.find_one({"client_id": client_id}, {"name": 1, "monthly_quota": 1})
+    if not client:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Client introuvable")
+    try:
+        start = datetime.strptime(month, "%Y-%m") if month else month_start()
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Mois invalide")
+    end = (start + timedelta(days=32)).replace(day=1)
+
+    if start == month_start():
+        requests = await quota_engine.used(client_id)
+    else:
+        requests = await quota_engine.requests_between(client_id, start, end)
+    return ClientReport(
+        client_id=client_id,
+        name=client.get("name", ""),
+        month=start.strftime("%Y-%m"),
+        monthly_quota=client.get("monthly_quota") or settings.DEFAULT_MONTHLY_QUOTA,
+        requests=requests,
+        stats=await stats_rollups.summary(client_id, "day", start, end),
+    )
+
+@router.get("/{client_id}/report/export")
+async def export_client_report(
+    client_id: str,
+    granularity: str = Query("day", pattern="^(hour|day|month)$"),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    format: str = Query("csv", pattern="^(ndjson|csv)$"),
+    gzip: bool = False,
+    admin_user: User = Depends(get_admin_user)
+):
+    """
+    Exporte la série statistique d'un client, une ligne par période (réservé aux administrateurs)
+
+    Args:
+        client_id: Identifiant du client
+        granularity: Granularité de la série (hour, day ou month)
+        date_from: Début de l'intervalle
+        date_to: Fin de l'intervalle
+        format: Format (ndjson ou csv)
+        gzip: Compression gzip
+        admin_user: Utilisateur administrateur (injecté par la dépendance)
+
+    Returns:
+        Un fichier NDJSON ou CSV, en pièce jointe
+
+    Raises:
+        HTTPException: Si l'intervalle demandé est trop long
+    """
+    try:
+        summary = await stats_rollups.summary(client_id, granularity, date_from, date_to)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    encoder = RowEncoder(format, gzip, columns=REPORT_COLUMNS)
+
+    def chunks():
+        for point in summary["series"]:
+            encoder.write({column: point.get(column) for column in REPORT_COLUMNS})
+            if encoder.pending() >= settings.EXPORT_CHUNK_SIZE:
+                yield encoder.take()
+        yield encoder.take(final=True)
+
+    filename = f"report-{client_id}-{granularity}.{format}{'.gz' if gzip else ''}"
+    return StreamingResponse(
+        chunks(),
+        media_type="application/gzip" if gzip else FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
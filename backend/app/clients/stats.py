@@ -0,0 +1,323 @@
+"""
+Statistiques pré-agrégées des clients et des chatbots
+
+Les compteurs (messages, conversations, tokens, coût, temps de réponse) sont
+maintenus par heure, jour et mois pour chaque combinaison client / chatbot / LLM
+dans la collection stats_rollups. Ils sont incrémentés à l'écriture des messages
+(voir app.conversations.storage), agrégés en mémoire puis écrits par lots toutes
+les STATS_FLUSH_INTERVAL secondes, ainsi qu'à l'arrêt. Les routes de statistiques
+ne lisent donc que quelques documents, quel que soit le volume de conversations.
+
+Les documents portent une source : "live" pour les compteurs tenus au fil de
+l'eau, "backfill" pour ceux recalculés depuis l'historique par
+`python -m app.utils.backfill_stats`. Le rattrapage ne porte que sur les messages
+antérieurs à la mise en service des compteurs (date `live_since` de la
+collection stats_state) : les deux sources ne se recouvrent jamais et leurs
+compteurs s'additionnent.
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+
+from app.config import settings
+from app.utils.db import llms_collection, stats_rollups_collection, stats_state_collection
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ("hour", "day", "month")
+
+# Durée approximative d'une période, pour borner les intervalles demandés
+PERIOD_LENGTHS = {"hour": timedelta(hours=1), "day": timedelta(days=1), "month": timedelta(days=31)}
+
+COUNTERS = ("messages", "user_messages", "bot_messages", "conversations", "tokens",
+            "response_time_sum", "response_time_count")
+
+RollupKey = Tuple[str, str, str, str, datetime]
+
+def period_start(timestamp: datetime, granularity: str) -> datetime:
+    """
+    Retourne le début de la période contenant une date
+
+    Args:
+        timestamp: Date
+        granularity: Granularité (hour, day ou month)
+
+    Returns:
+        Le début de l'heure, du jour ou du mois
+    """
+    start = timestamp.replace(minute=0, second=0, microsecond=0)
+    if granularity in ("day", "month"):
+        start = start.replace(hour=0)
+    if granularity == "month":
+        start = start.replace(day=1)
+    return start
+
+def accumulate(deltas: Dict[RollupKey, Dict[str, float]], client_id: str, chatbot_id: str,
+               messages: Iterable[Dict[str, Any]], tokens_of: Any = None, new_conversation: bool = False) -> None:
+    """
+    Ajoute les compteurs de messages aux incréments par période
+
+    Args:
+        deltas: Incréments par (client_id, chatbot_id, llm, granularité, période)
+        client_id: Identifiant du client
+        chatbot_id: Identifiant du chatbot
+        messages: Messages de la session
+        tokens_of: Fonction estimant les tokens d'une réponse sans métadonnée `tokens` (optionnelle)
+        new_conversation: Le premier message ouvre une conversation (création de l'en-tête de la session)
+    """
+    for index, message in enumerate(messages):
+        bot = message["sender"] == "bot"
+        # Les messages des visiteurs et les conversations ne dépendent d'aucun LLM
+        llm = (message.get("llm_used") or "") if bot else ""
+        increments: Dict[str, float] = {"messages": 1, "bot_messages" if bot else "user_messages": 1}
+        if new_conversation and index == 0:
+            increments["conversations"] = 1
+        if bot:
+            tokens = (message.get("metadata") or {}).get("tokens")
+            if tokens is None and tokens_of is not None:
+                tokens = tokens_of(message)
+            increments["tokens"] = tokens or 0
+            if message.get("response_time") is not None:
+                increments["response_time_sum"] = message["response_time"]
+                increments["response_time_count"] = 1
+        for granularity in GRANULARITIES:
+            delta = deltas[(client_id, chatbot_id, llm, granularity, period_start(message["timestamp"], granularity))]
+            for field, value in increments.items():
+                delta[field] += value
+
+class LLMPrices:
+    """
+    Tarifs des LLM (cost_per_1k_tokens de la collection llms), relus périodiquement
+    """
+
+    def __init__(self, ttl: float = settings.LLM_PRICES_TTL):
+        self.ttl = ttl
+        self._prices: Dict[str, float] = {}
+        self._loaded_at = 0.0
+
+    async def get(self) -> Dict[str, float]:
+        """
+        Retourne le coût par 1000 tokens de chaque LLM
+
+        Returns:
+            Les tarifs de la collection llms, complétés par LLM_COST_PER_1K_TOKENS
+        """
+        if time.monotonic() - self._loaded_at > self.ttl:
+            prices = dict(settings.LLM_COST_PER_1K_TOKENS)
+            try:
+                async for llm in llms_collection.find({}, {"name": 1, "cost_per_1k_tokens": 1}):
+                    if llm.get("cost_per_1k_tokens") is not None:
+                        prices[llm["name"]] = llm["cost_per_1k_tokens"]
+            except Exception as e:
+                logger.warning(f"Impossible de lire les tarifs des LLM: {str(e)}")
+                prices = self._prices or prices
+            self._prices, self._loaded_at = prices, time.monotonic()
+        return self._prices
+
+    def cost(self, prices: Dict[str, float], llm: str, tokens: float) -> float:
+        """
+        Calcule le coût d'un nombre de tokens
+
+        Args:
+            prices: Tarifs retournés par get
+            llm: Nom du LLM
+            tokens: Nombre de tokens
+
+        Returns:
+            Le coût
+        """
+        return tokens / 1000 * prices.get(llm, 0.0)
+
+# Tarifs partagés des LLM
+llm_prices = LLMPrices()
+
+def rollup_operations(deltas: Dict[RollupKey, Dict[str, float]], prices: Dict[str, float], source: str) -> List[UpdateOne]:
+    """
+    Construit les incréments des documents de statistiques
+
+    Args:
+        deltas: Incréments par (client_id, chatbot_id, llm, granularité, période)
+        prices: Tarifs des LLM
+        source: Source des compteurs ("live" ou "backfill")
+
+    Returns:
+        Les opérations, qui créent les documents si nécessaire
+    """
+    operations = []
+    for (client_id, chatbot_id, llm, granularity, period), increments in deltas.items():
+        increments = dict(increments)
+        if increments.get("tokens"):
+            increments["cost"] = llm_prices.cost(prices, llm, increments["tokens"])
+        operations.append(UpdateOne(
+            {"client_id": client_id, "granularity": granularity, "period": period,
+             "chatbot_id": chatbot_id, "llm": llm, "source": source},
+            {"$inc": increments},
+            upsert=True
+        ))
+    return operations
+
+class StatsRollups:
+    """
+    Compteurs de statistiques par période, avec écriture différée dans stats_rollups
+    """
+
+    def __init__(self, interval: float = settings.STATS_FLUSH_INTERVAL):
+        self.interval = interval
+        self.live_since: Optional[datetime] = None
+        self._deltas: Dict[RollupKey, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        # Écriture périodique en cours, protégée de l'annulation de la tâche d'écriture
+        self._writing: Optional[asyncio.Task] = None
+
+    def record(self, client_id: str, chatbot_id: str, messages: List[Dict[str, Any]],
+               new_conversation: bool = False) -> None:
+        """
+        Comptabilise des messages écrits (sans entrée/sortie)
+
+        Args:
+            client_id: Identifiant du client
+            chatbot_id: Identifiant du chatbot
+            messages: Messages de la session (avec leur position)
+            new_conversation: Les messages ouvrent la conversation (en-tête créé à leur écriture)
+        """
+        if self.live_since is not None:
+            # Les messages antérieurs (rejeu tardif) relèvent du rattrapage, y compris l'ouverture de la conversation
+            live = [message for message in messages if message["timestamp"] >= self.live_since]
+            new_conversation = new_conversation and bool(live) and live[0] is messages[0]
+            messages = live
+        accumulate(self._deltas, client_id, chatbot_id, messages, new_conversation=new_conversation)
+
+    async def start(self) -> None:
+        """Enregistre la date de mise en service des compteurs et démarre l'écriture périodique"""
+        state = await stats_state_collection.find_one_and_update(
+            {"_id": "rollups"},
+            {"$setOnInsert": {"live_since": datetime.utcnow()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self.live_since = state["live_since"]
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Arrête la tâche d'écriture et écrit les compteurs restants"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._writing is not None:
+            await asyncio.gather(self._writing, return_exceptions=True)
+            self._writing = None
+        await self.flush()
+
+    async def flush(self) -> int:
+        """
+        Écrit les compteurs en attente dans stats_rollups
+
+        Returns:
+            Nombre de documents mis à jour
+        """
+        async with self._lock:
+            deltas, self._deltas = self._deltas, defaultdict(lambda: defaultdict(float))
+            if not deltas:
+                return 0
+            try:
+                operations = rollup_operations(deltas, await llm_prices.get(), "live")
+                await stats_rollups_collection.bulk_write(operations, ordered=False)
+            except Exception:
+                self._merge_back(deltas)
+                raise
+            return len(operations)
+
+    def _merge_back(self, deltas: Dict[RollupKey, Dict[str, float]]) -> None:
+        """Réintègre des compteurs non écrits pour une prochaine tentative"""
+        for key, increments in deltas.items():
+            for field, value in increments.items():
+                self._deltas[key][field] += value
+
+    async def summary(self, client_id: str, granularity: str = "day", date_from: Optional[datetime] = None,
+                      date_to: Optional[datetime] = None, chatbot_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Calcule les statistiques d'un client (ou d'un de ses chatbots) sur un intervalle
+
+        Args:
+            client_id: Identifiant du client
+            granularity: Granularité de la série (hour, day ou month)
+            date_from: Début de l'intervalle (par défaut STATS_DEFAULT_PERIODS périodes avant date_to)
+            date_to: Fin de l'intervalle, exclue (maintenant par défaut)
+            chatbot_id: Limite les statistiques à un chatbot
+
+        Returns:
+            Dictionnaire (totals, series, by_llm, by_chatbot)
+
+        Raises:
+            ValueError: Si la granularité est inconnue ou si l'intervalle compte trop de périodes
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Granularité inconnue: {granularity}")
+        date_to = date_to or datetime.utcnow()
+        date_from = date_from or date_to - PERIOD_LENGTHS[granularity] * settings.STATS_DEFAULT_PERIODS
+        if (date_to - date_from) / PERIOD_LENGTHS[granularity] > settings.STATS_MAX_PERIODS:
+            raise ValueError(f"Intervalle trop long pour la granularité {granularity}")
+
+        query: Dict[str, Any] = {
+            "client_id": client_id,
+            "granularity": granularity,
+            "period": {"$gte": period_start(date_from, granularity), "$lt": date_to},
+        }
+        if chatbot_id is not None:
+            query["chatbot_id"] = chatbot_id
+        documents = await stats_rollups_collection.find(query, {"_id": 0}).to_list(None)
+
+        totals: Dict[str, float] = defaultdict(float)
+        series: Dict[datetime, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        by_llm: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        by_chatbot: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        for document in documents:
+            targets = [totals, series[document["period"]], by_chatbot[document["chatbot_id"]]]
+            if document["llm"]:
+                targets.append(by_llm[document["llm"]])
+            for field in COUNTERS + ("cost",):
+                value = document.get(field, 0)
+                for target in targets:
+                    target[field] += value
+
+        return {
+            "granularity": granularity,
+            "date_from": date_from,
+            "date_to": date_to,
+            "totals": self._finalize(totals),
+            "series": [dict(self._finalize(values), period=period) for period, values in sorted(series.items())],
+            "by_llm": {llm: self._finalize(values) for llm, values in by_llm.items()},
+            "by_chatbot": {chatbot: self._finalize(values) for chatbot, values in by_chatbot.items()},
+        }
+
+    @staticmethod
+    def _finalize(values: Dict[str, float]) -> Dict[str, Any]:
+        """Remplace les sommes de temps de réponse par leur moyenne"""
+        count = values.get("response_time_count", 0)
+        result = {field: int(values.get(field, 0)) for field in COUNTERS[:5]}
+        result["cost"] = round(values.get("cost", 0.0), 6)
+        result["avg_response_time"] = values.get("response_time_sum", 0.0) / count if count else None
+        return result
+
+    async def _run(self) -> None:
+        """Écrit périodiquement les compteurs en attente"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                # Une écriture interrompue perdrait les compteurs déjà retirés de la file
+                self._writing = asyncio.ensure_future(self.flush())
+                await asyncio.shield(self._writing)
+            except Exception as e:
+                logger.error(f"Erreur lors de l'écriture des statistiques: {str(e)}")
+
+# Instance partagée des statistiques pré-agrégées
+stats_rollups = StatsRollups()
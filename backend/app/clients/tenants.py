@@ -0,0 +1,240 @@
+"""
+Cache de la configuration des clients et de leurs chatbots
+
+Chaque message de chat a besoin du document du client (statut, quota) et de celui
+de son chatbot (instructions, LLM, couleurs). Ces documents sont chargés une seule
+fois puis servis depuis la mémoire.
+
+Les modifications faites depuis l'interface d'administration, quel que soit le
+worker qui les écrit, sont propagées par les change streams MongoDB. Lorsque ceux-ci
+ne sont pas disponibles (serveur MongoDB autonome, hors replica set), les
+collections sont interrogées chaque seconde sur leur champ updated_at, qui sert de
+compteur de version. La durée de vie des entrées borne dans tous les cas la
+période pendant laquelle une configuration obsolète peut être servie.
+
+Les client_id inconnus ou inactifs sont mis en cache à part, avec une durée de vie
+courte : des identifiants invalides ne peuvent pas évincer les clients réels.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo.errors import OperationFailure
+
+from app.config import settings
+from app.conversations.llm.cache import response_cache
+from app.utils.cache import LRUCache
+from app.utils.db import chatbots_collection, clients_collection, db
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+Tenant = Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]
+
+class TenantCache:
+    """
+    Cache en mémoire des couples (client, chatbot actif) par client_id
+    """
+
+    def __init__(self, maxsize: int = settings.TENANT_CACHE_SIZE, ttl: float = settings.TENANT_CACHE_TTL,
+                 poll_interval: float = settings.TENANT_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._entries = LRUCache(maxsize=maxsize, ttl=ttl, on_evict=self._forget)
+        self._missing = LRUCache(maxsize=settings.TENANT_MISSING_CACHE_SIZE, ttl=settings.TENANT_MISSING_CACHE_TTL)
+        self._loading: Dict[str, asyncio.Future] = {}
+        # Client propriétaire de chaque document en cache, pour traiter les suppressions
+        self._owners: Dict[Any, str] = {}
+        self._generation = 0
+        self._task: Optional[asyncio.Task] = None
+        self.mode = "stopped"
+
+    async def get(self, client_id: str) -> Tenant:
+        """
+        Retourne le client et son chatbot actif
+
+        Les chargements concurrents d'un même client sont regroupés en une seule
+        lecture MongoDB.
+
+        Args:
+            client_id: Identifiant du client
+
+        Returns:
+            Tuple (document du client, document du chatbot), chacun à None s'il est
+            introuvable ou inactif
+        """
+        tenant = self._entries.get(client_id)
+        if tenant is not None:
+            return tenant
+        if client_id in self._missing:
+            return None, None
+
+        future = self._loading.get(client_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._loading[client_id] = future
+            generation = self._generation
+            try:
+                tenant = await self._load(client_id)
+            except BaseException as e:
+                # Les requêtes en attente sont libérées même si ce chargement est annulé
+                if isinstance(e, Exception):
+                    future.set_exception(e)
+                    # Évite l'avertissement "exception never retrieved" sans requête en attente
+                    future.exception()
+                else:
+                    future.cancel()
+                raise
+            finally:
+                self._loading.pop(client_id, None)
+            # Une invalidation pendant le chargement rend le résultat potentiellement obsolète
+            if generation == self._generation:
+                self._store(client_id, tenant)
+            future.set_result(tenant)
+            return tenant
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Chargement annulé avec la requête qui le menait : nouvelle tentative
+            if future.cancelled():
+                return await self.get(client_id)
+            raise
+
+    def invalidate(self, client_id: str) -> None:
+        """
+        Retire la configuration d'un client du cache
+
+        Args:
+            client_id: Identifiant du client
+        """
+        self._generation += 1
+        self._missing.pop(client_id)
+        tenant = self._entries.pop(client_id)
+        if tenant is not None:
+            self._forget(client_id, tenant)
+        response_cache.invalidate_chatbot(client_id)
+
+    def clear(self) -> None:
+        """Vide le cache (par exemple après une interruption du suivi des modifications)"""
+        self._generation += 1
+        self._entries.clear()
+        self._missing.clear()
+        self._owners.clear()
+
+    async def start(self) -> None:
+        """Démarre le suivi des modifications"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Arrête le suivi des modifications"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.mode = "stopped"
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Retourne les statistiques du cache
+
+        Returns:
+            Nombre d'entrées, succès, échecs et mode de suivi des modifications
+        """
+        return {
+            "entries": len(self._entries),
+            "missing": len(self._missing),
+            "hits": self._entries.hits,
+            "misses": self._entries.misses,
+            "mode": self.mode,
+        }
+
+    async def _load(self, client_id: str) -> Tenant:
+        """Lit le client et son chatbot actif dans MongoDB"""
+        client = await clients_collection.find_one({"client_id": client_id})
+        if not client or not client.get("active", True):
+            return None, None
+        chatbot = await chatbots_collection.find_one({"client_id": client_id, "active": {"$ne": False}})
+        return client, chatbot
+
+    def _store(self, client_id: str, tenant: Tenant) -> None:
+        """Met en cache un client chargé et enregistre le propriétaire de ses documents"""
+        if tenant[0] is None:
+            self._missing.set(client_id, True)
+            return
+        self._entries.set(client_id, tenant)
+        for document in tenant:
+            if document is not None:
+                self._owners[document["_id"]] = client_id
+
+    def _forget(self, client_id: str, tenant: Tenant) -> None:
+        """Oublie le propriétaire des documents d'un client retiré du cache"""
+        for document in tenant:
+            if document is not None and self._owners.get(document["_id"]) == client_id:
+                del self._owners[document["_id"]]
+
+    def _on_change(self, document_id: Any, document: Optional[Dict[str, Any]]) -> None:
+        """Invalide le client concerné par la modification d'un document"""
+        client_id = (document or {}).get("client_id") or self._owners.get(document_id)
+        if client_id:
+            self.invalidate(client_id)
+
+    async def _run(self) -> None:
+        """Suit les modifications par change streams, ou par interrogation périodique à défaut"""
+        use_change_streams = True
+        while True:
+            try:
+                if use_change_streams:
+                    await self._watch()
+                else:
+                    await self._poll()
+            except Exception as e:
+                if use_change_streams and isinstance(e, OperationFailure):
+                    logger.info(f"Change streams indisponibles ({str(e)}), suivi des modifications par interrogation")
+                    use_change_streams = False
+                    continue
+                logger.error(f"Erreur lors du suivi des modifications des clients: {str(e)}")
+                # Des modifications ont pu être manquées pendant l'interruption
+                self.clear()
+                await asyncio.sleep(self.poll_interval)
+
+    async def _watch(self) -> None:
+        """Applique les modifications reçues par change stream"""
+        pipeline = [{"$match": {"ns.coll": {"$in": [clients_collection.name, chatbots_collection.name]}}}]
+        async with db.watch(pipeline, full_document="updateLookup") as stream:
+            self.mode = "change_stream"
+            self.clear()
+            async for change in stream:
+                document_key = change.get("documentKey") or {}
+                self._on_change(document_key.get("_id"), change.get("fullDocument"))
+
+    async def _poll(self) -> None:
+        """Applique les modifications détectées sur le champ updated_at des collections"""
+        self.mode = "polling"
+        # Le plus récent updated_at vu sert de version : seule l'horloge de MongoDB fait foi.
+        # Les documents déjà traités à cette version sont mémorisés pour ne pas les invalider en boucle.
+        versions: Dict[str, Tuple[datetime, set]] = {}
+        for collection in (clients_collection, chatbots_collection):
+            latest = await collection.find_one({"updated_at": {"$ne": None}}, {"updated_at": 1}, sort=[("updated_at", -1)])
+            if latest:
+                versions[collection.name] = (latest["updated_at"], {latest["_id"]})
+            else:
+                versions[collection.name] = (datetime.utcnow() - timedelta(seconds=1), set())
+        self.clear()
+
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            for collection in (clients_collection, chatbots_collection):
+                version, seen = versions[collection.name]
+                cursor = collection.find({"updated_at": {"$gte": version}}, {"client_id": 1, "updated_at": 1})
+                async for document in cursor:
+                    if document["updated_at"] == version and document["_id"] in seen:
+                        continue
+                    self._on_change(document["_id"], document)
+                    if document["updated_at"] > version:
+                        version, seen = document["updated_at"], set()
+                    seen.add(document["_id"])
+                versions[collection.name] = (version, seen)
+
+# Instance partagée du cache des clients
+tenant_cache = TenantCache()
@@ -2,7 +2,7 @@
 Configuration de l'application IAfluence
 """
 import os
-from typing import List
+from typing import Dict, List
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -13,11 +13,16 @@ class Settings(BaseSettings):
     APP_NAME: str = "IAfluence"
     DEBUG: bool = os.getenv("DEBUG", "False").lower() == "true"
     API_PREFIX: str = "/api"
+    PUBLIC_URL: str = os.getenv("PUBLIC_URL", "")  # URL publique de l'API (à défaut, déduite de la requête)
     
     # Paramètres de sécurité
     SECRET_KEY: str = os.getenv("SECRET_KEY", "iafluence_secret_key_change_in_production")
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24  # 24 heures
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+    PASSWORD_HASH_MAX_QUEUE: int = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+    AUTH_CACHE_SIZE: int = 1000
+    AUTH_USER_CACHE_TTL: int = 60  # Secondes
     
     # Paramètres CORS
     CORS_ORIGINS: List[str] = [
@@ -31,12 +36,70 @@ class Settings(BaseSettings):
     # Paramètres MongoDB
     MONGODB_URL: str = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
     MONGODB_DB_NAME: str = os.getenv("MONGODB_DB_NAME", "iafluence")
+    MONGODB_MAX_POOL_SIZE: int = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))  # Par serveur et par client
+    MONGODB_MIN_POOL_SIZE: int = int(os.getenv("MONGODB_MIN_POOL_SIZE", "0"))
+    MONGODB_MAX_IDLE_TIME_MS: int = 5 * 60 * 1000
+    MONGODB_MAX_CONNECTING: int = 2  # Ouvertures de connexions simultanées
+    MONGODB_WAIT_QUEUE_TIMEOUT_MS: int = 5000  # Attente maximale d'une connexion libre
+    MONGODB_CONNECT_TIMEOUT_MS: int = 10000
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS: int = 10000
+    MONGODB_COMPRESSORS: str = os.getenv("MONGODB_COMPRESSORS", "zstd,snappy,zlib")  # Par ordre de préférence
+    TENANT_DB_CACHE_SIZE: int = 1000  # Références aux bases des clients conservées
     
     # Paramètres LLM
     DEFAULT_LLM: str = "gpt-4"
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
     ANTHROPIC_API_KEY: str = os.getenv("ANTHROPIC_API_KEY", "")
     OLLAMA_API_URL: str = os.getenv("OLLAMA_API_URL", "http://localhost:11434")
+    OPENAI_API_URL: str = os.getenv("OPENAI_API_URL", "https://api.openai.com/v1")
+    ANTHROPIC_API_URL: str = os.getenv("ANTHROPIC_API_URL", "https://api.anthropic.com/v1")
+    LLM_TIMEOUT: float = float(os.getenv("LLM_TIMEOUT", "60"))
+    LLM_PROVIDER_TIMEOUTS: Dict[str, float] = {"openai": 60.0, "anthropic": 60.0, "ollama": 120.0}
+    LLM_CONNECT_TIMEOUT: float = 5.0
+    LLM_MAX_CONNECTIONS: int = 100  # Par fournisseur
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    LLM_BREAKER_FAILURES: int = 5  # Échecs consécutifs avant ouverture du disjoncteur
+    LLM_BREAKER_RESET_TIMEOUT: float = 30.0  # Secondes avant un nouvel essai
+    LLM_HEDGING: bool = os.getenv("LLM_HEDGING", "True").lower() == "true"
+    LLM_HEDGE_PERCENTILE: float = 95.0  # Délai avant requête de secours : centile du délai du premier fragment
+    LLM_HEDGE_MIN_SAMPLES: int = 20
+    LLM_HEDGE_DEFAULT_DELAY: float = 3.0  # Secondes, tant que les mesures sont insuffisantes
+    LLM_HEDGE_MIN_DELAY: float = 0.5
+    LLM_HEDGE_MAX_DELAY: float = 10.0
+    LLM_COALESCING: bool = os.getenv("LLM_COALESCING", "True").lower() == "true"  # Partage des requêtes identiques en cours
+    LLM_COST_PER_1K_TOKENS: Dict[str, float] = {}  # Tarifs par défaut, complétés par la collection llms
+    LLM_PRICES_TTL: float = 5 * 60  # Relecture des tarifs (secondes)
+    LLM_MAX_TOKENS: int = 1024
+    LLM_TEMPERATURE: float = 0.7
+    
+    # Paramètres de l'historique des sessions
+    SESSION_CACHE_SIZE: int = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+    SESSION_CACHE_TTL: int = 30 * 60  # 30 minutes
+    SESSION_HISTORY_MAX_MESSAGES: int = 50
+    CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))  # Budget par défaut, modifiable par chatbot
+    CONTEXT_SUMMARY_MAX_TOKENS: int = 300
+    CONVERSATION_BUCKET_SIZE: int = 50  # Messages par compartiment de conversation
+    SEARCH_MAX_MATCHES: int = 10000  # Résultats pris en compte pour le total et les facettes
+    SEARCH_FACET_SIZE: int = 20  # Valeurs par facette
+    SEARCH_TIMEOUT_MS: int = 2000  # Durée maximale d'une recherche côté MongoDB
+    INGEST_FLUSH_INTERVAL: float = 0.2  # Écriture différée des messages de conversation (secondes)
+    INGEST_BATCH_SIZE: int = 500  # Messages en attente déclenchant une écriture immédiate
+    INGEST_MAX_PENDING: int = 10000  # Au-delà, les nouveaux messages attendent une écriture
+    INGEST_BACKPRESSURE_TIMEOUT: float = 1.0  # Attente maximale avant passage au fichier de débordement (secondes)
+    INGEST_SPILL_PATH: str = os.getenv("INGEST_SPILL_PATH", "data/conversation_spill.jsonl")
+    
+    # Paramètres du transport WebSocket du widget
+    WS_HEARTBEAT_INTERVAL: float = 25.0  # Battements de cœur envoyés par le widget (secondes)
+    WS_IDLE_TIMEOUT: float = 60.0  # Fermeture d'une connexion sans trame (secondes)
+    
+    # Paramètres du cache de réponses
+    RESPONSE_CACHE_SIZE: int = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))
+    RESPONSE_CACHE_TTL: int = 24 * 60 * 60  # 24 heures
+    RESPONSE_CACHE_SEMANTIC: bool = os.getenv("RESPONSE_CACHE_SEMANTIC", "False").lower() == "true"
+    RESPONSE_CACHE_SEMANTIC_SIZE: int = 200  # Entrées sémantiques par chatbot
+    RESPONSE_CACHE_SEMANTIC_MAX_MB: int = 64  # Embeddings conservés, tous chatbots confondus (float32)
+    RESPONSE_CACHE_SIMILARITY: float = 0.92
+    RESPONSE_CACHE_EMBEDDING_MODEL: str = "text-embedding-3-small"
     
     # Paramètres email
     SMTP_SERVER: str = os.getenv("SMTP_SERVER", "smtp.gmail.com")
@@ -45,9 +108,65 @@ class Settings(BaseSettings):
     SMTP_PASSWORD: str = os.getenv("SMTP_PASSWORD", "")
     EMAIL_FROM: str = os.getenv("EMAIL_FROM", "noreply@iafluence.fr")
     ADMIN_EMAIL: str = os.getenv("ADMIN_EMAIL", "suan.tay@iafluence.fr")
+    SMTP_STARTTLS: bool = os.getenv("SMTP_STARTTLS", "True").lower() == "true"
+    SMTP_TIMEOUT: float = 30.0
+    SMTP_IDLE_TIMEOUT: float = 60.0  # Fermeture de la connexion SMTP inutilisée (secondes)
+    EMAIL_QUEUE_SIZE: int = 1000
+    EMAIL_BATCH_SIZE: int = 20
+    EMAIL_MAX_ATTEMPTS: int = 5
+    EMAIL_RETRY_BASE_DELAY: int = 30  # Secondes, doublé à chaque tentative
+    EMAIL_SWEEP_INTERVAL: int = 30  # Secondes
+    EMAIL_CLAIM_TIMEOUT: int = 10 * 60  # Reprise des emails bloqués en cours d'envoi (secondes)
     
     # Paramètres de quota
     DEFAULT_MONTHLY_QUOTA: int = 1000  # Nombre de requêtes par mois
+    QUOTA_ALERT_THRESHOLDS: List[int] = [80, 100, 120]  # Pourcentages du quota mensuel
+    QUOTA_ALERT_DIGEST_INTERVAL: int = 60  # Regroupement des alertes (secondes)
+    QUOTA_FLUSH_INTERVAL: float = 5.0  # Écriture différée des compteurs dans llm_usage (secondes)
+    
+    # Paramètres des statistiques pré-agrégées
+    STATS_FLUSH_INTERVAL: float = 10.0  # Écriture différée des compteurs (secondes)
+    STATS_DEFAULT_PERIODS: int = 30  # Périodes couvertes par défaut
+    STATS_MAX_PERIODS: int = 1000  # Périodes maximales par requête
+    
+    # Paramètres du widget
+    WIDGET_DIR: str = os.getenv("WIDGET_DIR", "widgets")
+    WIDGET_LOADER_MAX_AGE: int = 5 * 60  # Mise en cache du chargeur avant revalidation (secondes)
+    WIDGET_ASSET_HISTORY_DIR: str = os.getenv("WIDGET_ASSET_HISTORY_DIR", "data/widget_assets")  # Versions publiées du widget
+    WIDGET_ASSET_VERSIONS: int = 3  # Versions précédentes du widget encore servies
+    WIDGET_CONFIG_MAX_AGE: int = 60  # Mise en cache de la configuration des chatbots (secondes)
+    WIDGET_CONFIG_STALE: int = 10 * 60  # Configuration servie pendant sa revalidation (secondes)
+    WIDGET_CONFIG_CACHE_SIZE: int = 10000
+    WIDGET_ARTIFACT_DIR: str = os.getenv("WIDGET_ARTIFACT_DIR", "data/widget_artifacts")  # Snippets et plugins générés
+    WIDGET_ARTIFACT_CACHE_MB: int = 100
+    PREVIEW_CACHE_SIZE: int = 1000  # Pages de prévisualisation rendues conservées en mémoire
+    
+    # Paramètres des exports
+    EXPORT_DIR: str = os.getenv("EXPORT_DIR", "data/exports")  # Partagé par toutes les instances de l'API
+    EXPORT_SESSION_BATCH: int = 100  # Conversations lues par lot
+    EXPORT_CHUNK_SIZE: int = 64 * 1024  # Taille des blocs envoyés (octets avant compression)
+    EXPORT_MAX_JOBS: int = 2  # Exports en tâche de fond simultanés
+    EXPORT_TTL: int = 24 * 60 * 60  # Conservation des fichiers exportés (secondes)
+    EXPORT_SWEEP_INTERVAL: int = 60 * 60  # Suppression des exports expirés (secondes)
+    EXPORT_HEARTBEAT_INTERVAL: int = 30  # Signal de vie des exports en cours (secondes)
+    EXPORT_STALE_AFTER: int = 5 * 60  # Export sans signal de vie considéré comme interrompu (secondes)
+    
+    # Paramètres du cache de configuration des clients
+    TENANT_CACHE_SIZE: int = 10000
+    TENANT_CACHE_TTL: int = 5 * 60  # Secondes
+    TENANT_MISSING_CACHE_SIZE: int = 1000  # client_id inconnus ou inactifs, en cache séparé
+    TENANT_MISSING_CACHE_TTL: int = 30  # Secondes
+    TENANT_POLL_INTERVAL: float = 1.0  # Sans change streams (secondes)
+    
+    # Paramètres de la sandbox (code personnalisé des chatbots)
+    SANDBOX_WORKERS: int = int(os.getenv("SANDBOX_WORKERS", "2"))
+    SANDBOX_TIMEOUT: float = 2.0  # Délai maximal d'un appel, au-delà duquel le processus est remplacé (secondes)
+    SANDBOX_CPU_LIMIT: float = 1.0  # Temps CPU par appel (secondes, arrondi à la seconde supérieure)
+    SANDBOX_MEMORY_LIMIT_MB: int = 256  # Mémoire maximale par processus
+    
+    # Paramètres de supervision
+    EVENT_LOOP_LAG_INTERVAL: float = 0.5  # Échantillonnage du retard de la boucle d'événements (secondes)
+    READINESS_TIMEOUT: float = 2.0  # Délai maximal du ping MongoDB de /ready (secondes)
     
     # Paramètres d'administration
     ADMIN_USERNAME: str = os.getenv("ADMIN_USERNAME", "suan.tay@iafluence.fr")
@@ -0,0 +1,422 @@
+"""
+Export des conversations en NDJSON ou CSV
+
+Les messages sont lus au fil d'un curseur MongoDB et encodés par blocs : la
+mémoire utilisée ne dépend pas du volume exporté. Les conversations d'un client
+sont parcourues par ordre de session_id, leurs compartiments étant lus dans le
+même ordre par lots de EXPORT_SESSION_BATCH sessions.
+
+Chaque ligne exportée porte un curseur (`cursor`) : un export interrompu reprend
+à la ligne suivante en passant le dernier curseur reçu en paramètre `after`.
+
+Les exports volumineux peuvent être confiés à une tâche de fond qui écrit le
+fichier dans EXPORT_DIR ; son état est conservé dans la collection export_jobs
+et le fichier est supprimé après EXPORT_TTL secondes. Le téléchargement pouvant
+être servi par une autre instance que celle qui a écrit le fichier, EXPORT_DIR
+doit être un répertoire partagé par toutes les instances de l'API.
+
+L'instance qui exécute un export en renouvelle le signal de vie (`heartbeat_at`)
+toutes les EXPORT_HEARTBEAT_INTERVAL secondes. Un export en attente ou en cours
+dont le signal de vie a plus de EXPORT_STALE_AFTER secondes a été interrompu par
+l'arrêt de son instance : il est marqué en échec au démarrage et périodiquement.
+"""
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Tuple
+
+from app.config import settings
+from app.utils.db import conversation_buckets_collection, conversations_collection, export_jobs_collection
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+COLUMNS = ("session_id", "chatbot_id", "position", "message_id", "timestamp", "sender",
+           "content", "llm_used", "response_time", "tags", "cursor")
+
+class ExportError(Exception):
+    """Erreur levée lorsqu'un export ne peut pas être réalisé"""
+
+def encode_cursor(session_id: str, position: int) -> str:
+    """
+    Construit le curseur de reprise d'une ligne exportée
+
+    Args:
+        session_id: Identifiant de session
+        position: Position du message dans la conversation
+
+    Returns:
+        Le curseur
+    """
+    return f"{position}.{session_id}"
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """
+    Décode un curseur de reprise
+
+    Args:
+        cursor: Curseur d'une ligne exportée
+
+    Returns:
+        Tuple (identifiant de session, position du dernier message exporté)
+
+    Raises:
+        ExportError: Si le curseur est invalide
+    """
+    try:
+        position, session_id = cursor.split(".", 1)
+        return session_id, int(position)
+    except ValueError:
+        raise ExportError("Curseur de reprise invalide")
+
+async def export_rows(client_id: str, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                      chatbot_id: Optional[str] = None, after: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Parcourt les messages des conversations d'un client
+
+    Args:
+        client_id: Identifiant du client
+        date_from: Date minimale des messages
+        date_to: Date maximale des messages (exclue)
+        chatbot_id: Limite l'export à un chatbot
+        after: Curseur de la dernière ligne déjà reçue
+
+    Yields:
+        Une ligne par message, par session puis par position
+
+    Raises:
+        ExportError: Si le curseur de reprise est invalide
+    """
+    query: Dict[str, Any] = {"client_id": client_id}
+    if chatbot_id:
+        query["chatbot_id"] = chatbot_id
+    if date_from:
+        query["updated_at"] = {"$gte": date_from}
+    if date_to:
+        query["timestamp"] = {"$lt": date_to}
+    resume_session, resume_position = decode_cursor(after) if after else (None, -1)
+    if resume_session is not None:
+        query["session_id"] = {"$gte": resume_session}
+
+    cursor = conversations_collection.find(query, {"session_id": 1, "chatbot_id": 1}) \
+        .sort("session_id", 1) \
+        .batch_size(settings.EXPORT_SESSION_BATCH)
+    headers: Dict[str, Dict[str, Any]] = {}
+    async for header in cursor:
+        headers[header["session_id"]] = header
+        if len(headers) >= settings.EXPORT_SESSION_BATCH:
+            async for row in _session_rows(client_id, headers, date_from, date_to, resume_session, resume_position):
+                yield row
+            headers = {}
+    if headers:
+        async for row in _session_rows(client_id, headers, date_from, date_to, resume_session, resume_position):
+            yield row
+
+async def _session_rows(client_id: str, headers: Dict[str, Dict[str, Any]], date_from: Optional[datetime],
+                        date_to: Optional[datetime], resume_session: Optional[str],
+                        resume_position: int) -> AsyncIterator[Dict[str, Any]]:
+    """Produit les lignes d'un lot de conversations, compartiment par compartiment"""
+    bucket_query: Dict[str, Any] = {"session_id": {"$in": list(headers)}, "client_id": client_id}
+    if date_from:
+        bucket_query["last_timestamp"] = {"$gte": date_from}
+    if date_to:
+        bucket_query["first_timestamp"] = {"$lt": date_to}
+
+    async for bucket in conversation_buckets_collection.find(bucket_query).sort([("session_id", 1), ("seq", 1)]):
+        session_id = bucket["session_id"]
+        skip_until = resume_position if session_id == resume_session else -1
+        for message in bucket["messages"]:
+            if message["position"] <= skip_until:
+                continue
+            if (date_from and message["timestamp"] < date_from) or (date_to and message["timestamp"] >= date_to):
+                continue
+            yield {
+                "session_id": session_id,
+                "chatbot_id": headers[session_id].get("chatbot_id"),
+                "position": message["position"],
+                "message_id": message["id"],
+                "timestamp": message["timestamp"],
+                "sender": message["sender"],
+                "content": message["content"],
+                "llm_used": message.get("llm_used"),
+                "response_time": message.get("response_time"),
+                "tags": message.get("tags", []),
+                "cursor": encode_cursor(session_id, message["position"]),
+            }
+
+class RowEncoder:
+    """
+    Encodage de lignes en NDJSON ou CSV, compressé ou non, par blocs d'octets
+    """
+
+    def __init__(self, format: str = "ndjson", gzip: bool = False, columns: Iterable[str] = COLUMNS):
+        if format not in FORMATS:
+            raise ExportError(f"Format d'export inconnu: {format}")
+        self.format = format
+        self.columns = tuple(columns)
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer) if format == "csv" else None
+        if self._writer is not None:
+            self._writer.writerow(self.columns)
+
+    def write(self, row: Dict[str, Any]) -> None:
+        """Ajoute une ligne au bloc en cours"""
+        if self._writer is not None:
+            self._writer.writerow([self._csv_value(row.get(column)) for column in self.columns])
+        else:
+            self._buffer.write(json.dumps(row, default=str, ensure_ascii=False))
+            self._buffer.write("\n")
+
+    def pending(self) -> int:
+        """Taille du bloc en cours (caractères)"""
+        return self._buffer.tell()
+
+    def take(self, final: bool = False) -> bytes:
+        """
+        Retire le bloc en cours
+
+        Args:
+            final: Termine le flux compressé
+
+        Returns:
+            Les octets du bloc (éventuellement vides en cours de compression)
+        """
+        data = self._buffer.getvalue().encode("utf-8")
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+            if final:
+                data += self._compressor.flush()
+        return data
+
+    @staticmethod
+    def _csv_value(value: Any) -> Any:
+        """Convertit une valeur pour une cellule CSV"""
+        if isinstance(value, list):
+            return ";".join(str(item) for item in value)
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return "" if value is None else value
+
+async def encode_rows(rows: AsyncIterator[Dict[str, Any]], encoder: RowEncoder) -> AsyncIterator[bytes]:
+    """
+    Encode des lignes par blocs d'environ EXPORT_CHUNK_SIZE octets
+
+    Args:
+        rows: Lignes à encoder
+        encoder: Encodeur (format et compression)
+
+    Yields:
+        Les blocs encodés
+    """
+    async for row in rows:
+        encoder.write(row)
+        if encoder.pending() >= settings.EXPORT_CHUNK_SIZE:
+            chunk = encoder.take()
+            if chunk:
+                yield chunk
+    chunk = encoder.take(final=True)
+    if chunk:
+        yield chunk
+
+def export_filename(client_id: str, format: str, gzip: bool) -> str:
+    """
+    Construit le nom du fichier d'un export
+
+    Args:
+        client_id: Identifiant du client
+        format: Format (ndjson ou csv)
+        gzip: Compression gzip
+
+    Returns:
+        Le nom du fichier
+    """
+    return f"conversations-{client_id}-{datetime.utcnow():%Y%m%d%H%M%S}.{format}{'.gz' if gzip else ''}"
+
+class ExportJobs:
+    """
+    Exports exécutés en tâche de fond et écrits dans des fichiers locaux
+    """
+
+    def __init__(self, directory: str = settings.EXPORT_DIR, max_jobs: int = settings.EXPORT_MAX_JOBS):
+        self.directory = directory
+        self._semaphore = asyncio.Semaphore(max_jobs)
+        # Exports de cette instance, par identifiant
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Marque en échec les exports interrompus, puis démarre le signal de vie et la suppression périodique"""
+        try:
+            await self._fail_stale()
+        except Exception as e:
+            logger.error(f"Erreur lors de la reprise des exports interrompus: {str(e)}")
+        self._heartbeat = asyncio.create_task(self._beat())
+        self._sweeper = asyncio.create_task(self._sweep())
+
+    async def stop(self) -> None:
+        """Interrompt les exports en cours, le signal de vie et la suppression périodique"""
+        tasks = list(self._tasks.values()) + [task for task in (self._heartbeat, self._sweeper) if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._heartbeat = self._sweeper = None
+
+    async def submit(self, client_id: str, format: str = "ndjson", gzip: bool = True,
+                     date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                     chatbot_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Enregistre un export et le démarre en tâche de fond
+
+        Args:
+            client_id: Identifiant du client
+            format: Format (ndjson ou csv)
+            gzip: Compression gzip
+            date_from: Date minimale des messages
+            date_to: Date maximale des messages (exclue)
+            chatbot_id: Limite l'export à un chatbot
+
+        Returns:
+            Le document de l'export (identifiant et statut)
+
+        Raises:
+            ExportError: Si le format est inconnu
+        """
+        encoder = RowEncoder(format, gzip)
+        job = {
+            "_id": uuid.uuid4().hex,
+            "client_id": client_id,
+            "status": "pending",
+            "filename": export_filename(client_id, format, gzip),
+            "media_type": "application/gzip" if gzip else FORMATS[format],
+            "rows": 0,
+            "created_at": datetime.utcnow(),
+            "heartbeat_at": datetime.utcnow(),
+        }
+        await export_jobs_collection.insert_one(job)
+        task = asyncio.create_task(self._run(job, encoder, date_from, date_to, chatbot_id))
+        self._tasks[job["_id"]] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job["_id"], None))
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Retourne l'état d'un export
+
+        Args:
+            job_id: Identifiant de l'export
+
+        Returns:
+            Le document de l'export, ou None s'il est inconnu
+        """
+        return await export_jobs_collection.find_one({"_id": job_id})
+
+    def path(self, job: Dict[str, Any]) -> str:
+        """
+        Retourne le chemin du fichier d'un export
+
+        Args:
+            job: Document de l'export
+
+        Returns:
+            Le chemin du fichier dans EXPORT_DIR
+        """
+        return os.path.join(self.directory, f"{job['_id']}-{job['filename']}")
+
+    async def _run(self, job: Dict[str, Any], encoder: RowEncoder, date_from: Optional[datetime],
+                   date_to: Optional[datetime], chatbot_id: Optional[str]) -> None:
+        """Écrit un export dans son fichier, bloc par bloc"""
+        loop = asyncio.get_running_loop()
+        path = self.path(job)
+        async with self._semaphore:
+            await export_jobs_collection.update_one({"_id": job["_id"]}, {"$set": {"status": "running"}})
+            rows = 0
+
+            async def counted() -> AsyncIterator[Dict[str, Any]]:
+                nonlocal rows
+                async for row in export_rows(job["client_id"], date_from, date_to, chatbot_id):
+                    rows += 1
+                    yield row
+
+            try:
+                await loop.run_in_executor(None, lambda: os.makedirs(self.directory, exist_ok=True))
+                output = await loop.run_in_executor(None, open, path + ".part", "wb")
+                try:
+                    async for chunk in encode_rows(counted(), encoder):
+                        await loop.run_in_executor(None, output.write, chunk)
+                finally:
+                    await loop.run_in_executor(None, output.close)
+                await loop.run_in_executor(None, os.replace, path + ".part", path)
+                await export_jobs_collection.update_one(
+                    {"_id": job["_id"]},
+                    {"$set": {"status": "done", "rows": rows, "size": os.path.getsize(path),
+                              "completed_at": datetime.utcnow()}}
+                )
+                logger.info(f"Export {job['_id']} terminé: {rows} ligne(s)")
+            except BaseException as e:
+                logger.error(f"Échec de l'export {job['_id']}: {str(e) or type(e).__name__}")
+                await asyncio.shield(export_jobs_collection.update_one(
+                    {"_id": job["_id"]},
+                    {"$set": {"status": "failed", "rows": rows, "error": str(e) or type(e).__name__}}
+                ))
+                if os.path.exists(path + ".part"):
+                    os.remove(path + ".part")
+                if not isinstance(e, Exception):
+                    raise
+
+    async def _fail_stale(self) -> int:
+        """Marque en échec les exports d'autres instances (ou d'un précédent démarrage) sans signal de vie récent"""
+        stale = datetime.utcnow() - timedelta(seconds=settings.EXPORT_STALE_AFTER)
+        result = await export_jobs_collection.update_many(
+            {"_id": {"$nin": list(self._tasks)}, "status": {"$in": ["pending", "running"]},
+             "heartbeat_at": {"$lt": stale}},
+            {"$set": {"status": "failed", "error": "Export interrompu par l'arrêt du serveur"}}
+        )
+        if result.modified_count:
+            logger.warning(f"{result.modified_count} export(s) interrompu(s) marqué(s) en échec")
+        return result.modified_count
+
+    async def _beat(self) -> None:
+        """Renouvelle le signal de vie des exports de cette instance et marque en échec les exports interrompus"""
+        while True:
+            await asyncio.sleep(settings.EXPORT_HEARTBEAT_INTERVAL)
+            try:
+                if self._tasks:
+                    await export_jobs_collection.update_many(
+                        {"_id": {"$in": list(self._tasks)}, "status": {"$in": ["pending", "running"]}},
+                        {"$set": {"heartbeat_at": datetime.utcnow()}}
+                    )
+                await self._fail_stale()
+            except Exception as e:
+                logger.error(f"Erreur lors du signal de vie des exports: {str(e)}")
+
+    async def _sweep(self) -> None:
+        """Supprime périodiquement les exports expirés et leurs fichiers"""
+        while True:
+            try:
+                expired = datetime.utcnow() - timedelta(seconds=settings.EXPORT_TTL)
+                async for job in export_jobs_collection.find({"created_at": {"$lt": expired}}):
+                    path = self.path(job)
+                    # Fichier terminé, ou partiel si l'export a été interrompu
+                    for leftover in (path, path + ".part"):
+                        if os.path.exists(leftover):
+                            os.remove(leftover)
+                    await export_jobs_collection.delete_one({"_id": job["_id"]})
+            except Exception as e:
+                logger.error(f"Erreur lors de la suppression des exports expirés: {str(e)}")
+            await asyncio.sleep(settings.EXPORT_SWEEP_INTERVAL)
+
+# Instance partagée des exports en tâche de fond
+export_jobs = ExportJobs()
@@ -0,0 +1,84 @@
+"""
+Historique des conversations conservé côté serveur
+"""
+import logging
+from typing import Any, Dict, List, Optional
+
+from app.config import settings
+from app.conversations.ingest import message_ingestor
+from app.conversations.storage import conversation_store
+from app.utils.cache import LRUCache
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class SessionHistoryStore:
+    """
+    Historique des sessions de chat, indexé par session_id
+
+    Les derniers messages de chaque session sont conservés dans un cache LRU en
+    mémoire ; MongoDB (compartiments de messages) reste la source de vérité et
+    n'est interrogée qu'en cas d'absence dans le cache ou de désynchronisation.
+    Les messages pas encore écrits par l'écriture différée y sont ajoutés.
+    """
+
+    def __init__(self, maxsize: int = settings.SESSION_CACHE_SIZE, ttl: float = settings.SESSION_CACHE_TTL,
+                 max_messages: int = settings.SESSION_HISTORY_MAX_MESSAGES):
+        self.max_messages = max_messages
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, client_id: str, session_id: str, last_message_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Récupère les derniers messages d'une session
+
+        Args:
+            client_id: Identifiant du client propriétaire de la session
+            session_id: Identifiant de session
+            last_message_id: Dernier message connu du widget ; s'il diffère du dernier
+                message en cache, l'historique est rechargé depuis MongoDB
+
+        Returns:
+            Les derniers messages de la session, du plus ancien au plus récent
+        """
+        key = (client_id, session_id)
+        messages = self._cache.get(key)
+        if messages is not None and (not last_message_id or (messages and messages[-1]["id"] == last_message_id)):
+            return messages
+
+        messages = await conversation_store.latest(client_id, session_id, self.max_messages)
+        stored = {message["id"] for message in messages}
+        pending = [message for message in message_ingestor.pending(client_id, session_id) if message["id"] not in stored]
+        messages = (messages + pending)[-self.max_messages:]
+        self._cache.set(key, messages)
+        return messages
+
+    def append(self, client_id: str, session_id: str, *messages: Dict[str, Any]) -> None:
+        """
+        Ajoute des messages à l'historique en cache d'une session
+
+        Une session absente du cache n'est pas créée : elle sera rechargée
+        complètement depuis MongoDB au prochain accès.
+
+        Args:
+            client_id: Identifiant du client propriétaire de la session
+            session_id: Identifiant de session
+            *messages: Messages à ajouter
+        """
+        key = (client_id, session_id)
+        history = self._cache.get(key)
+        if history is not None:
+            self._cache.set(key, (history + list(messages))[-self.max_messages:])
+
+    def invalidate(self, client_id: str, session_id: str) -> None:
+        """
+        Retire une session du cache
+
+        Args:
+            client_id: Identifiant du client propriétaire de la session
+            session_id: Identifiant de session
+        """
+        self._cache.pop((client_id, session_id))
+
+# Instance partagée de l'historique des sessions
+history_store = SessionHistoryStore()
@@ -0,0 +1,326 @@
+"""
+Écriture différée des messages de conversation
+
+Les messages d'un échange ne sont plus écrits dans MongoDB avant la réponse au
+visiteur : ils sont placés dans une file en mémoire, regroupés par session, puis
+écrits par lots dans les compartiments de messages (voir
+app.conversations.storage, une seule écriture bulk_write par lot) toutes les
+INGEST_FLUSH_INTERVAL secondes ou dès que INGEST_BATCH_SIZE messages sont en
+attente, ainsi qu'à l'arrêt.
+
+Si MongoDB est lent ou indisponible :
+- au-delà de INGEST_MAX_PENDING messages en attente, les nouveaux messages
+  attendent qu'un lot soit écrit (au plus INGEST_BACKPRESSURE_TIMEOUT secondes) ;
+- les lots qui ne peuvent pas être écrits, et les messages qui ne trouvent pas de
+  place dans la file, sont ajoutés à un fichier de débordement (une ligne JSON
+  par session, synchronisée sur disque), rejoué dès que les écritures reprennent
+  et au démarrage.
+
+Le rejeu est idempotent : les messages déjà présents dans la conversation ne sont
+pas ajoutés une seconde fois.
+
+L'ordre des messages est conservé : une session écrite partiellement garde les
+positions déjà réservées, et tant que le fichier de débordement contient des
+messages d'une session sans position, ses nouveaux messages y sont ajoutés à leur
+suite plutôt que d'être écrits avant eux.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import json_util
+from app.config import settings
+from app.conversations.storage import conversation_store
+from app.utils.metrics import registry
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ingested_messages = registry.counter(
+    "conversation_messages_ingested_total", "Messages de conversation traités par l'écriture différée", ("outcome",))
+ingest_flush_duration = registry.histogram(
+    "conversation_ingest_flush_duration_seconds", "Durée des écritures par lots des messages de conversation")
+
+SessionKey = Tuple[str, str]
+
+class MessageIngestor:
+    """
+    File d'écriture différée des messages de conversation, regroupés par session
+    """
+
+    def __init__(self, interval: float = settings.INGEST_FLUSH_INTERVAL, batch_size: int = settings.INGEST_BATCH_SIZE,
+                 max_pending: int = settings.INGEST_MAX_PENDING, spill_path: str = settings.INGEST_SPILL_PATH):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.spill_path = spill_path
+        # Messages en attente puis en cours d'écriture, par (client_id, session_id)
+        self._sessions: Dict[SessionKey, Dict[str, Any]] = {}
+        self._flushing: Dict[SessionKey, Dict[str, Any]] = {}
+        # Sessions sans positions dans le fichier de débordement, par (client_id, session_id)
+        self._spilled: Dict[SessionKey, int] = {}
+        self._pending = 0
+        self._wakeup = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._spill_lock = asyncio.Lock()
+        self._replaying = False
+        self._task: Optional[asyncio.Task] = None
+        # Écriture périodique en cours, protégée de l'annulation de la tâche d'écriture
+        self._writing: Optional[asyncio.Task] = None
+        registry.gauge("conversation_ingest_pending", "Messages de conversation en attente d'écriture").set_function(
+            lambda: {(): float(self._pending)})
+
+    async def start(self) -> None:
+        """Rejoue le fichier de débordement puis démarre la tâche d'écriture"""
+        try:
+            await self._count_spilled()
+            await self._replay()
+        except Exception as e:
+            logger.error(f"Erreur lors du rejeu des messages en attente: {str(e)}")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Arrête la tâche d'écriture et écrit les messages restants"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._writing is not None:
+            await asyncio.gather(self._writing, return_exceptions=True)
+            self._writing = None
+        await self.flush()
+
+    async def submit(self, chatbot: Dict[str, Any], session_id: str, *messages: Dict[str, Any]) -> None:
+        """
+        Place des messages d'une session dans la file d'écriture
+
+        Ne fait qu'ajouter les messages en mémoire, sauf si la file est pleine.
+
+        Args:
+            chatbot: Document du chatbot
+            session_id: Identifiant de session
+            *messages: Messages à ajouter à la conversation
+        """
+        entry = {
+            "client_id": chatbot["client_id"],
+            "session_id": session_id,
+            "chatbot_id": str(chatbot["_id"]),
+            "messages": list(messages),
+            "updated_at": datetime.utcnow(),
+        }
+        key = (entry["client_id"], session_id)
+        if self._spilled.get(key):
+            # Messages antérieurs de la session en attente de rejeu : ceux-ci sont écrits après eux
+            await self._spill([entry])
+            return
+
+        if self._task is None:
+            # File non démarrée (scripts, tests) : écriture immédiate
+            failed = await conversation_store.append([entry])
+            if failed:
+                await self._spill(failed)
+            return
+
+        if self._pending >= self.max_pending:
+            self._wakeup.set()
+            self._drained.clear()
+            try:
+                await asyncio.wait_for(self._drained.wait(), timeout=settings.INGEST_BACKPRESSURE_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+            if self._pending >= self.max_pending:
+                # Les messages de la session déjà en file la précèdent dans le fichier de débordement
+                queued = self._sessions.pop(key, None)
+                if queued is not None:
+                    self._pending -= len(queued["messages"])
+                await self._spill([queued, entry] if queued is not None else [entry])
+                return
+
+        session = self._sessions.get(key)
+        if session is None:
+            self._sessions[key] = entry
+        else:
+            session["messages"].extend(entry["messages"])
+            session["updated_at"] = entry["updated_at"]
+        self._pending += len(messages)
+        if self._pending >= self.batch_size:
+            self._wakeup.set()
+
+    def pending(self, client_id: str, session_id: str) -> List[Dict[str, Any]]:
+        """
+        Retourne les messages d'une session qui ne sont pas encore écrits
+
+        Args:
+            client_id: Identifiant du client propriétaire de la session
+            session_id: Identifiant de session
+
+        Returns:
+            Les messages en attente ou en cours d'écriture, du plus ancien au plus récent
+        """
+        key = (client_id, session_id)
+        return [
+            message
+            for sessions in (self._flushing, self._sessions)
+            for message in sessions.get(key, {}).get("messages", [])
+        ]
+
+    async def flush(self) -> int:
+        """
+        Écrit les messages en attente, une mise à jour par session
+
+        Les sessions qui n'ont pas pu être écrites sont ajoutées au fichier de débordement.
+
+        Returns:
+            Nombre de messages écrits
+        """
+        async with self._lock:
+            self._flushing, self._sessions = self._sessions, {}
+            self._pending = 0
+            self._drained.set()
+            entries: List[Dict[str, Any]] = []
+            # Sessions dont des messages antérieurs ont été mis en débordement entre-temps : à leur suite
+            diverted: List[Dict[str, Any]] = []
+            for entry in self._flushing.values():
+                if self._spilled.get((entry["client_id"], entry["session_id"])):
+                    diverted.append(entry)
+                else:
+                    entries.append(entry)
+
+            failed: List[Dict[str, Any]] = []
+            if entries:
+                start = asyncio.get_running_loop().time()
+                try:
+                    failed = await conversation_store.append(entries)
+                    if failed:
+                        logger.error(f"Échec de l'écriture de {len(failed)} session(s) de conversation")
+                except Exception as e:
+                    failed = entries
+                    logger.error(f"Erreur lors de l'écriture des messages de conversation: {str(e)}")
+                finally:
+                    ingest_flush_duration.observe(asyncio.get_running_loop().time() - start)
+
+            try:
+                if diverted or failed:
+                    await self._spill(diverted + failed)
+            finally:
+                self._flushing = {}
+            written = sum(len(entry["messages"]) for entry in entries) - sum(len(entry["messages"]) for entry in failed)
+            ingested_messages.inc(written, outcome="written")
+
+        # Rejeu après une écriture réussie, ou pour les sessions qui attendent le leur
+        if (entries or self._spilled) and not failed and not self._replaying and os.path.exists(self.spill_path):
+            await self._replay()
+        return written
+
+    async def _spill(self, entries: List[Dict[str, Any]]) -> None:
+        """Ajoute des sessions au fichier de débordement et le synchronise sur disque"""
+        for entry in entries:
+            if not conversation_store.placed(entry):
+                key = (entry["client_id"], entry["session_id"])
+                self._spilled[key] = self._spilled.get(key, 0) + 1
+        lines = "".join(json_util.dumps(entry) + "\n" for entry in entries)
+
+        def write() -> None:
+            os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+            with open(self.spill_path, "a", encoding="utf-8") as spill:
+                spill.write(lines)
+                spill.flush()
+                os.fsync(spill.fileno())
+
+        async with self._spill_lock:
+            await asyncio.get_running_loop().run_in_executor(None, write)
+        ingested_messages.inc(sum(len(entry["messages"]) for entry in entries), outcome="spilled")
+        logger.warning(f"{len(entries)} session(s) de conversation mises en attente dans {self.spill_path}")
+
+    async def _replay(self) -> None:
+        """Rejoue le fichier de débordement ; les sessions non écrites y sont remises"""
+        replay_path = self.spill_path + ".replay"
+
+        def take() -> List[Dict[str, Any]]:
+            # Un fichier de rejeu restant provient d'un rejeu interrompu : il est traité en premier
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spill_path):
+                    return []
+                os.replace(self.spill_path, replay_path)
+            with open(replay_path, encoding="utf-8") as replay:
+                return [json_util.loads(line) for line in replay if line.strip()]
+
+        if self._replaying:
+            return
+        self._replaying = True
+        try:
+            loop = asyncio.get_running_loop()
+            async with self._spill_lock:
+                entries = await loop.run_in_executor(None, take)
+            if not entries:
+                return
+
+            replayed = 0
+            unplaced = [not conversation_store.placed(entry) for entry in entries]
+            for index, entry in enumerate(entries):
+                try:
+                    await conversation_store.append_once(entry)
+                except Exception as e:
+                    logger.error(f"Rejeu des messages de conversation interrompu: {str(e)}")
+                    for remaining, counted in zip(entries[index:], unplaced[index:]):
+                        if counted:
+                            self._unspill(remaining)
+                    await self._spill(entries[index:])
+                    break
+                if unplaced[index]:
+                    self._unspill(entry)
+                replayed += len(entry["messages"])
+            await loop.run_in_executor(None, os.remove, replay_path)
+        finally:
+            self._replaying = False
+        ingested_messages.inc(replayed, outcome="replayed")
+        logger.info(f"{replayed} message(s) de conversation rejoués depuis {self.spill_path}")
+
+    async def _count_spilled(self) -> None:
+        """Décompte les sessions sans positions laissées dans les fichiers de débordement par un arrêt"""
+        def read() -> List[Dict[str, Any]]:
+            entries = []
+            for path in (self.spill_path + ".replay", self.spill_path):
+                if os.path.exists(path):
+                    with open(path, encoding="utf-8") as spill:
+                        entries.extend(json_util.loads(line) for line in spill if line.strip())
+            return entries
+
+        async with self._spill_lock:
+            entries = await asyncio.get_running_loop().run_in_executor(None, read)
+        self._spilled = {}
+        for entry in entries:
+            if not conversation_store.placed(entry):
+                key = (entry["client_id"], entry["session_id"])
+                self._spilled[key] = self._spilled.get(key, 0) + 1
+
+    def _unspill(self, entry: Dict[str, Any]) -> None:
+        """Retire une session sans positions du décompte du fichier de débordement"""
+        key = (entry["client_id"], entry["session_id"])
+        count = self._spilled.get(key, 0) - 1
+        if count > 0:
+            self._spilled[key] = count
+        else:
+            self._spilled.pop(key, None)
+
+    async def _run(self) -> None:
+        """Écrit les messages toutes les `interval` secondes ou dès qu'un lot est complet"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                # Une écriture interrompue perdrait le lot déjà retiré de la file
+                self._writing = asyncio.ensure_future(self.flush())
+                await asyncio.shield(self._writing)
+            except Exception as e:
+                logger.error(f"Erreur lors de l'écriture des messages de conversation: {str(e)}")
+
+# Instance partagée de l'écriture différée des messages
+message_ingestor = MessageIngestor()
@@ -0,0 +1,237 @@
+"""
+Cache des réponses LLM par chatbot
+
+Deux niveaux sont disponibles :
+- correspondance exacte sur la question normalisée ;
+- similarité sémantique (optionnelle) sur les embeddings des questions.
+
+Les clés incluent une version de la configuration du chatbot (LLM et instructions
+personnalisées) : toute modification de celle-ci rend les anciennes entrées
+inaccessibles, qui sont ensuite évincées par expiration ou LRU.
+
+Les embeddings du niveau sémantique sont stockés en float32 (array) dans un LRU
+commun à tous les chatbots, borné à RESPONSE_CACHE_SEMANTIC_MAX_MB, et chaque
+chatbot conserve au plus RESPONSE_CACHE_SEMANTIC_SIZE entrées.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import re
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+from app.config import settings
+from app.conversations.llm.providers import LLMError, get_provider
+from app.utils.cache import LRUCache
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def normalize_question(question: str) -> str:
+    """
+    Normalise une question pour la recherche en cache
+
+    Args:
+        question: Question brute du visiteur
+
+    Returns:
+        La question en minuscules, sans espaces superflus ni ponctuation finale
+    """
+    question = unicodedata.normalize("NFKC", question).casefold()
+    question = re.sub(r"\s+", " ", question)
+    return question.strip(" ?!.;,")
+
+def config_version(chatbot: Dict[str, Any]) -> str:
+    """
+    Calcule la version de la configuration d'un chatbot ayant un impact sur les réponses
+
+    Args:
+        chatbot: Document du chatbot
+
+    Returns:
+        Empreinte du LLM par défaut et des instructions personnalisées
+    """
+    llm_name = chatbot.get("default_llm") or settings.DEFAULT_LLM
+    instructions = chatbot.get("custom_instructions") or ""
+    return hashlib.sha256(f"{llm_name}\x00{instructions}".encode()).hexdigest()[:16]
+
+class ResponseCache:
+    """
+    Cache des réponses LLM avec expiration, éviction LRU et statistiques
+    """
+
+    def __init__(self, maxsize: int = settings.RESPONSE_CACHE_SIZE, ttl: float = settings.RESPONSE_CACHE_TTL,
+                 semantic: bool = settings.RESPONSE_CACHE_SEMANTIC):
+        self.ttl = ttl
+        self.semantic = semantic
+        self._exact = LRUCache(maxsize=maxsize, ttl=ttl)
+        # Entrées sémantiques, de la moins à la plus récemment utilisée : clé exacte -> (vecteur, réponse, expiration)
+        self._vectors: "OrderedDict[Tuple[str, str, str], Tuple[array, str, float]]" = OrderedDict()
+        self._vector_bytes = 0
+        self.max_vector_bytes = settings.RESPONSE_CACHE_SEMANTIC_MAX_MB * 1024 * 1024
+        # Clés sémantiques de chaque client, dans l'ordre d'insertion
+        self._client_vectors: Dict[str, Dict[Tuple[str, str, str], None]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+        self._lookup_time = 0.0
+        self._lookups = 0
+
+    async def get(self, chatbot: Dict[str, Any], question: str) -> Optional[str]:
+        """
+        Recherche une réponse en cache
+
+        Args:
+            chatbot: Document du chatbot
+            question: Question du visiteur
+
+        Returns:
+            La réponse en cache, ou None
+        """
+        start = time.perf_counter()
+        try:
+            key = self._key(chatbot, question)
+            response = self._exact.get(key)
+            if response is not None:
+                self.hits_exact += 1
+                return response
+
+            if self.semantic:
+                response = await self._get_semantic(key, question)
+                if response is not None:
+                    self.hits_semantic += 1
+                    return response
+
+            self.misses += 1
+            return None
+        finally:
+            self._lookup_time += time.perf_counter() - start
+            self._lookups += 1
+
+    def set(self, chatbot: Dict[str, Any], question: str, response: str) -> None:
+        """
+        Enregistre une réponse en cache
+
+        L'embedding du niveau sémantique est calculé en arrière-plan.
+
+        Args:
+            chatbot: Document du chatbot
+            question: Question du visiteur
+            response: Réponse du LLM
+        """
+        key = self._key(chatbot, question)
+        self._exact.set(key, response)
+        if self.semantic:
+            task = asyncio.create_task(self._set_semantic(key, question, response))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def invalidate_chatbot(self, client_id: str) -> None:
+        """
+        Invalide les réponses en cache d'un chatbot dont la configuration a changé
+
+        Args:
+            client_id: Identifiant du client propriétaire du chatbot
+        """
+        for key in list(self._client_vectors.get(client_id, ())):
+            self._remove_vector(key)
+        for key in [k for k in self._exact.keys() if k[0] == client_id]:
+            self._exact.pop(key)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Retourne les statistiques du cache
+
+        Returns:
+            Nombre d'entrées, succès, échecs, taux de succès et temps moyen de recherche
+        """
+        hits = self.hits_exact + self.hits_semantic
+        total = hits + self.misses
+        return {
+            "entries": len(self._exact),
+            "semantic_entries": len(self._vectors),
+            "semantic_bytes": self._vector_bytes,
+            "hits_exact": self.hits_exact,
+            "hits_semantic": self.hits_semantic,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "avg_lookup_ms": (self._lookup_time / self._lookups) * 1000 if self._lookups else 0.0,
+        }
+
+    def _key(self, chatbot: Dict[str, Any], question: str) -> Tuple[str, str, str]:
+        """Construit la clé de cache (client_id, version, question normalisée)"""
+        return chatbot["client_id"], config_version(chatbot), normalize_question(question)
+
+    async def _set_semantic(self, key: Tuple[str, str, str], question: str, response: str) -> None:
+        """Enregistre l'embedding d'une question dans le niveau sémantique"""
+        vector = await self._embed(question)
+        if vector is None:
+            return
+        self._remove_vector(key)
+        self._vectors[key] = (vector, response, time.monotonic() + self.ttl)
+        self._vector_bytes += vector.itemsize * len(vector)
+        keys = self._client_vectors.setdefault(key[0], {})
+        keys[key] = None
+        # Au plus RESPONSE_CACHE_SEMANTIC_SIZE entrées par client, puis la taille totale
+        if len(keys) > settings.RESPONSE_CACHE_SEMANTIC_SIZE:
+            self._remove_vector(next(iter(keys)))
+        while self._vector_bytes > self.max_vector_bytes and self._vectors:
+            self._remove_vector(next(iter(self._vectors)))
+
+    def _remove_vector(self, key: Tuple[str, str, str]) -> None:
+        """Retire une entrée du niveau sémantique"""
+        entry = self._vectors.pop(key, None)
+        if entry is None:
+            return
+        self._vector_bytes -= entry[0].itemsize * len(entry[0])
+        keys = self._client_vectors.get(key[0])
+        if keys is not None:
+            keys.pop(key, None)
+            if not keys:
+                del self._client_vectors[key[0]]
+
+    async def _get_semantic(self, key: Tuple[str, str, str], question: str) -> Optional[str]:
+        """Recherche la réponse dont la question est la plus similaire au-delà du seuil"""
+        keys = self._client_vectors.get(key[0])
+        # Seules les entrées de la version courante de la configuration sont candidates
+        if not keys or not any(entry_key[1] == key[1] for entry_key in keys):
+            return None
+        vector = await self._embed(question)
+        if vector is None:
+            return None
+
+        now = time.monotonic()
+        best_score, best_key = 0.0, None
+        for entry_key in list(self._client_vectors.get(key[0], ())):
+            if entry_key[1] != key[1]:
+                continue
+            entry_vector, _, expires_at = self._vectors[entry_key]
+            if expires_at < now:
+                self._remove_vector(entry_key)
+                continue
+            score = sum(a * b for a, b in zip(vector, entry_vector))
+            if score > best_score:
+                best_score, best_key = score, entry_key
+        if best_key is not None and best_score >= settings.RESPONSE_CACHE_SIMILARITY:
+            self._vectors.move_to_end(best_key)
+            return self._vectors[best_key][1]
+        return None
+
+    async def _embed(self, question: str) -> Optional[array]:
+        """Calcule l'embedding normalisé d'une question (float32)"""
+        try:
+            vector = await get_provider("openai").embed(settings.RESPONSE_CACHE_EMBEDDING_MODEL, normalize_question(question))
+        except LLMError as e:
+            logger.warning(f"Embedding indisponible pour le cache sémantique: {str(e)}")
+            return None
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return array("f", (x / norm for x in vector))
+
+# Instance partagée du cache de réponses
+response_cache = ResponseCache()
@@ -0,0 +1,159 @@
+"""
+Regroupement des requêtes LLM identiques en cours (single-flight)
+
+Lors d'un pic de trafic, de nombreux visiteurs posent la même première question
+au même chatbot en quelques secondes. Les requêtes identiques (même client, même
+LLM, même contexte et même question normalisée) qui arrivent pendant qu'un appel
+est en cours partagent cet appel : les fragments déjà reçus leur sont rejoués,
+puis les suivants leur sont diffusés au fil de l'eau.
+
+L'appel est exécuté dans sa propre tâche : le départ du visiteur qui l'a
+déclenché ne l'interrompt pas tant que d'autres visiteurs l'attendent.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.conversations.llm.cache import normalize_question
+from app.utils.metrics import registry
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+llm_coalesced = registry.counter(
+    "llm_coalesced_requests_total", "Requêtes LLM regroupées (leader : appel effectif, follower : appel partagé)", ("role",))
+
+class _Flight:
+    """Appel LLM en cours, partagé par ses abonnés"""
+
+    def __init__(self):
+        self.chunks: List[Tuple[str, str]] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def notify(self) -> None:
+        """Réveille les abonnés en attente d'un nouveau fragment"""
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self) -> None:
+        """Attend un nouveau fragment ou la fin de l'appel"""
+        await self._changed.wait()
+
+class Subscription:
+    """
+    Abonnement à un appel LLM, itérable de façon asynchrone
+
+    L'attribut `shared` indique si l'appel a été déclenché par une autre requête.
+    """
+
+    def __init__(self, coalescer: "RequestCoalescer", key: str, flight: _Flight, shared: bool):
+        self.shared = shared
+        self._coalescer = coalescer
+        self._key = key
+        self._flight = flight
+
+    async def __aiter__(self) -> AsyncIterator[Tuple[str, str]]:
+        flight = self._flight
+        flight.subscribers += 1
+        position = 0
+        try:
+            while True:
+                while position < len(flight.chunks):
+                    yield flight.chunks[position]
+                    position += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # Plus personne n'attend la réponse : l'appel est abandonné
+                self._coalescer._forget(self._key, flight)
+                flight.task.cancel()
+
+class RequestCoalescer:
+    """
+    Partage des appels LLM identiques en cours
+    """
+
+    def __init__(self, enabled: bool = settings.LLM_COALESCING):
+        self.enabled = enabled
+        self._flights: Dict[str, _Flight] = {}
+
+    @staticmethod
+    def key(client_id: str, messages: List[Dict[str, str]], *llm_names: Optional[str]) -> str:
+        """
+        Calcule la clé de regroupement d'une requête
+
+        Args:
+            client_id: Identifiant du client
+            messages: Messages envoyés au LLM (le dernier étant la question du visiteur)
+            *llm_names: LLM principal et de secours
+
+        Returns:
+            Empreinte du client, des LLM, du contexte et de la question normalisée
+        """
+        context = messages[:-1]
+        question = normalize_question(messages[-1]["content"]) if messages else ""
+        payload = json.dumps([client_id, llm_names, context, question], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def subscribe(self, key: str, call: Callable[[], AsyncIterator[Tuple[str, Any]]]) -> Subscription:
+        """
+        S'abonne à l'appel en cours pour cette clé, ou le déclenche
+
+        Args:
+            key: Clé de regroupement (voir `key`)
+            call: Fonction démarrant l'appel LLM, produisant des tuples (LLM utilisé, fragment)
+
+        Returns:
+            L'abonnement, qui produit les fragments de la réponse
+        """
+        flight = self._flights.get(key) if self.enabled else None
+        if flight is not None:
+            llm_coalesced.inc(role="follower")
+            return Subscription(self, key, flight, shared=True)
+
+        flight = _Flight()
+        if self.enabled:
+            self._flights[key] = flight
+        flight.task = asyncio.create_task(self._run(key, flight, call))
+        llm_coalesced.inc(role="leader")
+        return Subscription(self, key, flight, shared=False)
+
+    def in_flight(self) -> int:
+        """Nombre d'appels partagés en cours"""
+        return len(self._flights)
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        """Retire un appel des appels partageables"""
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def _run(self, key: str, flight: _Flight, call: Callable[[], AsyncIterator[Tuple[str, Any]]]) -> None:
+        """Exécute l'appel et diffuse ses fragments aux abonnés"""
+        try:
+            async for item in call():
+                flight.chunks.append(item)
+                flight.notify()
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            self._forget(key, flight)
+            flight.notify()
+
+# Instance partagée du regroupement des requêtes
+request_coalescer = RequestCoalescer()
@@ -0,0 +1,289 @@
+"""
+Construction de la fenêtre de contexte envoyée aux LLMs
+
+Les derniers échanges sont conservés mot pour mot dans la limite d'un budget de
+tokens propre à chaque chatbot ; les échanges plus anciens sont condensés dans un
+résumé glissant, mis à jour de manière incrémentale en arrière-plan.
+
+Le résumé retient la position du dernier message résumé : les messages plus
+anciens que l'historique en mémoire (SESSION_HISTORY_MAX_MESSAGES derniers
+messages) qui n'ont pas encore été résumés sont relus depuis le stockage et
+résumés par tranches, si bien qu'aucun message ne sort du contexte sans être
+passé par le résumé. Les appels de résumé sont comptabilisés comme les autres
+requêtes LLM (métrique llm_tokens et quota du client).
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.clients.quota import quota_engine
+from app.config import settings
+from app.conversations.llm.providers import LLMError, get_provider, resolve_llm
+from app.conversations.storage import conversation_store
+from app.utils.cache import LRUCache
+from app.utils.db import conversations_collection
+from app.utils.metrics import llm_tokens
+
+try:
+    import tiktoken
+except ImportError:  # Dépendance optionnelle : estimation approximative sans tiktoken
+    tiktoken = None
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Correspondance entre l'expéditeur d'un message et le rôle attendu par les LLMs
+ROLE_BY_SENDER = {"user": "user", "bot": "assistant"}
+
+# Nombre moyen de caractères par token, par fournisseur, en l'absence de tokenizer
+CHARS_PER_TOKEN = {"openai": 4.0, "anthropic": 3.5, "ollama": 4.0}
+
+# Surcoût en tokens de l'encapsulation de chaque message (rôle, séparateurs)
+TOKENS_PER_MESSAGE = 4
+
+SUMMARY_PROMPT = (
+    "Tu résumes une conversation entre un visiteur et un assistant. "
+    "Mets à jour le résumé existant avec les nouveaux échanges, en conservant les faits, "
+    "demandes et informations utiles pour la suite. Réponds uniquement par le résumé, en quelques phrases."
+)
+
+_encodings: Dict[str, Any] = {}
+
+def count_tokens(text: str, provider_name: str) -> int:
+    """
+    Compte (ou estime) le nombre de tokens d'un texte pour un fournisseur
+
+    Args:
+        text: Texte à mesurer
+        provider_name: Fournisseur LLM (openai, anthropic, ollama)
+
+    Returns:
+        Nombre de tokens
+    """
+    if not text:
+        return 0
+    if provider_name == "openai" and tiktoken is not None:
+        encoding = _encodings.get(provider_name)
+        if encoding is None:
+            encoding = _encodings[provider_name] = tiktoken.get_encoding("cl100k_base")
+        return len(encoding.encode(text))
+    return int(len(text) / CHARS_PER_TOKEN.get(provider_name, 4.0)) + 1
+
+def count_message_tokens(messages: List[Dict[str, str]], provider_name: str) -> int:
+    """
+    Compte le nombre de tokens d'une liste de messages au format {"role", "content"}
+
+    Args:
+        messages: Messages à mesurer
+        provider_name: Fournisseur LLM
+
+    Returns:
+        Nombre de tokens
+    """
+    return sum(count_tokens(m["content"], provider_name) + TOKENS_PER_MESSAGE for m in messages)
+
+def to_llm_message(item: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    """
+    Convertit un message stocké au format attendu par les LLMs
+
+    Args:
+        item: Message stocké (sender, content, ...)
+
+    Returns:
+        Le message {"role", "content"}, ou None s'il n'est pas transmissible
+    """
+    role = ROLE_BY_SENDER.get(item.get("sender"))
+    if not role or not item.get("content"):
+        return None
+    return {"role": role, "content": item["content"]}
+
+class ContextBuilder:
+    """
+    Construit les messages envoyés au LLM dans la limite d'un budget de tokens
+
+    Le résumé de chaque session est conservé en cache mémoire et dans le document
+    de la conversation (champ `summary`, avec l'identifiant du dernier message résumé).
+    """
+
+    def __init__(self, maxsize: int = settings.SESSION_CACHE_SIZE, ttl: float = settings.SESSION_CACHE_TTL):
+        self._summaries = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._pending: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    async def build(self, chatbot: Dict[str, Any], session_id: str, history: List[Dict[str, Any]], message: str) -> List[Dict[str, str]]:
+        """
+        Construit les messages à envoyer au LLM
+
+        Args:
+            chatbot: Document du chatbot
+            session_id: Identifiant de session
+            history: Derniers messages de la session, du plus ancien au plus récent
+            message: Nouveau message de l'utilisateur
+
+        Returns:
+            Messages au format {"role", "content"}
+        """
+        provider_name, _ = resolve_llm(chatbot.get("default_llm") or settings.DEFAULT_LLM)
+        budget = chatbot.get("context_token_budget") or settings.CONTEXT_TOKEN_BUDGET
+        key = (chatbot["client_id"], session_id)
+        summary = await self._get_summary(key)
+
+        head = []
+        if chatbot.get("custom_instructions"):
+            head.append({"role": "system", "content": chatbot["custom_instructions"]})
+        if summary.get("text"):
+            head.append({"role": "system", "content": f"Résumé de la conversation précédente : {summary['text']}"})
+        tail = [{"role": "user", "content": message}]
+        used = count_message_tokens(head + tail, provider_name)
+
+        # Seuls les messages postérieurs au résumé sont candidats à la fenêtre
+        start = self._after_summary(summary, history)
+        # Messages plus anciens que l'historique en mémoire et pas encore résumés
+        gap_before = None
+        until_position = summary.get("until_position", -1 if not summary.get("until") else None)
+        if start == 0 and until_position is not None and history and history[0].get("position") is not None \
+                and history[0]["position"] > until_position + 1:
+            gap_before = history[0]["position"]
+        candidates = history[start:]
+
+        # Les échanges les plus récents sont conservés tant que le budget le permet
+        window: List[Dict[str, str]] = []
+        kept = 0
+        for item in reversed(candidates):
+            llm_message = to_llm_message(item)
+            if llm_message is None:
+                kept += 1
+                continue
+            cost = count_message_tokens([llm_message], provider_name)
+            if used + cost > budget:
+                break
+            window.append(llm_message)
+            used += cost
+            kept += 1
+        window.reverse()
+
+        dropped = candidates[:len(candidates) - kept]
+        if dropped or gap_before is not None:
+            self._schedule_fold(chatbot, key, summary, dropped, gap_before)
+
+        return head + window + tail
+
+    @staticmethod
+    def _after_summary(summary: Dict[str, Any], history: List[Dict[str, Any]]) -> int:
+        """Retourne l'indice du premier message de l'historique postérieur au résumé"""
+        if summary.get("until"):
+            for index, item in enumerate(history):
+                if item.get("id") == summary["until"]:
+                    return index + 1
+        until_position = summary.get("until_position")
+        if until_position is not None:
+            for index, item in enumerate(history):
+                # Les messages pas encore écrits n'ont pas de position : ils sont les plus récents
+                if item.get("position") is None or item["position"] > until_position:
+                    return index
+            return len(history)
+        return 0
+
+    async def _get_summary(self, key: Tuple[str, str]) -> Dict[str, Any]:
+        """Récupère le résumé d'une session depuis le cache ou MongoDB"""
+        summary = self._summaries.get(key)
+        if summary is None:
+            client_id, session_id = key
+            conversation = await conversations_collection.find_one(
+                {"session_id": session_id, "client_id": client_id},
+                {"summary": 1}
+            )
+            summary = (conversation or {}).get("summary") or {}
+            self._summaries.set(key, summary)
+        return summary
+
+    def _schedule_fold(self, chatbot: Dict[str, Any], key: Tuple[str, str], summary: Dict[str, Any],
+                       dropped: List[Dict[str, Any]], gap_before: Optional[int]) -> None:
+        """Planifie l'intégration des messages sortis de la fenêtre dans le résumé"""
+        if key in self._pending:
+            # Le résumé suivant reprendra à partir du dernier message résumé
+            return
+        task = asyncio.create_task(self._fold(chatbot, key, summary, dropped, gap_before))
+        self._pending[key] = task
+        task.add_done_callback(lambda _: self._pending.pop(key, None))
+
+    async def _fold(self, chatbot: Dict[str, Any], key: Tuple[str, str], summary: Dict[str, Any],
+                    dropped: List[Dict[str, Any]], gap_before: Optional[int]) -> None:
+        """
+        Met à jour le résumé d'une session avec les messages sortis de la fenêtre
+
+        Les messages antérieurs à l'historique en mémoire (avant la position
+        gap_before) sont d'abord relus depuis le stockage et résumés par tranches,
+        puis les messages sortis de la fenêtre. Seuls les nouveaux messages sont
+        envoyés au LLM, accompagnés du résumé existant ; en cas d'échec, le résumé
+        s'arrête au dernier message intégré et la suite est reprise au tour suivant.
+        """
+        # Tâche de fond que personne n'attend : une erreur non interceptée serait perdue
+        try:
+            client_id, session_id = key
+            if gap_before is not None:
+                after = summary.get("until_position", -1)
+                while True:
+                    try:
+                        older = await conversation_store.between(
+                            client_id, session_id, after, gap_before, settings.SESSION_HISTORY_MAX_MESSAGES)
+                    except Exception as e:
+                        logger.warning(f"Impossible de relire les messages de la session {session_id}: {str(e)}")
+                        return
+                    if not older:
+                        break
+                    summary = await self._summarize(chatbot, key, summary, older)
+                    if summary is None:
+                        return
+                    after = older[-1]["position"]
+            if dropped:
+                await self._summarize(chatbot, key, summary, dropped)
+        except Exception as e:
+            logger.error(f"Erreur lors de la mise à jour du résumé de la session {key[1]}: {str(e)}")
+
+    async def _summarize(self, chatbot: Dict[str, Any], key: Tuple[str, str], summary: Dict[str, Any],
+                         items: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Intègre des messages au résumé d'une session et retourne le nouveau résumé (None en cas d'échec)"""
+        llm_name = chatbot.get("fallback_llm") or chatbot.get("default_llm") or settings.DEFAULT_LLM
+        provider_name, model = resolve_llm(llm_name)
+        transcript = "\n".join(
+            f"{'Visiteur' if item.get('sender') == 'user' else 'Assistant'} : {item.get('content', '')}"
+            for item in items
+        )
+        prompt = f"Résumé existant : {summary.get('text') or '(aucun)'}\n\nNouveaux échanges :\n{transcript}"
+        messages = [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": prompt}]
+        try:
+            text = await get_provider(provider_name).complete(
+                model,
+                messages,
+                max_tokens=settings.CONTEXT_SUMMARY_MAX_TOKENS,
+                temperature=0.2
+            )
+        except LLMError as e:
+            logger.warning(f"Impossible de mettre à jour le résumé de la session {key[1]}: {str(e)}")
+            return None
+
+        client_id, session_id = key
+        prompt_tokens = count_message_tokens(messages, provider_name)
+        completion_tokens = count_tokens(text, provider_name)
+        llm_tokens.inc(prompt_tokens, provider=provider_name, kind="prompt")
+        llm_tokens.inc(completion_tokens, provider=provider_name, kind="completion")
+        quota_engine.record(client_id, llm_name, prompt_tokens + completion_tokens)
+
+        positions = [item["position"] for item in items if item.get("position") is not None]
+        new_summary = {
+            "text": text.strip(),
+            "until": items[-1]["id"],
+            "until_position": positions[-1] if positions else summary.get("until_position"),
+            "updated_at": datetime.utcnow(),
+        }
+        self._summaries.set(key, new_summary)
+        await conversations_collection.update_one(
+            {"session_id": session_id, "client_id": client_id},
+            {"$set": {"summary": new_summary}}
+        )
+        return new_summary
+
+# Instance partagée du constructeur de contexte
+context_builder = ContextBuilder()
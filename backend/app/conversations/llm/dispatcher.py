@@ -0,0 +1,267 @@
+"""
+Répartition des requêtes de chat entre le LLM principal et le LLM de secours
+
+Le répartiteur ajoute aux fournisseurs :
+- un disjoncteur par fournisseur : après plusieurs échecs consécutifs, le
+  fournisseur n'est plus sollicité pendant LLM_BREAKER_RESET_TIMEOUT secondes,
+  puis une seule requête de test est autorisée ;
+- la bascule vers le LLM de secours lorsque le principal échoue avant d'avoir
+  produit son premier fragment ;
+- des requêtes couvertes (hedging) : si le principal n'a produit aucun fragment
+  au-delà du 95e centile de son délai habituel, la même requête est envoyée au LLM
+  de secours et le premier à répondre est conservé, l'autre étant annulé.
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.conversations.llm.providers import LLMError, get_provider, resolve_llm
+from app.utils.metrics import registry
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+llm_dispatches = registry.counter(
+    "llm_dispatch_total", "Requêtes de chat réparties entre LLM principal et de secours", ("outcome",))
+
+class CircuitOpenError(LLMError):
+    """Erreur levée lorsque le disjoncteur d'un fournisseur est ouvert"""
+
+class CircuitBreaker:
+    """
+    Disjoncteur d'un fournisseur LLM (fermé, ouvert, semi-ouvert)
+    """
+
+    def __init__(self, name: str, failure_threshold: int = settings.LLM_BREAKER_FAILURES,
+                 reset_timeout: float = settings.LLM_BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        """
+        Indique si une requête peut être envoyée au fournisseur
+
+        Returns:
+            True si le disjoncteur est fermé, ou semi-ouvert sans requête de test en cours
+        """
+        if self.state == "open":
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+            self._probing = False
+        if self.state == "half_open":
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def record_success(self) -> None:
+        """Enregistre une réponse du fournisseur"""
+        if self.state != "closed":
+            logger.info(f"Disjoncteur {self.name} refermé")
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self) -> None:
+        """Enregistre un échec du fournisseur"""
+        self.failures += 1
+        self._probing = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(f"Disjoncteur {self.name} ouvert après {self.failures} échec(s)")
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """Libère la requête de test lorsqu'elle est annulée sans résultat"""
+        self._probing = False
+
+class _Attempt:
+    """Requête en cours auprès d'un LLM, dans l'attente de son premier fragment"""
+
+    def __init__(self, llm_name: str, provider_name: str, stream: AsyncIterator[str], breaker: CircuitBreaker):
+        self.llm_name = llm_name
+        self.provider_name = provider_name
+        self.stream = stream
+        self.breaker = breaker
+        self.started_at = time.perf_counter()
+        self.first_chunk = asyncio.ensure_future(stream.__anext__())
+
+    async def cancel(self) -> None:
+        """Annule la requête et ferme le flux du fournisseur"""
+        self.first_chunk.cancel()
+        await asyncio.gather(self.first_chunk, return_exceptions=True)
+        await self.stream.aclose()
+        self.breaker.release()
+
+class LLMDispatcher:
+    """
+    Envoi des requêtes de chat avec disjoncteurs, bascule et requêtes couvertes
+    """
+
+    def __init__(self, hedging: bool = settings.LLM_HEDGING, window: int = 200):
+        self.hedging = hedging
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        # Derniers délais avant le premier fragment, par LLM
+        self._first_chunk_delays: Dict[str, Deque[float]] = {}
+        self._window = window
+        registry.gauge("llm_circuit_open", "Disjoncteurs des fournisseurs LLM (1 si ouvert)", ("provider",)).set_function(
+            lambda: {(name,): float(breaker.state == "open") for name, breaker in self._breakers.items()})
+
+    def breaker(self, provider_name: str) -> CircuitBreaker:
+        """
+        Retourne le disjoncteur d'un fournisseur
+
+        Args:
+            provider_name: Nom du fournisseur
+
+        Returns:
+            Le disjoncteur
+        """
+        breaker = self._breakers.get(provider_name)
+        if breaker is None:
+            breaker = self._breakers[provider_name] = CircuitBreaker(provider_name)
+        return breaker
+
+    def hedge_delay(self, llm_name: str) -> float:
+        """
+        Calcule le délai au-delà duquel une requête couverte est envoyée
+
+        Args:
+            llm_name: LLM principal
+
+        Returns:
+            Le centile LLM_HEDGE_PERCENTILE des délais observés avant le premier fragment,
+            borné par LLM_HEDGE_MIN_DELAY et LLM_HEDGE_MAX_DELAY
+        """
+        delays = self._first_chunk_delays.get(llm_name)
+        if not delays or len(delays) < settings.LLM_HEDGE_MIN_SAMPLES:
+            return settings.LLM_HEDGE_DEFAULT_DELAY
+        ordered = sorted(delays)
+        index = min(len(ordered) - 1, math.ceil(len(ordered) * settings.LLM_HEDGE_PERCENTILE / 100) - 1)
+        return min(max(ordered[index], settings.LLM_HEDGE_MIN_DELAY), settings.LLM_HEDGE_MAX_DELAY)
+
+    async def stream(self, messages: List[Dict[str, str]], primary: str,
+                     fallback: Optional[str] = None) -> AsyncIterator[Tuple[str, str]]:
+        """
+        Génère une réponse en streaming auprès du LLM principal ou de secours
+
+        Args:
+            messages: Messages au format {"role", "content"}
+            primary: LLM principal
+            fallback: LLM de secours (aucune bascule si None)
+
+        Yields:
+            Des tuples (LLM ayant produit la réponse, fragment de texte)
+
+        Raises:
+            LLMError: Si aucun LLM n'a pu produire de réponse, ou si le flux retenu échoue
+        """
+        if fallback == primary:
+            fallback = None
+        attempt, first = await self._first_chunk(messages, primary, fallback)
+        try:
+            if first is not None:
+                yield attempt.llm_name, first
+                async for chunk in attempt.stream:
+                    yield attempt.llm_name, chunk
+        except LLMError:
+            attempt.breaker.record_failure()
+            raise
+        except Exception as e:
+            # Réponse illisible ou erreur inattendue du fournisseur : traitée comme un échec du LLM
+            attempt.breaker.record_failure()
+            raise LLMError(f"{attempt.provider_name}: {str(e)}") from e
+        finally:
+            await attempt.stream.aclose()
+
+    def _start(self, llm_name: str, messages: List[Dict[str, str]]) -> _Attempt:
+        """Envoie la requête à un LLM si son disjoncteur l'autorise"""
+        provider_name, model = resolve_llm(llm_name)
+        breaker = self.breaker(provider_name)
+        if not breaker.allow():
+            raise CircuitOpenError(f"{provider_name}: disjoncteur ouvert")
+        return _Attempt(llm_name, provider_name, get_provider(provider_name).stream(model, messages), breaker)
+
+    async def _first_chunk(self, messages: List[Dict[str, str]], primary: str,
+                           fallback: Optional[str]) -> Tuple[_Attempt, Optional[str]]:
+        """Attend le premier fragment du LLM principal, ou du LLM de secours en cas d'échec ou de lenteur"""
+        pending: List[_Attempt] = []
+        errors: List[Exception] = []
+        fallback_started = False
+
+        def start_fallback(outcome: str) -> None:
+            nonlocal fallback_started
+            fallback_started = True
+            try:
+                pending.append(self._start(fallback, messages))
+                llm_dispatches.inc(outcome=outcome)
+            except LLMError as e:
+                errors.append(e)
+
+        try:
+            try:
+                pending.append(self._start(primary, messages))
+            except LLMError as e:
+                errors.append(e)
+
+            if not pending and fallback:
+                start_fallback("failover")
+            elif fallback and self.hedging:
+                done, _ = await asyncio.wait({pending[0].first_chunk}, timeout=self.hedge_delay(primary))
+                if not done:
+                    start_fallback("hedged")
+
+            while pending:
+                await asyncio.wait({attempt.first_chunk for attempt in pending}, return_when=asyncio.FIRST_COMPLETED)
+                # En cas d'arrivée simultanée, le LLM principal est préféré
+                for attempt in [attempt for attempt in pending if attempt.first_chunk.done()]:
+                    pending.remove(attempt)
+                    error = attempt.first_chunk.exception()
+                    if error is None or isinstance(error, StopAsyncIteration):
+                        first = None if error is not None else attempt.first_chunk.result()
+                        return self._won(attempt, primary, pending), first
+                    attempt.breaker.record_failure()
+                    logger.warning(f"Échec du LLM {attempt.llm_name} avant sa réponse: {str(error)}")
+                    errors.append(error)
+                    if attempt.llm_name == primary and fallback and not fallback_started:
+                        start_fallback("failover")
+        finally:
+            for attempt in pending:
+                await attempt.cancel()
+
+        llm_dispatches.inc(outcome="error")
+        error = next((e for e in reversed(errors) if isinstance(e, LLMError)), None)
+        if error is not None:
+            raise error
+        raise LLMError(f"Aucun LLM disponible: {'; '.join(str(e) for e in errors) or primary}")
+
+    def _won(self, attempt: _Attempt, primary: str, losers: List[_Attempt]) -> _Attempt:
+        """Enregistre le LLM retenu (les requêtes restantes sont annulées par l'appelant)"""
+        attempt.breaker.record_success()
+        now = time.perf_counter()
+        self._observe(attempt.llm_name, now - attempt.started_at)
+        # Le délai d'un LLM devancé est au moins le temps écoulé : sans cette mesure
+        # (censurée), seules ses réponses rapides seraient comptées et son centile baisserait
+        for loser in losers:
+            self._observe(loser.llm_name, now - loser.started_at)
+        llm_dispatches.inc(outcome="primary" if attempt.llm_name == primary else "fallback")
+        return attempt
+
+    def _observe(self, llm_name: str, delay: float) -> None:
+        """Ajoute un délai avant le premier fragment à la fenêtre d'un LLM"""
+        self._first_chunk_delays.setdefault(llm_name, deque(maxlen=self._window)).append(delay)
+
+# Instance partagée du répartiteur
+llm_dispatcher = LLMDispatcher()
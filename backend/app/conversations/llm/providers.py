@@ -0,0 +1,295 @@
+"""
+Fournisseurs LLM (OpenAI, Anthropic, Ollama) avec support du streaming
+"""
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+
+from app.config import settings
+from app.utils.metrics import llm_request_duration, llm_time_to_first_token
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class LLMError(Exception):
+    """Erreur levée lorsqu'un fournisseur LLM échoue"""
+
+class LLMProvider(ABC):
+    """
+    Classe de base pour un fournisseur LLM
+
+    Les sous-classes implémentent `stream`, qui produit les fragments de texte
+    au fur et à mesure de leur réception depuis le fournisseur.
+    """
+    name = "base"
+
+    def __init__(self, base_url: str, api_key: str = "", timeout: Optional[float] = None):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout or settings.LLM_TIMEOUT
+        self._http: Optional[httpx.AsyncClient] = None
+
+    def _client(self) -> httpx.AsyncClient:
+        """Retourne le client HTTP du fournisseur, créé au premier appel puis réutilisé (pool de connexions)"""
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=settings.LLM_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=settings.LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+                ),
+            )
+        return self._http
+
+    async def aclose(self) -> None:
+        """Ferme le client HTTP du fournisseur"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    @abstractmethod
+    async def stream(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int = settings.LLM_MAX_TOKENS,
+        temperature: float = settings.LLM_TEMPERATURE,
+    ) -> AsyncIterator[str]:
+        """
+        Génère une réponse en streaming
+
+        Args:
+            model: Modèle à utiliser
+            messages: Messages au format {"role", "content"}
+            max_tokens: Nombre maximum de tokens générés
+            temperature: Température
+
+        Yields:
+            Les fragments de texte de la réponse
+        """
+
+    async def complete(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int = settings.LLM_MAX_TOKENS,
+        temperature: float = settings.LLM_TEMPERATURE,
+    ) -> str:
+        """
+        Génère une réponse complète
+
+        Args:
+            model: Modèle à utiliser
+            messages: Messages au format {"role", "content"}
+            max_tokens: Nombre maximum de tokens générés
+            temperature: Température
+
+        Returns:
+            Le texte complet de la réponse
+        """
+        chunks = []
+        async for chunk in self.stream(model, messages, max_tokens, temperature):
+            chunks.append(chunk)
+        return "".join(chunks)
+
+    async def _post_stream(self, path: str, payload: dict, headers: dict) -> AsyncIterator[str]:
+        """
+        Envoie une requête en streaming et produit les lignes de la réponse
+
+        Raises:
+            LLMError: Si le fournisseur répond avec une erreur ou est injoignable
+        """
+        start = time.perf_counter()
+        first_line = True
+        outcome = "error"
+        try:
+            async with self._client().stream("POST", f"{self.base_url}{path}", json=payload, headers=headers) as response:
+                if response.status_code >= 400:
+                    body = await response.aread()
+                    raise LLMError(f"{self.name}: HTTP {response.status_code} - {body[:200]!r}")
+                async for line in response.aiter_lines():
+                    if line:
+                        if first_line:
+                            llm_time_to_first_token.observe(time.perf_counter() - start, provider=self.name)
+                            first_line = False
+                        yield line
+            outcome = "success"
+        except httpx.HTTPError as e:
+            raise LLMError(f"{self.name}: {str(e)}") from e
+        except GeneratorExit:
+            # Flux refermé par l'appelant : fin de réponse détectée, ou visiteur déconnecté avant le premier fragment
+            outcome = "cancelled" if first_line else "success"
+            raise
+        finally:
+            llm_request_duration.observe(time.perf_counter() - start, provider=self.name, operation="chat", outcome=outcome)
+
+class OpenAIProvider(LLMProvider):
+    """Fournisseur OpenAI (API chat completions, flux SSE)"""
+    name = "openai"
+
+    async def stream(self, model, messages, max_tokens=settings.LLM_MAX_TOKENS, temperature=settings.LLM_TEMPERATURE):
+        payload = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": True,
+        }
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        async for line in self._post_stream("/chat/completions", payload, headers):
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            choices = json.loads(data).get("choices") or []
+            if choices:
+                content = choices[0].get("delta", {}).get("content")
+                if content:
+                    yield content
+
+    async def embed(self, model: str, text: str) -> List[float]:
+        """
+        Calcule l'embedding d'un texte
+
+        Args:
+            model: Modèle d'embedding
+            text: Texte à encoder
+
+        Returns:
+            Le vecteur d'embedding
+
+        Raises:
+            LLMError: Si le fournisseur répond avec une erreur ou est injoignable
+        """
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            response = await self._client().post(
+                f"{self.base_url}/embeddings",
+                json={"model": model, "input": text},
+                headers={"Authorization": f"Bearer {self.api_key}"}
+            )
+            response.raise_for_status()
+            embedding = response.json()["data"][0]["embedding"]
+            outcome = "success"
+            return embedding
+        except (httpx.HTTPError, KeyError, IndexError) as e:
+            raise LLMError(f"{self.name}: {str(e)}") from e
+        finally:
+            llm_request_duration.observe(time.perf_counter() - start, provider=self.name, operation="embed", outcome=outcome)
+
+class AnthropicProvider(LLMProvider):
+    """Fournisseur Anthropic (API messages, flux SSE)"""
+    name = "anthropic"
+
+    async def stream(self, model, messages, max_tokens=settings.LLM_MAX_TOKENS, temperature=settings.LLM_TEMPERATURE):
+        # Anthropic attend les instructions système hors de la liste des messages
+        system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+        payload = {
+            "model": model,
+            "messages": [m for m in messages if m["role"] != "system"],
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": True,
+        }
+        if system:
+            payload["system"] = system
+        headers = {"x-api-key": self.api_key, "anthropic-version": "2023-06-01"}
+        async for line in self._post_stream("/messages", payload, headers):
+            if not line.startswith("data:"):
+                continue
+            event = json.loads(line[5:].strip())
+            if event.get("type") == "content_block_delta":
+                text = event.get("delta", {}).get("text")
+                if text:
+                    yield text
+            elif event.get("type") == "message_stop":
+                break
+            elif event.get("type") == "error":
+                raise LLMError(f"{self.name}: {event.get('error')}")
+
+class OllamaProvider(LLMProvider):
+    """Fournisseur Ollama (API chat, flux NDJSON)"""
+    name = "ollama"
+
+    async def stream(self, model, messages, max_tokens=settings.LLM_MAX_TOKENS, temperature=settings.LLM_TEMPERATURE):
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": True,
+            "options": {"num_predict": max_tokens, "temperature": temperature},
+        }
+        async for line in self._post_stream("/api/chat", payload, {}):
+            event = json.loads(line)
+            if event.get("error"):
+                raise LLMError(f"{self.name}: {event['error']}")
+            content = event.get("message", {}).get("content")
+            if content:
+                yield content
+            if event.get("done"):
+                break
+
+def resolve_llm(llm_name: str) -> Tuple[str, str]:
+    """
+    Détermine le fournisseur et le modèle correspondant à un nom de LLM
+
+    Args:
+        llm_name: Nom du LLM (ex: "gpt-4", "claude-3-opus-20240229", "ollama/llama3")
+
+    Returns:
+        Tuple (fournisseur, modèle)
+    """
+    if "/" in llm_name:
+        provider, model = llm_name.split("/", 1)
+        return provider, model
+    if llm_name.startswith(("gpt-", "o1", "o3")):
+        return "openai", llm_name
+    if llm_name.startswith("claude"):
+        return "anthropic", llm_name
+    return "ollama", llm_name
+
+# Fournisseurs instanciés, partagés par toutes les requêtes
+_providers: Dict[str, LLMProvider] = {}
+
+def get_provider(provider_name: str) -> LLMProvider:
+    """
+    Retourne le fournisseur LLM configuré correspondant au nom donné
+
+    Chaque fournisseur est instancié une seule fois, avec son propre pool de
+    connexions HTTP et son délai d'attente (LLM_PROVIDER_TIMEOUTS).
+
+    Args:
+        provider_name: Nom du fournisseur (openai, anthropic, ollama)
+
+    Returns:
+        Le fournisseur LLM
+
+    Raises:
+        LLMError: Si le fournisseur est inconnu
+    """
+    provider = _providers.get(provider_name)
+    if provider is not None:
+        return provider
+    timeout = settings.LLM_PROVIDER_TIMEOUTS.get(provider_name)
+    if provider_name == "openai":
+        provider = OpenAIProvider(settings.OPENAI_API_URL, settings.OPENAI_API_KEY, timeout)
+    elif provider_name == "anthropic":
+        provider = AnthropicProvider(settings.ANTHROPIC_API_URL, settings.ANTHROPIC_API_KEY, timeout)
+    elif provider_name == "ollama":
+        provider = OllamaProvider(settings.OLLAMA_API_URL, timeout=timeout)
+    else:
+        raise LLMError(f"Fournisseur LLM inconnu: {provider_name}")
+    _providers[provider_name] = provider
+    return provider
+
+async def close_providers() -> None:
+    """Ferme les pools de connexions des fournisseurs LLM"""
+    for provider in _providers.values():
+        await provider.aclose()
+    _providers.clear()
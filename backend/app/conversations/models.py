@@ -0,0 +1,103 @@
+"""
+Modèles pour les conversations
+"""
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Any
+from datetime import datetime
+
+class Message(BaseModel):
+    """Modèle pour un message d'une conversation"""
+    id: str
+    sender: str
+    content: str
+    timestamp: datetime
+    llm_used: Optional[str] = None
+    confidence: Optional[float] = None
+    response_time: Optional[float] = None
+    tags: List[str] = Field(default_factory=list)
+    metadata: Dict[str, Any] = Field(default_factory=dict)
+    position: Optional[int] = None
+
+class Conversation(BaseModel):
+    """Modèle pour une conversation (en-tête, les messages étant stockés par compartiments)"""
+    id: str
+    client_id: str
+    chatbot_id: Optional[str] = None
+    session_id: str
+    messages: List[Message] = Field(default_factory=list)
+    message_count: int = 0
+    user_info: Dict[str, Any] = Field(default_factory=dict)
+    timestamp: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class ConversationPage(BaseModel):
+    """Modèle pour une page de messages d'une conversation"""
+    session_id: str
+    messages: List[Message]
+    next_cursor: Optional[int] = None  # Valeur de `before` pour la page précédente, None au début de la conversation
+
+class SearchHit(BaseModel):
+    """Modèle pour un message trouvé par la recherche"""
+    session_id: str
+    message_id: str
+    position: Optional[int] = None
+    sender: str
+    content: str
+    tags: List[str] = Field(default_factory=list)
+    llm_used: Optional[str] = None
+    timestamp: datetime
+    score: Optional[float] = None
+
+class FacetCount(BaseModel):
+    """Modèle pour une valeur de facette et son nombre de messages"""
+    value: str
+    count: int
+
+class SearchResults(BaseModel):
+    """Modèle pour les résultats d'une recherche dans les conversations"""
+    total: int
+    truncated: bool  # Total et facettes limités aux SEARCH_MAX_MATCHES meilleurs résultats
+    results: List[SearchHit]
+    facets: Dict[str, List[FacetCount]]  # Par jour (dates), LLM (llms) et tag (tags)
+
+class ExportRequest(BaseModel):
+    """Modèle pour une demande d'export en tâche de fond"""
+    client_id: str
+    format: str = Field("ndjson", pattern="^(ndjson|csv)$")
+    gzip: bool = True
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = None
+    chatbot_id: Optional[str] = None
+
+class ExportJob(BaseModel):
+    """Modèle pour l'état d'un export en tâche de fond"""
+    job_id: str = Field(..., alias="_id")
+    client_id: str
+    status: str  # pending, running, done ou failed
+    filename: str
+    rows: int = 0
+    size: Optional[int] = None  # Taille du fichier (octets), une fois l'export terminé
+    error: Optional[str] = None
+    created_at: datetime
+    completed_at: Optional[datetime] = None
+
+    class Config:
+        populate_by_name = True
+
+class ChatRequest(BaseModel):
+    """Modèle pour une requête de chat envoyée par le widget"""
+    client_id: str
+    session_id: str
+    message: str = Field(..., min_length=1)
+    last_message_id: Optional[str] = None
+
+class ChatResponse(BaseModel):
+    """Modèle pour la réponse à une requête de chat"""
+    response: str
+    message_id: str
+    session_id: str
+    llm_used: str
+    response_time: float
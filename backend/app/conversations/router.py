@@ -0,0 +1,323 @@
+"""
+Routes pour les conversations
+"""
+import json
+import logging
+import os
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, status
+from fastapi.responses import FileResponse, StreamingResponse
+from pymongo.errors import ExecutionTimeout
+
+from app.auth.models import User
+from app.auth.service import get_admin_user
+from app.conversations.export import FORMATS, ExportError, RowEncoder, decode_cursor, encode_rows, export_filename, \
+    export_jobs, export_rows
+from app.conversations.llm.cache import response_cache
+from app.conversations.llm.providers import LLMError
+from app.conversations.models import ChatRequest, ChatResponse, ConversationPage, ExportJob, ExportRequest, \
+    SearchResults
+from app.conversations.search import conversation_search
+from app.conversations.service import get_tenant, process_chat, stream_chat
+from app.conversations.storage import conversation_store
+from app.conversations.websocket import chat_sockets
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+def format_sse(event: str, data: dict) -> str:
+    """
+    Formate un événement server-sent events
+
+    Args:
+        event: Nom de l'événement
+        data: Données de l'événement
+
+    Returns:
+        L'événement encodé au format SSE
+    """
+    return f"event: {event}\ndata: {json.dumps(data, default=str, ensure_ascii=False)}\n\n"
+
+@router.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest):
+    """
+    Traite une requête de chat et retourne la réponse complète
+
+    Args:
+        request: Requête de chat envoyée par le widget
+
+    Returns:
+        La réponse du chatbot
+
+    Raises:
+        HTTPException: Si le chatbot est introuvable ou si le LLM est indisponible
+    """
+    client, chatbot = await get_tenant(request.client_id)
+    try:
+        return await process_chat(request, client, chatbot)
+    except LLMError as e:
+        logger.error(f"Erreur LLM: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Le service de réponse est momentanément indisponible"
+        )
+
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Traite une requête de chat en streaming (server-sent events)
+
+    Les tokens sont relayés au fil de l'eau sous forme d'événements `token`,
+    suivis d'un événement `done` contenant la réponse complète, ou d'un
+    événement `error` en cas d'échec du LLM.
+
+    Args:
+        request: Requête de chat envoyée par le widget
+
+    Returns:
+        Un flux text/event-stream
+
+    Raises:
+        HTTPException: Si le chatbot est introuvable
+    """
+    client, chatbot = await get_tenant(request.client_id)
+
+    async def event_stream() -> AsyncIterator[str]:
+        try:
+            async for event, data in stream_chat(request, client, chatbot):
+                yield format_sse(event, data)
+        except LLMError as e:
+            logger.error(f"Erreur LLM: {str(e)}")
+            yield format_sse("error", {"detail": "Le service de réponse est momentanément indisponible"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.websocket("/ws")
+async def chat_websocket(websocket: WebSocket, client_id: str, session_id: str, last_message_id: Optional[str] = None):
+    """
+    Échanges du widget sur une connexion WebSocket par session (voir app.conversations.websocket)
+
+    Args:
+        websocket: Connexion WebSocket
+        client_id: Identifiant du client
+        session_id: Identifiant de session du visiteur
+        last_message_id: Dernier message reçu, pour recevoir les messages manqués après une déconnexion
+    """
+    await chat_sockets.serve(websocket, client_id, session_id, last_message_id)
+
+@router.get("/cache/stats")
+async def cache_stats(admin_user: User = Depends(get_admin_user)):
+    """
+    Statistiques du cache de réponses LLM (réservé aux administrateurs)
+
+    Args:
+        admin_user: Utilisateur administrateur (injecté par la dépendance)
+
+    Returns:
+        Nombre d'entrées, succès, échecs, taux de succès et temps moyen de recherche
+    """
+    return response_cache.stats()
+
+@router.get("/search", response_model=SearchResults)
+async def search_conversations(
+    client_id: str,
+    q: Optional[str] = Query(None, max_length=500),
+    session_id: Optional[str] = None,
+    llm_used: Optional[str] = None,
+    tag: Optional[str] = None,
+    sender: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    limit: int = Query(20, ge=1, le=100),
+    skip: int = Query(0, ge=0, le=1000),
+    admin_user: User = Depends(get_admin_user)
+):
+    """
+    Recherche dans les messages des conversations d'un client (réservé aux administrateurs)
+
+    Args:
+        client_id: Identifiant du client
+        q: Texte recherché ("expression exacte", -mot exclu)
+        session_id: Filtre sur une session
+        llm_used: Filtre sur le LLM ayant répondu
+        tag: Filtre sur un tag
+        sender: Filtre sur l'expéditeur (user ou bot)
+        date_from: Date minimale
+        date_to: Date maximale
+        limit: Nombre de résultats
+        skip: Nombre de résultats à sauter
+        admin_user: Utilisateur administrateur (injecté par la dépendance)
+
+    Returns:
+        Les messages trouvés, leur nombre et les décomptes par jour, LLM et tag
+
+    Raises:
+        HTTPException: Si la recherche dépasse SEARCH_TIMEOUT_MS
+    """
+    try:
+        return await conversation_search.search(
+            client_id, q, session_id=session_id, llm_used=llm_used, tag=tag, sender=sender,
+            date_from=date_from, date_to=date_to, limit=limit, skip=skip
+        )
+    except ExecutionTimeout:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Recherche trop longue, veuillez préciser les critères"
+        )
+
+@router.get("/export")
+async def export_conversations(
+    client_id: str,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    gzip: bool = False,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    chatbot_id: Optional[str] = None,
+    after: Optional[str] = None,
+    admin_user: User = Depends(get_admin_user)
+):
+    """
+    Exporte les messages des conversations d'un client en flux (réservé aux administrateurs)
+
+    Les messages sont envoyés au fur et à mesure de leur lecture, par session puis
+    par position. Chaque ligne porte un curseur : un export interrompu reprend en
+    passant le dernier curseur reçu en paramètre `after`.
+
+    Args:
+        client_id: Identifiant du client
+        format: Format (ndjson ou csv)
+        gzip: Compression gzip à la volée
+        date_from: Date minimale des messages
+        date_to: Date maximale des messages (exclue)
+        chatbot_id: Limite l'export à un chatbot
+        after: Curseur de la dernière ligne déjà reçue
+        admin_user: Utilisateur administrateur (injecté par la dépendance)
+
+    Returns:
+        Un flux NDJSON ou CSV, en pièce jointe
+
+    Raises:
+        HTTPException: Si le curseur de reprise est invalide
+    """
+    try:
+        if after:
+            decode_cursor(after)
+        encoder = RowEncoder(format, gzip)
+    except ExportError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    rows = export_rows(client_id, date_from, date_to, chatbot_id, after)
+    return StreamingResponse(
+        encode_rows(rows, encoder),
+        media_type="application/gzip" if gzip else FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{export_filename(client_id, format, gzip)}"'},
+    )
+
+@router.post("/export/jobs", response_model=ExportJob, status_code=status.HTTP_202_ACCEPTED)
+async def create_export_job(request: ExportRequest, admin_user: User = Depends(get_admin_user)):
+    """
+    Lance l'export des conversations d'un client en tâche de fond (réservé aux administrateurs)
+
+    Args:
+        request: Client, format et filtres de l'export
+        admin_user: Utilisateur administrateur (injecté par la dépendance)
+
+    Returns:
+        L'état de l'export, dont l'identifiant permet de suivre puis de télécharger le fichier
+    """
+    return await export_jobs.submit(
+        request.client_id, request.format, request.gzip, request.date_from, request.date_to, request.chatbot_id
+    )
+
+@router.get("/export/jobs/{job_id}", response_model=ExportJob)
+async def get_export_job(job_id: str, admin_user: User = Depends(get_admin_user)):
+    """
+    Récupère l'état d'un export en tâche de fond (réservé aux administrateurs)
+
+    Args:
+        job_id: Identifiant de l'export
+        admin_user: Utilisateur administrateur (injecté par la dépendance)
+
+    Returns:
+        L'état de l'export
+
+    Raises:
+        HTTPException: Si l'export est introuvable ou expiré
+    """
+    job = await export_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Export introuvable")
+    return job
+
+@router.get("/export/jobs/{job_id}/download")
+async def download_export_job(job_id: str, admin_user: User = Depends(get_admin_user)):
+    """
+    Télécharge le fichier d'un export terminé (réservé aux administrateurs)
+
+    Args:
+        job_id: Identifiant de l'export
+        admin_user: Utilisateur administrateur (injecté par la dépendance)
+
+    Returns:
+        Le fichier exporté
+
+    Raises:
+        HTTPException: Si l'export est introuvable, expiré, pas encore terminé ou si son fichier est absent
+    """
+    job = await export_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Export introuvable")
+    if job["status"] != "done":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Export non disponible ({job['status']})")
+    path = export_jobs.path(job)
+    if not os.path.exists(path):
+        # Fichier écrit par une autre instance : EXPORT_DIR n'est pas partagé
+        logger.error(f"Fichier de l'export {job_id} absent de {export_jobs.directory}, "
+                     f"EXPORT_DIR doit être partagé par toutes les instances")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Fichier d'export introuvable")
+    return FileResponse(path, media_type=job["media_type"], filename=job["filename"])
+
+@router.get("/{session_id}", response_model=ConversationPage)
+async def get_conversation(
+    session_id: str,
+    before: Optional[int] = Query(None, ge=0),
+    limit: int = Query(50, ge=1, le=200),
+    client_id: Optional[str] = None,
+    admin_user: User = Depends(get_admin_user)
+):
+    """
+    Récupère une page de messages d'une conversation (réservé aux administrateurs)
+
+    Les messages sont paginés du plus récent au plus ancien : la première page
+    contient la fin de la conversation, et `next_cursor` est à passer en
+    paramètre `before` pour obtenir la page précédente.
+
+    Args:
+        session_id: Identifiant de session
+        before: Position à partir de laquelle remonter (exclue)
+        limit: Nombre maximal de messages
+        client_id: Identifiant du client (optionnel)
+        admin_user: Utilisateur administrateur (injecté par la dépendance)
+
+    Returns:
+        Les messages de la page, du plus ancien au plus récent
+
+    Raises:
+        HTTPException: Si la conversation est introuvable
+    """
+    messages, next_cursor = await conversation_store.page(session_id, before, limit, client_id)
+    if not messages and before is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Conversation introuvable"
+        )
+    return ConversationPage(session_id=session_id, messages=messages, next_cursor=next_cursor)
@@ -0,0 +1,177 @@
+"""
+Index de recherche des messages de conversation
+
+Chaque message est recopié dans la collection conversation_search (un document
+par message), couverte par un index texte préfixé par client_id : une recherche
+ne parcourt que l'index du client concerné, et non l'ensemble des compartiments
+de ses conversations.
+
+L'index est alimenté au fil de l'eau par l'écriture différée des messages (voir
+app.conversations.storage) ; il peut être reconstruit à partir des compartiments
+avec `python -m app.utils.reindex_conversations`.
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.config import settings
+from app.utils.db import conversation_search_collection
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def search_document(client_id: str, session_id: str, message: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Construit le document de recherche d'un message
+
+    Args:
+        client_id: Identifiant du client
+        session_id: Identifiant de session
+        message: Message (avec sa position)
+
+    Returns:
+        Le document à indexer
+    """
+    return {
+        "client_id": client_id,
+        "session_id": session_id,
+        "message_id": message["id"],
+        "position": message.get("position"),
+        "sender": message["sender"],
+        "content": message["content"],
+        "tags": message.get("tags", []),
+        "llm_used": message.get("llm_used"),
+        "timestamp": message["timestamp"],
+    }
+
+class ConversationSearch:
+    """
+    Indexation et recherche plein texte des messages, avec décomptes par facette
+    """
+
+    async def index(self, client_id: str, session_id: str, messages: List[Dict[str, Any]]) -> None:
+        """
+        Indexe des messages (sans effet pour les messages déjà indexés)
+
+        Args:
+            client_id: Identifiant du client
+            session_id: Identifiant de session
+            messages: Messages à indexer (avec leur position)
+        """
+        await self.index_documents([search_document(client_id, session_id, message) for message in messages])
+
+    async def index_documents(self, documents: List[Dict[str, Any]]) -> None:
+        """
+        Écrit des documents de recherche en une seule écriture
+
+        Args:
+            documents: Documents construits par search_document
+        """
+        if not documents:
+            return
+        operations = [
+            UpdateOne(
+                {"client_id": document["client_id"], "message_id": document["message_id"]},
+                {"$setOnInsert": document},
+                upsert=True
+            )
+            for document in documents
+        ]
+        try:
+            await conversation_search_collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Deux upserts concurrents du même message : le document existe déjà
+            errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+            if errors:
+                raise
+
+    async def search(self, client_id: str, query: Optional[str] = None, session_id: Optional[str] = None,
+                     llm_used: Optional[str] = None, tag: Optional[str] = None, sender: Optional[str] = None,
+                     date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                     limit: int = 20, skip: int = 0) -> Dict[str, Any]:
+        """
+        Recherche des messages d'un client
+
+        Les résultats sont triés par pertinence (puis du plus récent au plus ancien),
+        ou par date en l'absence de texte recherché. Les décomptes par jour, LLM et
+        tag portent sur les SEARCH_MAX_MATCHES meilleurs résultats.
+
+        Args:
+            client_id: Identifiant du client
+            query: Texte recherché (syntaxe $text : "expression exacte", -exclusion)
+            session_id: Filtre sur une session
+            llm_used: Filtre sur le LLM ayant répondu
+            tag: Filtre sur un tag
+            sender: Filtre sur l'expéditeur (user ou bot)
+            date_from: Date minimale
+            date_to: Date maximale
+            limit: Nombre de résultats
+            skip: Nombre de résultats à sauter
+
+        Returns:
+            Dictionnaire (total, truncated, results, facets)
+        """
+        match: Dict[str, Any] = {"client_id": client_id}
+        if query:
+            match["$text"] = {"$search": query}
+        for field, value in (("session_id", session_id), ("llm_used", llm_used), ("tags", tag), ("sender", sender)):
+            if value:
+                match[field] = value
+        if date_from or date_to:
+            match["timestamp"] = {}
+            if date_from:
+                match["timestamp"]["$gte"] = date_from
+            if date_to:
+                match["timestamp"]["$lte"] = date_to
+
+        pipeline: List[Dict[str, Any]] = [{"$match": match}]
+        if query:
+            pipeline += [
+                {"$addFields": {"score": {"$meta": "textScore"}}},
+                {"$sort": {"score": -1, "timestamp": -1}},
+            ]
+        else:
+            pipeline.append({"$sort": {"timestamp": -1}})
+        pipeline += [
+            {"$limit": settings.SEARCH_MAX_MATCHES},
+            {"$facet": {
+                "results": [{"$skip": skip}, {"$limit": limit}, {"$project": {"_id": 0, "client_id": 0}}],
+                "total": [{"$count": "count"}],
+                "dates": [
+                    {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}}, "count": {"$sum": 1}}},
+                    {"$sort": {"_id": -1}},
+                    {"$limit": settings.SEARCH_FACET_SIZE},
+                ],
+                "llms": [
+                    {"$match": {"llm_used": {"$ne": None}}},
+                    {"$group": {"_id": "$llm_used", "count": {"$sum": 1}}},
+                    {"$sort": {"count": -1}},
+                    {"$limit": settings.SEARCH_FACET_SIZE},
+                ],
+                "tags": [
+                    {"$unwind": "$tags"},
+                    {"$group": {"_id": "$tags", "count": {"$sum": 1}}},
+                    {"$sort": {"count": -1}},
+                    {"$limit": settings.SEARCH_FACET_SIZE},
+                ],
+            }},
+        ]
+        cursor = conversation_search_collection.aggregate(pipeline, maxTimeMS=settings.SEARCH_TIMEOUT_MS)
+        facets = (await cursor.to_list(1))[0]
+        total = facets["total"][0]["count"] if facets["total"] else 0
+        return {
+            "total": total,
+            "truncated": total >= settings.SEARCH_MAX_MATCHES,
+            "results": facets["results"],
+            "facets": {
+                name: [{"value": bucket["_id"], "count": bucket["count"]} for bucket in facets[name]]
+                for name in ("dates", "llms", "tags")
+            },
+        }
+
+# Instance partagée de la recherche
+conversation_search = ConversationSearch()
@@ -0,0 +1,199 @@
+"""
+Services pour les conversations
+"""
+import logging
+import time
+import uuid
+from functools import partial
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Tuple
+
+from fastapi import HTTPException, status
+
+from app.clients.alerts import quota_alerter
+from app.clients.quota import quota_engine
+from app.clients.tenants import tenant_cache
+from app.config import settings
+from app.conversations.history import history_store
+from app.conversations.ingest import message_ingestor
+from app.conversations.llm.cache import response_cache
+from app.conversations.llm.coalescing import request_coalescer
+from app.conversations.llm.context import context_builder, count_message_tokens, count_tokens
+from app.conversations.llm.dispatcher import llm_dispatcher
+from app.conversations.llm.providers import resolve_llm
+from app.conversations.models import ChatRequest, ChatResponse
+from app.sandbox.executor import pre_process_message
+from app.utils.metrics import llm_tokens
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+async def get_tenant(client_id: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Récupère un client actif et son chatbot actif depuis le cache de configuration
+
+    Args:
+        client_id: Identifiant du client
+
+    Returns:
+        Tuple (document du client, document du chatbot)
+
+    Raises:
+        HTTPException: Si le client ou le chatbot est introuvable ou inactif
+    """
+    client, chatbot = await tenant_cache.get(client_id)
+    if client is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Client introuvable ou inactif"
+        )
+    if chatbot is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Aucun chatbot actif pour ce client"
+        )
+    return client, chatbot
+
+def new_message(sender: str, content: str, **extra: Any) -> Dict[str, Any]:
+    """
+    Crée un message au format de stockage
+
+    Args:
+        sender: Expéditeur (user ou bot)
+        content: Contenu du message
+        **extra: Champs supplémentaires (llm_used, response_time, ...)
+
+    Returns:
+        Le message
+    """
+    message = {
+        "id": uuid.uuid4().hex,
+        "sender": sender,
+        "content": content,
+        "timestamp": datetime.utcnow(),
+        "tags": [],
+        "metadata": {},
+    }
+    message.update(extra)
+    return message
+
+async def save_exchange(chatbot: Dict[str, Any], session_id: str, user_message: Dict[str, Any], bot_message: Dict[str, Any]) -> None:
+    """
+    Enregistre un échange (question + réponse)
+
+    L'échange est confié à l'écriture différée, qui le regroupe avec les autres
+    messages de la session dans une seule écriture.
+
+    Args:
+        chatbot: Document du chatbot
+        session_id: Identifiant de session
+        user_message: Message de l'utilisateur
+        bot_message: Réponse du chatbot
+    """
+    await message_ingestor.submit(chatbot, session_id, user_message, bot_message)
+
+async def stream_chat(request: ChatRequest, client: Dict[str, Any], chatbot: Dict[str, Any]) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Traite une requête de chat en relayant les tokens dès leur réception
+
+    La réponse complète n'est enregistrée qu'une seule fois, à la fin du flux.
+    Si le quota mensuel du client est atteint, le LLM de secours du chatbot est utilisé ;
+    sinon il prend le relais lorsque le LLM principal échoue ou tarde à répondre.
+    La question est d'abord transmise à la fonction pre_process du code personnalisé
+    du chatbot, s'il en a un ; la question d'origine est conservée dans l'historique.
+
+    Args:
+        request: Requête de chat
+        client: Document du client
+        chatbot: Document du chatbot
+
+    Yields:
+        Des événements ("token", {"t": ...}) puis un événement ("done", {...})
+
+    Raises:
+        LLMError: Si le fournisseur LLM échoue
+    """
+    llm_name = chatbot.get("default_llm") or settings.DEFAULT_LLM
+    fallback_llm = chatbot.get("fallback_llm")
+    if fallback_llm and await quota_engine.is_over_quota(client):
+        llm_name, fallback_llm = fallback_llm, None
+    provider_name, _ = resolve_llm(llm_name)
+    history = await history_store.get(chatbot["client_id"], request.session_id, request.last_message_id)
+    prompt = await pre_process_message(chatbot, request.message)
+    messages = await context_builder.build(chatbot, request.session_id, history, prompt)
+    user_message = new_message("user", request.message)
+
+    # Seules les premières questions d'une session, indépendantes du contexte, sont mises en cache
+    cacheable = not history
+    cached = await response_cache.get(chatbot, prompt) if cacheable else None
+
+    start = time.perf_counter()
+    shared = False
+    if cached is not None:
+        chunks = [cached]
+        yield "token", {"t": cached}
+    else:
+        chunks = []
+        # Les requêtes identiques en cours partagent un seul appel ; le LLM de secours
+        # peut prendre le relais en cas d'échec ou de lenteur du principal
+        key = request_coalescer.key(client["client_id"], messages, llm_name, fallback_llm)
+        flight = request_coalescer.subscribe(key, partial(llm_dispatcher.stream, messages, llm_name, fallback_llm))
+        shared = flight.shared
+        async for used_llm, chunk in flight:
+            llm_name = used_llm
+            chunks.append(chunk)
+            yield "token", {"t": chunk}
+        provider_name, _ = resolve_llm(llm_name)
+    response_time = (time.perf_counter() - start) * 1000
+    # Une réponse partagée n'a pas coûté d'appel : elle est comptabilisée comme un succès de cache
+    served_without_call = cached is not None or shared
+
+    response = "".join(chunks)
+    prompt_tokens = count_message_tokens(messages, provider_name)
+    completion_tokens = count_tokens(response, provider_name)
+    tokens = prompt_tokens + completion_tokens
+
+    bot_message = new_message(
+        "bot", response,
+        llm_used=llm_name, response_time=response_time,
+        # Tokens facturés par le fournisseur (aucun pour une réponse servie sans appel)
+        metadata={"cache_hit": cached is not None, "coalesced": shared,
+                  "tokens": 0 if served_without_call else tokens}
+    )
+    await save_exchange(chatbot, request.session_id, user_message, bot_message)
+    history_store.append(chatbot["client_id"], request.session_id, user_message, bot_message)
+    if not served_without_call:
+        llm_tokens.inc(prompt_tokens, provider=provider_name, kind="prompt")
+        llm_tokens.inc(completion_tokens, provider=provider_name, kind="completion")
+    quota_engine.record(client["client_id"], llm_name, tokens, cache_hit=served_without_call)
+    quota_alerter.notify_usage(client, await quota_engine.used(client["client_id"]))
+    if cacheable and not served_without_call:
+        response_cache.set(chatbot, prompt, bot_message["content"])
+
+    yield "done", {
+        "response": bot_message["content"],
+        "message_id": bot_message["id"],
+        "session_id": request.session_id,
+        "llm_used": llm_name,
+        "response_time": response_time,
+    }
+
+async def process_chat(request: ChatRequest, client: Dict[str, Any], chatbot: Dict[str, Any]) -> ChatResponse:
+    """
+    Traite une requête de chat et retourne la réponse complète
+
+    Args:
+        request: Requête de chat
+        client: Document du client
+        chatbot: Document du chatbot
+
+    Returns:
+        La réponse du chatbot
+
+    Raises:
+        LLMError: Si le fournisseur LLM échoue
+    """
+    async for event, data in stream_chat(request, client, chatbot):
+        if event == "done":
+            return ChatResponse(**data)
@@ -0,0 +1,331 @@
+"""
+Stockage des messages de conversation par compartiments
+
+Une conversation est composée :
+- d'un en-tête léger dans la collection conversations (client, chatbot, session,
+  dates, résumé et nombre de messages `message_count`) ;
+- de compartiments de CONVERSATION_BUCKET_SIZE messages au plus dans la collection
+  conversation_messages, identifiés par (session_id, seq, client_id).
+
+Chaque message reçoit une position dans la session (champ `position`), réservée
+par un $inc atomique sur l'en-tête : le message de position p est rangé dans le
+compartiment p // CONVERSATION_BUCKET_SIZE. La taille des documents reste ainsi
+bornée quelle que soit la longueur de la session, et la dernière page d'une
+conversation est lue dans un ou deux petits compartiments.
+
+Une écriture interrompue après la réservation laisse des positions inutilisées :
+les positions sont croissantes mais pas nécessairement contiguës. Les sessions qui
+n'ont pas pu être écrites sont retournées avec leurs positions, réutilisées lors
+d'une nouvelle tentative : des messages rejoués plus tard gardent leur place.
+
+Une session est comptée comme nouvelle conversation lorsque la réservation crée
+son en-tête (`new_conversation`), et non d'après la position de ses messages : le
+drapeau accompagne le premier message de la session jusqu'à son écriture.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.clients.stats import stats_rollups
+from app.config import settings
+from app.conversations.search import conversation_search, search_document
+from app.utils.db import conversation_buckets_collection, conversations_collection
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Réservations de positions simultanées lors d'une écriture par lots
+RESERVE_CONCURRENCY = 32
+
+class ConversationStore:
+    """
+    Lecture et écriture des messages de conversation par compartiments
+    """
+
+    def __init__(self, bucket_size: int = settings.CONVERSATION_BUCKET_SIZE):
+        self.bucket_size = bucket_size
+
+    async def append(self, entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Ajoute des messages à plusieurs sessions
+
+        Les positions sont réservées session par session (sauf pour les messages
+        qui en ont déjà une), puis tous les compartiments sont mis à jour en une
+        seule écriture (bulk_write) ; les messages écrits sont ensuite ajoutés à
+        l'index de recherche et aux statistiques.
+
+        Args:
+            entries: Sessions à compléter (client_id, session_id, chatbot_id, messages, updated_at)
+
+        Returns:
+            Les sessions qui n'ont pas pu être écrites, réduites aux messages des
+            compartiments rejetés et avec leurs positions lorsqu'elles ont pu être réservées
+        """
+        semaphore = asyncio.Semaphore(RESERVE_CONCURRENCY)
+
+        async def place(entry: Dict[str, Any]) -> Dict[str, Any]:
+            if self.placed(entry):
+                return entry
+            async with semaphore:
+                return self._positioned(entry, *await self._reserve(entry))
+
+        placements = await asyncio.gather(*(place(entry) for entry in entries), return_exceptions=True)
+        failed: List[Dict[str, Any]] = []
+        operations: List[UpdateOne] = []
+        # Session et messages de chaque opération, pour n'écarter que les compartiments rejetés
+        owners: List[Tuple[Dict[str, Any], List[Dict[str, Any]]]] = []
+        for entry, result in zip(entries, placements):
+            if isinstance(result, Exception):
+                logger.error(f"Réservation impossible pour la session {entry['session_id']}: {str(result)}")
+                failed.append(entry)
+                continue
+            for seq, messages in self._buckets(result["messages"]).items():
+                operations.append(self.bucket_operation(result["client_id"], result["session_id"], seq, messages))
+                owners.append((result, messages))
+        if not operations:
+            return failed
+
+        rejected: set = set()
+        try:
+            await conversation_buckets_collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            rejected = {error["index"] for error in e.details.get("writeErrors", [])}
+        except Exception as e:
+            logger.error(f"Écriture de {len(operations)} compartiment(s) de conversation impossible: {str(e)}")
+            rejected = set(range(len(operations)))
+
+        written: Dict[int, Tuple[Dict[str, Any], List[Dict[str, Any]]]] = {}
+        unwritten: Dict[int, Tuple[Dict[str, Any], List[Dict[str, Any]]]] = {}
+        for index, (entry, messages) in enumerate(owners):
+            parts = unwritten if index in rejected else written
+            parts.setdefault(id(entry), (entry, []))[1].extend(messages)
+        failed.extend(self._part(entry, messages) for entry, messages in unwritten.values())
+        await self._written([self._part(entry, messages) for entry, messages in written.values()])
+        return failed
+
+    async def append_once(self, entry: Dict[str, Any]) -> bool:
+        """
+        Ajoute à une session ceux de ses messages qui n'y sont pas déjà (rejeu)
+
+        Les positions réservées lors d'une précédente tentative sont réutilisées ;
+        celles réservées ici sont enregistrées dans `entry` avant l'écriture, pour
+        qu'un nouvel échec ne les réserve pas une seconde fois.
+
+        Args:
+            entry: Session à compléter (client_id, session_id, chatbot_id, messages, updated_at)
+
+        Returns:
+            True si des messages ont été ajoutés, False s'ils étaient tous déjà présents
+        """
+        ids = [message["id"] for message in entry["messages"]]
+        existing = set()
+        async for bucket in conversation_buckets_collection.find(
+            {"session_id": entry["session_id"], "client_id": entry["client_id"], "messages.id": {"$in": ids}},
+            {"messages.id": 1}
+        ):
+            existing.update(message["id"] for message in bucket["messages"])
+        missing = [message for message in entry["messages"] if message["id"] not in existing]
+        if not missing:
+            return False
+        entry.update(self._part(entry, missing))
+        if not self.placed(entry):
+            entry.update(self._positioned(entry, *await self._reserve(entry)))
+        await conversation_buckets_collection.bulk_write(self._bucket_operations(entry), ordered=True)
+        await self._written([entry])
+        return True
+
+    @staticmethod
+    def placed(entry: Dict[str, Any]) -> bool:
+        """
+        Indique si les messages d'une session ont déjà reçu leur position
+
+        Args:
+            entry: Session à compléter
+
+        Returns:
+            True si chaque message a une position
+        """
+        return all("position" in message for message in entry["messages"])
+
+    async def latest(self, client_id: str, session_id: str, limit: int) -> List[Dict[str, Any]]:
+        """
+        Retourne les derniers messages d'une session
+
+        Args:
+            client_id: Identifiant du client propriétaire de la session
+            session_id: Identifiant de session
+            limit: Nombre maximal de messages
+
+        Returns:
+            Les messages, du plus ancien au plus récent
+        """
+        messages, _ = await self.page(session_id, limit=limit, client_id=client_id)
+        return messages
+
+    async def page(self, session_id: str, before: Optional[int] = None, limit: int = 50,
+                   client_id: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        Retourne une page de messages d'une session, en remontant dans le temps
+
+        Args:
+            session_id: Identifiant de session
+            before: Position à partir de laquelle remonter (exclue), ou None pour la fin de la session
+            limit: Nombre maximal de messages
+            client_id: Identifiant du client propriétaire de la session (optionnel)
+
+        Returns:
+            Tuple (messages du plus ancien au plus récent, curseur de la page précédente ou None)
+        """
+        if limit <= 0 or (before is not None and before <= 0):
+            return [], None
+        query: Dict[str, Any] = {"session_id": session_id}
+        if client_id is not None:
+            query["client_id"] = client_id
+        if before is not None:
+            query["seq"] = {"$lte": (before - 1) // self.bucket_size}
+
+        # Les compartiments nécessaires sont lus en une seule requête
+        buckets = await conversation_buckets_collection.find(query, {"seq": 1, "messages": 1}) \
+            .sort("seq", -1) \
+            .limit(-(-limit // self.bucket_size) + 1) \
+            .to_list(None)
+        messages = [
+            message
+            for bucket in reversed(buckets)
+            for message in bucket["messages"]
+            if before is None or message["position"] < before
+        ]
+        page = messages[-limit:]
+        has_more = len(messages) > limit or bool(buckets and buckets[-1]["seq"] > 0)
+        return page, (page[0]["position"] if page and has_more else None)
+
+    async def between(self, client_id: str, session_id: str, after: int, before: int, limit: int) -> List[Dict[str, Any]]:
+        """
+        Retourne les premiers messages d'une session compris entre deux positions
+
+        Args:
+            client_id: Identifiant du client propriétaire de la session
+            session_id: Identifiant de session
+            after: Position à partir de laquelle lire (exclue)
+            before: Position à laquelle s'arrêter (exclue)
+            limit: Nombre maximal de messages
+
+        Returns:
+            Les messages, du plus ancien au plus récent
+        """
+        if limit <= 0 or before <= after + 1:
+            return []
+        first_seq = (after + 1) // self.bucket_size
+        last_seq = (before - 1) // self.bucket_size
+        buckets = conversation_buckets_collection.find(
+            {"session_id": session_id, "client_id": client_id, "seq": {"$gte": first_seq, "$lte": last_seq}},
+            {"seq": 1, "messages": 1}
+        ).sort("seq", 1)
+        messages: List[Dict[str, Any]] = []
+        async for bucket in buckets:
+            messages.extend(message for message in bucket["messages"] if after < message["position"] < before)
+            if len(messages) >= limit:
+                break
+        return messages[:limit]
+
+    async def _reserve(self, entry: Dict[str, Any]) -> Tuple[int, bool]:
+        """
+        Réserve les positions des messages dans l'en-tête de la session
+
+        Returns:
+            Tuple (première position réservée, True si l'en-tête vient d'être créé)
+        """
+        count = len(entry["messages"])
+        header = await conversations_collection.find_one_and_update(
+            {"session_id": entry["session_id"], "client_id": entry["client_id"]},
+            {
+                "$inc": {"message_count": count},
+                "$set": {"updated_at": entry["updated_at"]},
+                "$setOnInsert": {
+                    "chatbot_id": entry["chatbot_id"],
+                    "user_info": {},
+                    "timestamp": entry["messages"][0]["timestamp"],
+                },
+            },
+            projection={"message_count": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        if header is None:
+            return 0, True
+        return header.get("message_count", 0), False
+
+    @staticmethod
+    def _positioned(entry: Dict[str, Any], first: int, created: bool) -> Dict[str, Any]:
+        """Numérote les messages d'une session à partir de la première position réservée"""
+        messages = [dict(message, position=first + offset) for offset, message in enumerate(entry["messages"])]
+        return dict(entry, messages=messages, new_conversation=created)
+
+    @staticmethod
+    def _part(entry: Dict[str, Any], messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Réduit une session à une partie de ses messages ; seule celle du premier ouvre la conversation"""
+        new_conversation = bool(entry.get("new_conversation")) and entry["messages"][0] in messages
+        return dict(entry, messages=messages, new_conversation=new_conversation)
+
+    def _buckets(self, messages: List[Dict[str, Any]]) -> Dict[int, List[Dict[str, Any]]]:
+        """Répartit des messages numérotés entre leurs compartiments"""
+        buckets: Dict[int, List[Dict[str, Any]]] = {}
+        for message in messages:
+            buckets.setdefault(message["position"] // self.bucket_size, []).append(message)
+        return buckets
+
+    def _bucket_operations(self, entry: Dict[str, Any]) -> List[UpdateOne]:
+        """Construit les mises à jour des compartiments recevant les messages numérotés d'une session"""
+        return [
+            self.bucket_operation(entry["client_id"], entry["session_id"], seq, messages)
+            for seq, messages in self._buckets(entry["messages"]).items()
+        ]
+
+    async def _written(self, entries: List[Dict[str, Any]]) -> None:
+        """Comptabilise des messages écrits et les ajoute à l'index de recherche (un échec n'affecte pas leur écriture)"""
+        for entry in entries:
+            stats_rollups.record(entry["client_id"], entry["chatbot_id"], entry["messages"],
+                                 new_conversation=entry.get("new_conversation", False))
+        documents = [
+            search_document(entry["client_id"], entry["session_id"], message)
+            for entry in entries
+            for message in entry["messages"]
+        ]
+        try:
+            await conversation_search.index_documents(documents)
+        except Exception as e:
+            logger.error(f"Indexation de {len(documents)} message(s) impossible, "
+                         f"à reprendre avec app.utils.reindex_conversations: {str(e)}")
+
+    @staticmethod
+    def bucket_operation(client_id: str, session_id: str, seq: int, messages: List[Dict[str, Any]]) -> UpdateOne:
+        """
+        Construit la mise à jour ajoutant des messages positionnés à un compartiment
+
+        Args:
+            client_id: Identifiant du client
+            session_id: Identifiant de session
+            seq: Numéro du compartiment
+            messages: Messages (avec leur position)
+
+        Returns:
+            L'opération, qui crée le compartiment si nécessaire
+        """
+        return UpdateOne(
+            {"session_id": session_id, "seq": seq, "client_id": client_id},
+            {
+                # Des écritures concurrentes peuvent arriver dans le désordre : le tri conserve l'ordre des positions
+                "$push": {"messages": {"$each": messages, "$sort": {"position": 1}}},
+                "$inc": {"count": len(messages)},
+                "$min": {"first_timestamp": messages[0]["timestamp"]},
+                "$max": {"last_timestamp": messages[-1]["timestamp"]},
+            },
+            upsert=True
+        )
+
+# Instance partagée du stockage des conversations
+conversation_store = ConversationStore()
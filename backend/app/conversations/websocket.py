@@ -0,0 +1,178 @@
+"""
+Transport WebSocket des échanges du widget
+
+Le widget ouvre une connexion par session de visiteur
+(`/api/conversations/ws?client_id=...&session_id=...`) et y échange des trames
+JSON compactes, au lieu d'une requête HTTP (et de son preflight CORS) par
+message. Le champ `t` donne le type de trame :
+
+- widget -> serveur : `{"t": "m", "m": message, "l": dernier message connu}` pour
+  une question, `{"t": "p"}` pour un battement de cœur ;
+- serveur -> widget : `{"t": "r", "hb": intervalle, "h": [...]}` à l'ouverture,
+  `{"t": "k", "d": texte}` pour chaque token, `{"t": "d", "i": id, "l": llm, "ms": durée}`
+  en fin de réponse, `{"t": "e", "d": détail}` en cas d'erreur et `{"t": "p"}` en
+  réponse à un battement de cœur.
+
+Une réponse en cours se poursuit et est enregistrée même si la connexion tombe.
+À la reconnexion, le widget passe le dernier message reçu (`last_message_id`) :
+la trame d'ouverture contient alors les messages manqués (`h`, liste de
+`{"i": id, "s": expéditeur, "c": contenu}`), après la fin de la réponse en cours
+éventuelle. Une connexion sans trame pendant WS_IDLE_TIMEOUT secondes est fermée.
+Les trames binaires sont refusées par une trame d'erreur, la connexion restant ouverte.
+"""
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Optional, Set, Tuple
+
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+
+from app.config import settings
+from app.conversations.history import history_store
+from app.conversations.llm.providers import LLMError
+from app.conversations.models import ChatRequest
+from app.conversations.service import get_tenant, stream_chat
+from app.utils.metrics import registry
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Codes de fermeture propres à l'application (plage 4000-4999)
+CLOSE_IDLE = 4408
+
+class ChatSockets:
+    """
+    Connexions WebSocket du widget et réponses en cours par session
+    """
+
+    def __init__(self, heartbeat: float = settings.WS_HEARTBEAT_INTERVAL, idle_timeout: float = settings.WS_IDLE_TIMEOUT):
+        self.heartbeat = heartbeat
+        self.idle_timeout = idle_timeout
+        self._sockets: Set[WebSocket] = set()
+        # Réponse en cours de chaque session, qui survit à la connexion qui l'a demandée
+        self._turns: Dict[Tuple[str, str], asyncio.Task] = {}
+        registry.gauge("chat_websocket_connections", "Connexions WebSocket du widget ouvertes").set_function(
+            lambda: {(): float(len(self._sockets))})
+
+    async def serve(self, websocket: WebSocket, client_id: str, session_id: str,
+                    last_message_id: Optional[str] = None) -> None:
+        """
+        Traite une connexion jusqu'à sa fermeture
+
+        Args:
+            websocket: Connexion WebSocket (pas encore acceptée)
+            client_id: Identifiant du client
+            session_id: Identifiant de session du visiteur
+            last_message_id: Dernier message reçu par le widget, pour une reprise après déconnexion
+        """
+        try:
+            await get_tenant(client_id)
+        except HTTPException:
+            # Refus de la poignée de main : le widget se replie sur HTTP
+            await websocket.close()
+            return
+        await websocket.accept()
+        self._sockets.add(websocket)
+        key = (client_id, session_id)
+        try:
+            await self._send(websocket, await self._ready(key, last_message_id))
+            while True:
+                try:
+                    message = await asyncio.wait_for(websocket.receive(), timeout=self.idle_timeout)
+                except asyncio.TimeoutError:
+                    await websocket.close(code=CLOSE_IDLE)
+                    return
+                if message["type"] == "websocket.disconnect":
+                    return
+                # Une trame binaire ne porte pas de texte : elle est refusée comme une trame invalide
+                text = message.get("text")
+                try:
+                    frame = json.loads(text) if text is not None else None
+                    kind = frame.get("t")
+                except (ValueError, AttributeError):
+                    kind = None
+                if kind == "p":
+                    await self._send(websocket, {"t": "p"})
+                elif kind == "m":
+                    await self._start_turn(websocket, key, frame)
+                else:
+                    await self._send(websocket, {"t": "e", "d": "Trame invalide"})
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self._sockets.discard(websocket)
+
+    async def stop(self) -> None:
+        """Ferme les connexions et attend la fin des réponses en cours, qui sont ainsi enregistrées"""
+        for websocket in list(self._sockets):
+            try:
+                await websocket.close(code=1001)
+            except Exception:
+                pass
+        await asyncio.gather(*self._turns.values(), return_exceptions=True)
+
+    async def _ready(self, key: Tuple[str, str], last_message_id: Optional[str]) -> Dict[str, Any]:
+        """Construit la trame d'ouverture, avec les messages manqués depuis last_message_id"""
+        frame: Dict[str, Any] = {"t": "r", "hb": int(self.heartbeat * 1000)}
+        if not last_message_id:
+            return frame
+        # La réponse demandée par une connexion précédente est attendue pour être transmise
+        turn = self._turns.get(key)
+        if turn is not None:
+            await asyncio.wait([turn])
+        history = await history_store.get(key[0], key[1], last_message_id)
+        ids = [message["id"] for message in history]
+        if last_message_id in ids:
+            frame["h"] = [
+                {"i": message["id"], "s": message["sender"], "c": message["content"]}
+                for message in history[ids.index(last_message_id) + 1:]
+            ]
+        return frame
+
+    async def _start_turn(self, websocket: WebSocket, key: Tuple[str, str], frame: Dict[str, Any]) -> None:
+        """Démarre la réponse à une question, une seule à la fois par session"""
+        if key in self._turns:
+            await self._send(websocket, {"t": "e", "d": "Une réponse est déjà en cours"})
+            return
+        try:
+            request = ChatRequest(client_id=key[0], session_id=key[1], message=frame.get("m"),
+                                  last_message_id=frame.get("l"))
+        except ValidationError:
+            await self._send(websocket, {"t": "e", "d": "Message invalide"})
+            return
+        task = asyncio.create_task(self._turn(websocket, request))
+        self._turns[key] = task
+        task.add_done_callback(lambda _: self._turns.pop(key, None))
+
+    async def _turn(self, websocket: WebSocket, request: ChatRequest) -> None:
+        """Relaie les tokens d'une réponse ; la réponse est menée à son terme même si la connexion tombe"""
+        try:
+            client, chatbot = await get_tenant(request.client_id)
+            async for event, data in stream_chat(request, client, chatbot):
+                if event == "token":
+                    await self._send(websocket, {"t": "k", "d": data["t"]})
+                elif event == "done":
+                    await self._send(websocket, {"t": "d", "i": data["message_id"], "l": data["llm_used"],
+                                                 "ms": round(data["response_time"])})
+        except HTTPException as e:
+            await self._send(websocket, {"t": "e", "d": e.detail})
+        except LLMError as e:
+            logger.error(f"Erreur LLM: {str(e)}")
+            await self._send(websocket, {"t": "e", "d": "Le service de réponse est momentanément indisponible"})
+        except Exception as e:
+            logger.error(f"Erreur lors d'une réponse WebSocket: {str(e)}")
+            await self._send(websocket, {"t": "e", "d": "Erreur interne"})
+
+    async def _send(self, websocket: WebSocket, frame: Dict[str, Any]) -> None:
+        """Envoie une trame, sans effet si la connexion est fermée"""
+        if websocket not in self._sockets:
+            return
+        try:
+            await websocket.send_text(json.dumps(frame, ensure_ascii=False, separators=(",", ":")))
+        except Exception:
+            self._sockets.discard(websocket)
+
+# Instance partagée des connexions WebSocket
+chat_sockets = ChatSockets()
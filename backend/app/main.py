@@ -1,10 +1,12 @@
 """
 Point d'entrée principal de l'application FastAPI IAfluence
 """
-from fastapi import FastAPI, Depends, HTTPException, status
+import asyncio
+
+from fastapi import FastAPI, Depends, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 
 from app.auth.router import router as auth_router
 from app.clients.router import router as clients_router
@@ -12,8 +14,24 @@ from app.chatbots.router import router as chatbots_router
 from app.conversations.router import router as conversations_router
 from app.llm.router import router as llm_router
 from app.widgets.router import router as widgets_router
+from app.auth.models import User
+from app.auth.service import get_admin_user, password_hasher
+from app.clients.alerts import quota_alerter
+from app.clients.quota import quota_engine
+from app.clients.stats import stats_rollups
+from app.clients.tenants import tenant_cache
 from app.config import settings
-from app.utils.db import init_db
+from app.conversations.export import export_jobs
+from app.conversations.ingest import message_ingestor
+from app.conversations.websocket import chat_sockets
+from app.sandbox.executor import sandbox_pool
+from app.conversations.llm.providers import close_providers
+from app.utils.db import client as mongo_client, close_db, init_db, pool_monitor
+from app.utils.email import email_queue
+from app.utils.metrics import MetricsMiddleware, event_loop_monitor, registry
+from app.widgets.artifacts import widget_artifacts
+from app.widgets.bundle import widget_bundle
+from app.widgets.pages import pages
 
 # Création de l'application FastAPI
 app = FastAPI(
@@ -31,9 +49,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Mesure de la latence des requêtes
+app.add_middleware(MetricsMiddleware)
+
 # Montage des fichiers statiques
 app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/widgets", StaticFiles(directory="widgets"), name="widgets")
+# Ressources non versionnées, pour les snippets installés avant le chargeur (/api/widgets/loader.js)
+app.mount("/widgets", StaticFiles(directory=settings.WIDGET_DIR), name="widgets")
 
 # Inclusion des routers
 app.include_router(auth_router, prefix="/api/auth", tags=["Authentification"])
@@ -46,148 +68,72 @@ app.include_router(widgets_router, prefix="/api/widgets", tags=["Widgets"])
 @app.on_event("startup")
 async def startup_db_client():
     """Initialisation de la connexion à la base de données au démarrage"""
+    await event_loop_monitor.start()
     await init_db()
+    await email_queue.start()
+    await quota_alerter.start()
+    await quota_engine.start()
+    await tenant_cache.start()
+    await stats_rollups.start()
+    await message_ingestor.start()
+    await sandbox_pool.start()
+    await export_jobs.start()
+    await widget_bundle.start()
+    await widget_artifacts.start()
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    """Arrêt des pools de workers à l'arrêt de l'application"""
+    await chat_sockets.stop()
+    await export_jobs.stop()
+    await sandbox_pool.stop()
+    await message_ingestor.stop()
+    await stats_rollups.stop()
+    await tenant_cache.stop()
+    await quota_engine.stop()
+    await quota_alerter.stop()
+    await email_queue.stop()
+    password_hasher.shutdown()
+    await close_providers()
+    close_db()
+    await event_loop_monitor.stop()
 
 @app.get("/", response_class=HTMLResponse)
-async def root():
+async def root(request: Request):
     """Page d'accueil de l'API"""
-    return """
-    <html>
-        <head>
-            <title>IAfluence API</title>
-            <style>
-                body {
-                    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, Cantarell, 'Open Sans', 'Helvetica Neue', sans-serif;
-                    max-width: 800px;
-                    margin: 0 auto;
-                    padding: 2rem;
-                    line-height: 1.6;
-                }
-                h1 {
-                    color: #4f46e5;
-                }
-                a {
-                    color: #4f46e5;
-                    text-decoration: none;
-                }
-                a:hover {
-                    text-decoration: underline;
-                }
-                .card {
-                    background-color: #f9fafb;
-                    border-radius: 8px;
-                    padding: 1.5rem;
-                    margin-bottom: 1.5rem;
-                    box-shadow: 0 1px 3px rgba(0, 0, 0, 0.1);
-                }
-            </style>
-        </head>
-        <body>
-            <h1>IAfluence API</h1>
-            <div class="card">
-                <h2>Documentation</h2>
-                <p>Consultez la documentation interactive de l'API :</p>
-                <ul>
-                    <li><a href="/docs">Documentation Swagger</a></li>
-                    <li><a href="/redoc">Documentation ReDoc</a></li>
-                </ul>
-            </div>
-            <div class="card">
-                <h2>Administration</h2>
-                <p>Accédez à l'interface d'administration :</p>
-                <ul>
-                    <li><a href="/admin">Interface d'administration</a></li>
-                </ul>
-            </div>
-            <div class="card">
-                <h2>Statut</h2>
-                <p>L'API est opérationnelle.</p>
-            </div>
-            <footer>
-                <p>&copy; 2025 IAfluence. Tous droits réservés.</p>
-            </footer>
-        </body>
-    </html>
-    """
+    return pages.root().response(request)
 
 @app.get("/health")
 async def health_check():
     """Vérification de l'état de santé de l'API"""
     return {"status": "ok"}
 
-@app.get("/preview")
-async def preview(client_id: str):
-    """Prévisualisation du chatbot pour un client donné"""
-    # Cette route sera utilisée pour la prévisualisation du chatbot dans l'interface d'administration
-    return HTMLResponse(content=f"""
-    <html>
-        <head>
-            <title>Prévisualisation du chatbot</title>
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <link rel="stylesheet" href="/widgets/css/chatbot-widget.css">
-            <style>
-                body {{
-                    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, Cantarell, 'Open Sans', 'Helvetica Neue', sans-serif;
-                    margin: 0;
-                    padding: 0;
-                    height: 100vh;
-                    display: flex;
-                    justify-content: center;
-                    align-items: center;
-                    background-color: #f9fafb;
-                }}
-                .preview-container {{
-                    width: 100%;
-                    max-width: 400px;
-                    height: 600px;
-                    position: relative;
-                    overflow: hidden;
-                    border-radius: 12px;
-                    box-shadow: 0 4px 12px rgba(0, 0, 0, 0.15);
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="preview-container">
-                <div id="iafluence-chatbot-container" 
-                    data-position="bottom-right"
-                    data-primary-color="#4f46e5"
-                    data-secondary-color="#ffffff"
-                    data-chatbot-name="Assistant IA"
-                    data-welcome-message="Bonjour ! Comment puis-je vous aider aujourd'hui ?"
-                    data-logo-url=""
-                    data-show-branding="true"
-                    data-auto-open="true"
-                    data-delay-auto-open="0"
-                ></div>
-            </div>
-            <script>
-                // Configuration du chatbot pour la prévisualisation
-                var iafluenceConfig = {{
-                    clientId: '{client_id}',
-                    serverUrl: window.location.origin,
-                    options: {{
-                        position: 'bottom-right',
-                        primaryColor: '#4f46e5',
-                        secondaryColor: '#ffffff',
-                        chatbotName: 'Assistant IA',
-                        welcomeMessage: 'Bonjour ! Comment puis-je vous aider aujourd\\'hui ?',
-                        logoUrl: '',
-                        showBranding: true,
-                        autoOpen: true,
-                        delayAutoOpen: 0
-                    }}
-                }};
-            </script>
-            <script src="/widgets/js/chatbot-widget.js"></script>
-            <script>
-                // Initialisation du chatbot
-                document.addEventListener('DOMContentLoaded', function() {{
-                    if (window.IAfluenceChatbot) {{
-                        window.IAfluenceChatbot.init(iafluenceConfig);
-                    }}
-                }});
-            </script>
-        </body>
-    </html>
-    """)
+@app.get("/ready")
+async def readiness_check():
+    """Vérification que l'API peut traiter des requêtes (MongoDB joignable)"""
+    try:
+        await asyncio.wait_for(mongo_client.admin.command("ping"), timeout=settings.READINESS_TIMEOUT)
+    except Exception as e:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "unavailable", "mongodb": str(e) or type(e).__name__}
+        )
+    return {"status": "ok", "mongodb": "ok"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Métriques de l'API au format Prometheus"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/health/db")
+async def database_health(admin_user: User = Depends(get_admin_user)):
+    """Utilisation des pools de connexions MongoDB (réservé aux administrateurs)"""
+    return pool_monitor.stats()
+
+@app.get("/preview", response_class=HTMLResponse)
+async def preview(client_id: str, request: Request):
+    """Prévisualisation du chatbot d'un client, utilisée par l'interface d'administration et le plugin WordPress"""
+    page = await pages.preview(client_id)
+    if page is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chatbot introuvable")
+    return page.response(request)
@@ -0,0 +1,259 @@
+"""
+Pool de processus pour l'exécution du code personnalisé des chatbots
+
+Le code personnalisé (champ custom_code des chatbots) n'est jamais exécuté dans
+le processus de l'API : il est confié à un pool de processus démarrés à l'avance
+(voir app.sandbox.worker), limités en mémoire et en temps CPU. Chaque processus
+compile un code une seule fois, identifié par son empreinte, et ne le reçoit
+qu'à sa première utilisation.
+
+La boucle d'événements n'est jamais bloquée : les réponses sont lues lorsque le
+tube est prêt, et un processus qui ne répond pas dans SANDBOX_TIMEOUT est tué
+puis remplacé. Un script qui boucle indéfiniment n'immobilise donc qu'un
+processus de la sandbox, pendant au plus ce délai.
+"""
+import asyncio
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import time
+from typing import Any, Dict, Optional, Set
+
+from app.config import settings
+from app.sandbox.worker import run_worker
+from app.utils.metrics import registry
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+sandbox_calls = registry.histogram(
+    "sandbox_call_duration_seconds", "Durée des appels au code personnalisé, attente d'un processus comprise", ("outcome",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+sandbox_restarts = registry.counter(
+    "sandbox_worker_restarts_total", "Processus de la sandbox remplacés", ("reason",))
+
+class SandboxError(Exception):
+    """Erreur levée lorsque l'exécution du code personnalisé échoue"""
+
+class SandboxTimeout(SandboxError):
+    """Erreur levée lorsque le code personnalisé dépasse le délai imparti"""
+
+def code_hash(source: str) -> str:
+    """
+    Calcule l'empreinte d'un code personnalisé
+
+    Args:
+        source: Code source
+
+    Returns:
+        L'empreinte SHA-256 du code
+    """
+    return hashlib.sha256(source.encode()).hexdigest()
+
+class _Worker:
+    """Processus de la sandbox et son extrémité du tube"""
+
+    def __init__(self, context: Any, memory_limit_mb: int, cpu_limit: float):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(
+            target=run_worker, args=(child, memory_limit_mb, cpu_limit), name="sandbox-worker", daemon=True
+        )
+        self.process.start()
+        child.close()
+        self.known: Set[str] = set()
+        self.reply: Optional[asyncio.Future] = None
+
+    def kill(self) -> None:
+        """Arrête le processus immédiatement"""
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=1)
+        self.connection.close()
+
+class SandboxPool:
+    """
+    Pool de processus exécutant le code personnalisé des chatbots
+    """
+
+    def __init__(self, size: int = settings.SANDBOX_WORKERS, timeout: float = settings.SANDBOX_TIMEOUT,
+                 cpu_limit: float = settings.SANDBOX_CPU_LIMIT, memory_limit_mb: int = settings.SANDBOX_MEMORY_LIMIT_MB):
+        self.size = size
+        self.timeout = timeout
+        self.cpu_limit = cpu_limit
+        self.memory_limit_mb = memory_limit_mb
+        # forkserver : les processus sont créés depuis un serveur vierge, sans les threads de l'API
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            self._context = multiprocessing.get_context("forkserver")
+            self._context.set_forkserver_preload(["app.sandbox.worker"])
+        else:
+            self._context = multiprocessing.get_context("spawn")
+        self._idle: Optional[asyncio.Queue] = None
+        self._workers: Set[_Worker] = set()
+        self._ids = itertools.count()
+
+    @property
+    def started(self) -> bool:
+        """Indique si le pool est démarré"""
+        return self._idle is not None
+
+    async def start(self) -> None:
+        """Démarre les processus de la sandbox"""
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            self._idle.put_nowait(await self._spawn())
+        logger.info(f"Sandbox démarrée avec {self.size} processus")
+
+    async def stop(self) -> None:
+        """Arrête les processus de la sandbox"""
+        loop = asyncio.get_running_loop()
+        for worker in list(self._workers):
+            self._workers.discard(worker)
+            await loop.run_in_executor(None, worker.kill)
+        self._idle = None
+
+    async def run(self, source: str, entrypoint: str, *args: Any) -> Any:
+        """
+        Appelle une fonction du code personnalisé d'un chatbot
+
+        Args:
+            source: Code personnalisé
+            entrypoint: Nom de la fonction à appeler
+            *args: Arguments de la fonction (sérialisables)
+
+        Returns:
+            Le résultat de la fonction, ou None si le code ne la définit pas
+
+        Raises:
+            SandboxError: Si le code échoue, dépasse ses limites ou si aucun processus n'est disponible
+        """
+        if self._idle is None:
+            raise SandboxError("Sandbox non démarrée")
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            try:
+                worker = await asyncio.wait_for(self._idle.get(), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                outcome = "busy"
+                raise SandboxError("Aucun processus de la sandbox disponible")
+            try:
+                result = await self._call(worker, code_hash(source), source, entrypoint, args)
+                outcome = "success"
+                return result
+            except SandboxTimeout:
+                outcome = "timeout"
+                raise
+        finally:
+            sandbox_calls.observe(time.perf_counter() - start, outcome=outcome)
+
+    async def _call(self, worker: _Worker, digest: str, source: str, entrypoint: str, args: tuple) -> Any:
+        """Envoie un appel à un processus et attend sa réponse"""
+        healthy = False
+        try:
+            status, result = await self._exchange(worker, digest, None if digest in worker.known else source,
+                                                  entrypoint, args)
+            if status == "unknown_code":
+                status, result = await self._exchange(worker, digest, source, entrypoint, args)
+            worker.known.add(digest)
+            # Un processus qui signale une erreur fatale s'arrête après sa réponse
+            healthy = status != "fatal"
+        finally:
+            if healthy:
+                self._idle.put_nowait(worker)
+            else:
+                await self._replace(worker)
+        if status in ("error", "fatal"):
+            raise SandboxError(result)
+        return result
+
+    async def _exchange(self, worker: _Worker, digest: str, source: Optional[str], entrypoint: str, args: tuple) -> tuple:
+        """Transmet une requête et attend la réponse correspondante"""
+        loop = asyncio.get_running_loop()
+        request_id = next(self._ids)
+        worker.reply = loop.create_future()
+        fd = worker.connection.fileno()
+        loop.add_reader(fd, self._on_readable, worker)
+        try:
+            worker.connection.send((request_id, digest, source, entrypoint, args))
+            reply_id, status, result = await asyncio.wait_for(worker.reply, timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise SandboxTimeout(f"Délai de {self.timeout}s dépassé")
+        except (EOFError, OSError) as e:
+            raise SandboxError(f"Processus de la sandbox interrompu: {str(e) or type(e).__name__}")
+        finally:
+            loop.remove_reader(fd)
+            worker.reply = None
+        if reply_id != request_id:
+            raise SandboxError("Réponse inattendue du processus de la sandbox")
+        return status, result
+
+    def _on_readable(self, worker: _Worker) -> None:
+        """Lit la réponse d'un processus lorsque le tube est prêt"""
+        reply = worker.reply
+        try:
+            message = worker.connection.recv()
+        except (EOFError, OSError) as e:
+            asyncio.get_running_loop().remove_reader(worker.connection.fileno())
+            if reply is not None and not reply.done():
+                reply.set_exception(EOFError("fin du tube") if isinstance(e, EOFError) else e)
+            return
+        if reply is not None and not reply.done():
+            reply.set_result(message)
+
+    async def _spawn(self) -> _Worker:
+        """Démarre un processus (hors de la boucle d'événements)"""
+        loop = asyncio.get_running_loop()
+        worker = await loop.run_in_executor(None, _Worker, self._context, self.memory_limit_mb, self.cpu_limit)
+        self._workers.add(worker)
+        return worker
+
+    async def _replace(self, worker: _Worker) -> None:
+        """Remplace un processus bloqué ou interrompu"""
+        reason = "crash" if not worker.process.is_alive() else "timeout"
+        self._workers.discard(worker)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, worker.kill)
+        sandbox_restarts.inc(reason=reason)
+        logger.warning(f"Processus de la sandbox remplacé ({reason})")
+        if self._idle is not None:
+            self._idle.put_nowait(await self._spawn())
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Retourne l'état du pool
+
+        Returns:
+            Nombre de processus et de processus disponibles
+        """
+        return {
+            "workers": len(self._workers),
+            "idle": self._idle.qsize() if self._idle is not None else 0,
+        }
+
+# Instance partagée de la sandbox
+sandbox_pool = SandboxPool()
+
+async def pre_process_message(chatbot: Dict[str, Any], message: str) -> str:
+    """
+    Transforme la question d'un visiteur par la fonction pre_process du code personnalisé
+
+    En cas d'échec du code personnalisé, la question est utilisée telle quelle.
+
+    Args:
+        chatbot: Document du chatbot
+        message: Question du visiteur
+
+    Returns:
+        La question à envoyer au LLM
+    """
+    source = chatbot.get("custom_code")
+    if not source or not sandbox_pool.started:
+        return message
+    try:
+        result = await sandbox_pool.run(source, "pre_process", message)
+    except SandboxError as e:
+        logger.warning(f"Échec du code personnalisé du chatbot {chatbot.get('client_id')}: {str(e)}")
+        return message
+    return result if isinstance(result, str) and result else message
@@ -0,0 +1,141 @@
+"""
+Processus d'exécution du code personnalisé des chatbots
+
+Chaque processus du pool de la sandbox exécute cette boucle : il reçoit des
+appels par un tube, compile le code avec RestrictedPython la première fois qu'il
+le rencontre (identifié par son empreinte), exécute une seule fois son code de
+niveau module, puis appelle la fonction demandée.
+
+Protocole (objets Python transmis par multiprocessing.Connection) :
+- requête : (id, empreinte, code source ou None, fonction, arguments)
+- réponse : (id, "ok", résultat) | (id, "error", message) | (id, "unknown_code", None)
+  | (id, "fatal", message) lorsque le processus s'arrête après l'appel
+
+Les limites de ressources sont appliquées au processus par setrlimit : mémoire
+(RLIMIT_AS) et temps CPU par appel (RLIMIT_CPU, relevé avant chaque appel).
+
+Ce module n'importe rien de l'application afin de rester léger à démarrer.
+"""
+import math
+import operator
+import resource
+import signal
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+from RestrictedPython import compile_restricted, safe_globals, utility_builtins
+from RestrictedPython.Eval import default_guarded_getitem, default_guarded_getiter
+from RestrictedPython.Guards import full_write_guard, guarded_iter_unpack_sequence, guarded_unpack_sequence, safer_getattr
+from RestrictedPython.PrintCollector import PrintCollector
+
+# Nombre de codes compilés conservés par processus
+MAX_COMPILED = 256
+
+INPLACE_OPERATORS = {
+    "+=": operator.iadd, "-=": operator.isub, "*=": operator.imul, "/=": operator.itruediv,
+    "//=": operator.ifloordiv, "%=": operator.imod, "**=": operator.ipow,
+    "<<=": operator.ilshift, ">>=": operator.irshift, "&=": operator.iand, "|=": operator.ior, "^=": operator.ixor,
+}
+
+class CPUTimeExceeded(Exception):
+    """Erreur levée lorsque le temps CPU alloué à un appel est dépassé"""
+
+def _inplacevar(op: str, x: Any, y: Any) -> Any:
+    """Opérateurs d'affectation augmentée autorisés (x += y, ...)"""
+    return INPLACE_OPERATORS[op](x, y)
+
+def build_globals() -> Dict[str, Any]:
+    """
+    Construit l'espace de noms d'exécution du code personnalisé
+
+    Returns:
+        Les variables globales restreintes (builtins sûrs et gardes RestrictedPython)
+    """
+    namespace = dict(safe_globals)
+    namespace["__builtins__"] = dict(safe_globals["__builtins__"], **utility_builtins)
+    namespace.update({
+        "__name__": "custom_code",
+        "__metaclass__": type,
+        "_getattr_": safer_getattr,
+        "_getitem_": default_guarded_getitem,
+        "_getiter_": default_guarded_getiter,
+        "_iter_unpack_sequence_": guarded_iter_unpack_sequence,
+        "_unpack_sequence_": guarded_unpack_sequence,
+        "_write_": full_write_guard,
+        "_inplacevar_": _inplacevar,
+        "_print_": PrintCollector,
+    })
+    return namespace
+
+def _on_cpu_limit(signum: int, frame: Any) -> None:
+    raise CPUTimeExceeded("Temps CPU dépassé")
+
+def _set_cpu_limit(seconds: float) -> None:
+    """Autorise `seconds` secondes de CPU supplémentaires au processus"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = usage.ru_utime + usage.ru_stime
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = math.ceil(used + seconds)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+def _call(modules: "OrderedDict[str, Dict[str, Any]]", request: Tuple, cpu_limit: float) -> Tuple:
+    """Traite une requête et retourne la réponse"""
+    request_id, code_hash, source, entrypoint, args = request
+    namespace = modules.get(code_hash)
+    if namespace is None:
+        if source is None:
+            return request_id, "unknown_code", None
+        _set_cpu_limit(cpu_limit)
+        byte_code = compile_restricted(source, filename="<custom_code>", mode="exec")
+        namespace = build_globals()
+        exec(byte_code, namespace)
+        modules[code_hash] = namespace
+        while len(modules) > MAX_COMPILED:
+            modules.popitem(last=False)
+    modules.move_to_end(code_hash)
+
+    function = namespace.get(entrypoint)
+    if not callable(function):
+        return request_id, "ok", None
+    _set_cpu_limit(cpu_limit)
+    return request_id, "ok", function(*args)
+
+def run_worker(connection: Any, memory_limit_mb: int, cpu_limit: float) -> None:
+    """
+    Boucle principale d'un processus de la sandbox
+
+    Args:
+        connection: Extrémité du tube vers le processus de l'API
+        memory_limit_mb: Mémoire maximale du processus (Mo)
+        cpu_limit: Temps CPU maximal par appel (secondes)
+    """
+    # L'arrêt est piloté par le processus parent (fermeture du tube)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGXCPU, _on_cpu_limit)
+    if memory_limit_mb:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    modules: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    while True:
+        try:
+            request = connection.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            response = _call(modules, request, cpu_limit)
+        except MemoryError:
+            # L'état du processus n'est plus fiable : il sera remplacé
+            connection.send((request[0], "fatal", "Mémoire dépassée"))
+            return
+        except BaseException as e:
+            response = (request[0], "error", f"{type(e).__name__}: {str(e)}")
+        try:
+            connection.send(response)
+        except MemoryError:
+            return
+        except Exception as e:
+            # Résultat non transmissible (objet non sérialisable)
+            connection.send((request[0], "error", f"Résultat invalide: {str(e)}"))
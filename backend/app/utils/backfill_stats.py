@@ -0,0 +1,111 @@
+"""
+Calcul des statistiques pré-agrégées à partir de l'historique des conversations
+
+Usage :
+    python -m app.utils.backfill_stats [--client-id ID]
+
+Les messages antérieurs à la mise en service des compteurs (live_since, voir
+app.clients.stats) sont relus depuis les compartiments et comptabilisés dans des
+documents de source "backfill", supprimés puis recalculés à chaque exécution : la
+commande peut être relancée sans double comptage.
+
+Les réponses enregistrées sans métadonnée `tokens` sont estimées à partir de leur
+seul contenu (tokens de la réponse, sans ceux du contexte envoyé au LLM).
+
+Une conversation est comptée pour le premier message de son premier compartiment,
+comme à la création de son en-tête par les compteurs tenus au fil de l'eau.
+"""
+import argparse
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from pymongo import ReturnDocument
+
+from app.clients.stats import RollupKey, accumulate, llm_prices, rollup_operations
+from app.conversations.llm.context import count_tokens
+from app.conversations.llm.providers import resolve_llm
+from app.utils.db import (
+    conversation_buckets_collection, conversations_collection, stats_rollups_collection, stats_state_collection
+)
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+def estimate_tokens(message: Dict[str, Any]) -> int:
+    """
+    Estime les tokens d'une réponse enregistrée sans métadonnée `tokens`
+
+    Args:
+        message: Message du chatbot
+
+    Returns:
+        Nombre de tokens de la réponse (0 pour une réponse servie depuis le cache)
+    """
+    metadata = message.get("metadata") or {}
+    if metadata.get("cache_hit") or metadata.get("coalesced"):
+        return 0
+    provider_name, _ = resolve_llm(message.get("llm_used") or "")
+    return count_tokens(message.get("content", ""), provider_name)
+
+async def backfill(client_id: Optional[str] = None) -> int:
+    """
+    Recalcule les statistiques antérieures à la mise en service des compteurs
+
+    Args:
+        client_id: Client à traiter (tous par défaut)
+
+    Returns:
+        Nombre de documents de statistiques écrits
+    """
+    state = await stats_state_collection.find_one_and_update(
+        {"_id": "rollups"},
+        {"$setOnInsert": {"live_since": datetime.utcnow()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    live_since = state["live_since"]
+    query: Dict[str, Any] = {"client_id": client_id} if client_id else {}
+
+    deltas: Dict[RollupKey, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    chatbots: Dict[tuple, str] = {}
+    buckets = 0
+    async for bucket in conversation_buckets_collection.find(
+        dict(query, first_timestamp={"$lt": live_since}), {"client_id": 1, "session_id": 1, "seq": 1, "messages": 1}
+    ):
+        key = (bucket["client_id"], bucket["session_id"])
+        if key not in chatbots:
+            header = await conversations_collection.find_one(
+                {"session_id": key[1], "client_id": key[0]}, {"chatbot_id": 1}
+            )
+            chatbots[key] = (header or {}).get("chatbot_id") or ""
+        messages = [message for message in bucket["messages"] if message["timestamp"] < live_since]
+        new_conversation = bucket["seq"] == 0 and bool(messages) and messages[0] is bucket["messages"][0]
+        accumulate(deltas, key[0], chatbots[key], messages, tokens_of=estimate_tokens,
+                   new_conversation=new_conversation)
+        buckets += 1
+        if buckets % BATCH_SIZE == 0:
+            logger.info(f"{buckets} compartiment(s) traités")
+
+    await stats_rollups_collection.delete_many(dict(query, source="backfill"))
+    operations = rollup_operations(deltas, await llm_prices.get(), "backfill")
+    for start in range(0, len(operations), BATCH_SIZE):
+        await stats_rollups_collection.bulk_write(operations[start:start + BATCH_SIZE], ordered=False)
+    logger.info(f"Rattrapage terminé: {buckets} compartiment(s), {len(operations)} document(s) de statistiques "
+                f"(messages antérieurs au {live_since.isoformat()})")
+    return len(operations)
+
+def main() -> None:
+    """Point d'entrée en ligne de commande"""
+    parser = argparse.ArgumentParser(description="Calcul des statistiques à partir de l'historique des conversations")
+    parser.add_argument("--client-id", help="Traite un seul client")
+    args = parser.parse_args()
+    asyncio.run(backfill(args.client_id))
+
+if __name__ == "__main__":
+    main()
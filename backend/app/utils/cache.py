@@ -0,0 +1,108 @@
+"""
+Utilitaires de mise en cache en mémoire
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+_MISSING = object()
+
+class LRUCache:
+    """
+    Cache LRU borné en mémoire, avec expiration optionnelle des entrées
+
+    Le cache n'est pas protégé contre les accès concurrents entre threads : il est
+    destiné à être utilisé depuis la boucle d'événements asyncio.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None,
+                 on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        """
+        Args:
+            maxsize: Nombre maximum d'entrées conservées
+            ttl: Durée de vie des entrées en secondes (None pour aucune expiration)
+            on_evict: Fonction appelée avec (clé, valeur) pour chaque entrée évincée ou expirée
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Récupère une entrée du cache
+
+        Args:
+            key: Clé de l'entrée
+            default: Valeur retournée si l'entrée est absente ou expirée
+
+        Returns:
+            La valeur en cache ou la valeur par défaut
+        """
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            self.misses += 1
+            return default
+        value, expires_at = item
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._data[key]
+            if self.on_evict is not None:
+                self.on_evict(key, value)
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Ajoute ou remplace une entrée du cache, en évinçant la moins récemment utilisée si nécessaire
+
+        Args:
+            key: Clé de l'entrée
+            value: Valeur à mettre en cache
+            ttl: Durée de vie spécifique de l'entrée (par défaut celle du cache)
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            evicted, (value, _) = self._data.popitem(last=False)
+            if self.on_evict is not None:
+                self.on_evict(evicted, value)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Retire une entrée du cache
+
+        Args:
+            key: Clé de l'entrée
+            default: Valeur retournée si l'entrée est absente
+
+        Returns:
+            La valeur retirée ou la valeur par défaut
+        """
+        item = self._data.pop(key, _MISSING)
+        return default if item is _MISSING else item[0]
+
+    def keys(self) -> list:
+        """
+        Retourne les clés présentes dans le cache, de la moins à la plus récemment utilisée
+
+        Returns:
+            Liste des clés (les entrées expirées peuvent y figurer jusqu'à leur prochain accès)
+        """
+        return list(self._data)
+
+    def clear(self) -> None:
+        """Vide le cache"""
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
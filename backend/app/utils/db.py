@@ -1,26 +1,209 @@
 """
 Utilitaires pour la connexion à la base de données MongoDB
+
+Ce module possède les clients MongoDB de l'application : un client asynchrone
+(Motor) et un client synchrone (pymongo), créés une seule fois par processus avec
+les paramètres de pool, de délais et de compression de Settings, et fermés à
+l'arrêt. L'utilisation des pools est suivie par un ConnectionPoolListener.
 """
+import importlib.util
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
 import motor.motor_asyncio
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
 from pymongo.errors import ServerSelectionTimeoutError
+
 from app.config import settings
-import logging
+from app.utils.cache import LRUCache
+from app.utils.metrics import CommandTimer, registry
 
 # Configuration du logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Bibliothèque Python nécessaire à chaque algorithme de compression (zlib est toujours disponible)
+COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": None}
+
+def available_compressors(requested: str = settings.MONGODB_COMPRESSORS) -> List[str]:
+    """
+    Filtre les algorithmes de compression demandés selon les bibliothèques installées
+
+    Args:
+        requested: Algorithmes par ordre de préférence, séparés par des virgules
+
+    Returns:
+        Les algorithmes utilisables
+    """
+    compressors = []
+    for name in (item.strip() for item in requested.split(",")):
+        if name not in COMPRESSOR_MODULES:
+            continue
+        module = COMPRESSOR_MODULES[name]
+        if module is None or importlib.util.find_spec(module) is not None:
+            compressors.append(name)
+    return compressors
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """
+    Métriques des pools de connexions MongoDB
+
+    Les événements sont émis depuis les threads de pymongo : les compteurs sont
+    protégés par un verrou.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.pools = 0
+        self.connections = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.created = 0
+        self.closed = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.pool_cleared = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def pool_created(self, event: monitoring.PoolCreatedEvent) -> None:
+        with self._lock:
+            self.pools += 1
+
+    def pool_ready(self, event: monitoring.PoolReadyEvent) -> None:
+        pass
+
+    def pool_cleared(self, event: monitoring.PoolClearedEvent) -> None:
+        with self._lock:
+            self.pool_cleared += 1
+        logger.warning(f"Pool de connexions MongoDB vidé: {event.address}")
+
+    def pool_closed(self, event: monitoring.PoolClosedEvent) -> None:
+        with self._lock:
+            self.pools -= 1
+
+    def connection_created(self, event: monitoring.ConnectionCreatedEvent) -> None:
+        with self._lock:
+            self.connections += 1
+            self.created += 1
+
+    def connection_ready(self, event: monitoring.ConnectionReadyEvent) -> None:
+        pass
+
+    def connection_closed(self, event: monitoring.ConnectionClosedEvent) -> None:
+        with self._lock:
+            self.connections -= 1
+            self.closed += 1
+
+    def connection_check_out_started(self, event: monitoring.ConnectionCheckOutStartedEvent) -> None:
+        # La fin de l'attente est signalée dans le même thread
+        self._local.started_at = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+
+    def connection_check_out_failed(self, event: monitoring.ConnectionCheckOutFailedEvent) -> None:
+        with self._lock:
+            self.waiting -= 1
+            self.checkout_failures += 1
+        logger.warning(f"Échec d'obtention d'une connexion MongoDB ({event.reason})")
+
+    def connection_checked_out(self, event: monitoring.ConnectionCheckedOutEvent) -> None:
+        started_at = getattr(self._local, "started_at", None)
+        wait = time.perf_counter() - started_at if started_at is not None else 0.0
+        with self._lock:
+            self.waiting -= 1
+            self.in_use += 1
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def connection_checked_in(self, event: monitoring.ConnectionCheckedInEvent) -> None:
+        with self._lock:
+            self.in_use -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Retourne les métriques des pools
+
+        Returns:
+            Connexions ouvertes, utilisées et en attente, créations et fermetures
+            (renouvellement des connexions), échecs et temps d'attente (ms)
+        """
+        with self._lock:
+            return {
+                "max_pool_size": settings.MONGODB_MAX_POOL_SIZE,
+                "pools": self.pools,
+                "connections": self.connections,
+                "in_use": self.in_use,
+                "waiting": self.waiting,
+                "created": self.created,
+                "closed": self.closed,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "pool_cleared": self.pool_cleared,
+                "avg_wait_ms": (self.total_wait / self.checkouts) * 1000 if self.checkouts else 0.0,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+# Suivi des pools, commun aux clients asynchrone et synchrone
+pool_monitor = PoolMonitor()
+
+registry.gauge("mongodb_pool_connections", "Connexions MongoDB par état", ("state",)).set_function(
+    lambda: {(state,): pool_monitor.stats()[state] for state in ("connections", "in_use", "waiting")})
+registry.counter("mongodb_pool_events_total", "Événements des pools de connexions MongoDB", ("event",)).set_function(
+    lambda: {(event,): pool_monitor.stats()[event]
+             for event in ("created", "closed", "checkouts", "checkout_failures", "pool_cleared")})
+
+def client_options() -> Dict[str, Any]:
+    """
+    Retourne les options communes aux clients MongoDB
+
+    Returns:
+        Taille des pools, délais, compression et écouteurs d'événements
+    """
+    options = {
+        "maxPoolSize": settings.MONGODB_MAX_POOL_SIZE,
+        "minPoolSize": settings.MONGODB_MIN_POOL_SIZE,
+        "maxIdleTimeMS": settings.MONGODB_MAX_IDLE_TIME_MS,
+        "maxConnecting": settings.MONGODB_MAX_CONNECTING,
+        "waitQueueTimeoutMS": settings.MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+        "connectTimeoutMS": settings.MONGODB_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": settings.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+        "event_listeners": [pool_monitor, CommandTimer()],
+    }
+    compressors = available_compressors()
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+    return options
+
 # Client MongoDB asynchrone
-client = motor.motor_asyncio.AsyncIOMotorClient(settings.MONGODB_URL)
+client = motor.motor_asyncio.AsyncIOMotorClient(settings.MONGODB_URL, **client_options())
 db = client[settings.MONGODB_DB_NAME]
 
+# Client MongoDB synchrone, créé à la première utilisation
+_sync_client: Optional[MongoClient] = None
+_sync_client_lock = threading.Lock()
+
 # Collections
 clients_collection = db["clients"]
 chatbots_collection = db["chatbots"]
 conversations_collection = db["conversations"]
+conversation_buckets_collection = db["conversation_messages"]
+conversation_search_collection = db["conversation_search"]
 users_collection = db["users"]
 llm_usage_collection = db["llm_usage"]
+email_outbox_collection = db["email_outbox"]
+quota_alerts_collection = db["quota_alerts"]
+llms_collection = db["llms"]
+stats_rollups_collection = db["stats_rollups"]
+stats_state_collection = db["stats_state"]
+export_jobs_collection = db["export_jobs"]
+
+# Références aux bases des clients, réutilisées d'un appel à l'autre
+client_databases = LRUCache(maxsize=settings.TENANT_DB_CACHE_SIZE)
 
 async def init_db():
     """
@@ -34,10 +217,32 @@ async def init_db():
         # Création des index
         await clients_collection.create_index("client_id", unique=True)
         await chatbots_collection.create_index("client_id")
+        await clients_collection.create_index("updated_at")
+        await chatbots_collection.create_index("updated_at")
         await conversations_collection.create_index([("client_id", 1), ("timestamp", -1)])
         await conversations_collection.create_index("session_id")
+        await conversations_collection.create_index([("client_id", 1), ("session_id", 1)])
+        await conversation_buckets_collection.create_index(
+            [("session_id", 1), ("seq", 1), ("client_id", 1)], unique=True
+        )
+        await conversation_search_collection.create_index([("client_id", 1), ("message_id", 1)], unique=True)
+        await conversation_search_collection.create_index([("client_id", 1), ("timestamp", -1)])
+        await conversation_search_collection.create_index(
+            [("client_id", 1), ("content", "text"), ("tags", "text"), ("llm_used", "text")],
+            name="client_text",
+            weights={"content": 10, "tags": 5, "llm_used": 1},
+            default_language="french",
+            language_override="search_language"
+        )
         await users_collection.create_index("email", unique=True)
+        await stats_rollups_collection.create_index(
+            [("client_id", 1), ("granularity", 1), ("period", 1), ("chatbot_id", 1), ("llm", 1), ("source", 1)],
+            unique=True
+        )
         await llm_usage_collection.create_index([("client_id", 1), ("date", 1)])
+        await email_outbox_collection.create_index([("status", 1), ("next_attempt_at", 1)])
+        await quota_alerts_collection.create_index([("client_id", 1), ("month", 1), ("threshold", 1)], unique=True)
+        await export_jobs_collection.create_index("created_at")
         
         # Création de l'utilisateur admin par défaut s'il n'existe pas
         admin_exists = await users_collection.find_one({"email": settings.ADMIN_USERNAME})
@@ -62,19 +267,48 @@ def get_client_db(client_id: str):
     """
     Retourne une référence à la base de données spécifique d'un client
     
+    Les références sont réutilisées (LRU borné à TENANT_DB_CACHE_SIZE) : seule la
+    construction de l'objet Motor est évitée, aucune connexion n'est ouverte ici.
+    Les données des clients sont stockées dans les collections communes, filtrées
+    par client_id ; aucun index n'est donc créé dans ces bases.
+    
     Args:
         client_id: Identifiant unique du client
         
     Returns:
         Une référence à la base de données du client
     """
-    return client[f"{settings.MONGODB_DB_NAME}_{client_id}"]
+    database = client_databases.get(client_id)
+    if database is None:
+        database = client[f"{settings.MONGODB_DB_NAME}_{client_id}"]
+        client_databases.set(client_id, database)
+    return database
 
-def get_sync_client():
+def get_sync_client() -> MongoClient:
     """
-    Retourne un client MongoDB synchrone pour les opérations non-asynchrones
+    Retourne le client MongoDB synchrone pour les opérations non-asynchrones
+    
+    Le client et son pool de connexions sont partagés par tout le processus :
+    il ne doit pas être fermé par l'appelant.
     
     Returns:
-        Un client MongoDB synchrone
+        Le client MongoDB synchrone
+    """
+    global _sync_client
+    if _sync_client is None:
+        with _sync_client_lock:
+            if _sync_client is None:
+                _sync_client = MongoClient(settings.MONGODB_URL, **client_options())
+    return _sync_client
+
+def close_db() -> None:
+    """
+    Ferme les clients MongoDB et leurs pools de connexions
     """
-    return MongoClient(settings.MONGODB_URL)
+    global _sync_client
+    client.close()
+    with _sync_client_lock:
+        if _sync_client is not None:
+            _sync_client.close()
+            _sync_client = None
+    logger.info("Connexions MongoDB fermées")
@@ -1,20 +1,278 @@
 """
 Utilitaires pour l'envoi d'emails
+
+Les emails sont enregistrés dans une boîte d'envoi MongoDB (collection email_outbox)
+puis délivrés en arrière-plan par lots, sur une connexion SMTP réutilisée, avec
+nouvelles tentatives espacées de manière exponentielle en cas d'échec.
 """
+import asyncio
+import html
 import logging
 import smtplib
+from datetime import datetime, timedelta
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from typing import Any, Dict, List, Optional
 from app.config import settings
 from app.clients.models import Client
+from app.utils.db import email_outbox_collection
+from app.utils.workers import BoundedExecutor
 
 # Configuration du logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def build_message(email: Dict[str, Any]) -> MIMEMultipart:
+    """
+    Construit le message MIME d'un email de la boîte d'envoi
+
+    Args:
+        email: Document de la boîte d'envoi (to, subject, body, html_body)
+
+    Returns:
+        Le message MIME
+    """
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = email["subject"]
+    msg['From'] = settings.EMAIL_FROM
+    msg['To'] = email["to"]
+
+    # Ajout du corps du message (texte)
+    msg.attach(MIMEText(email["body"], 'plain'))
+
+    # Ajout du corps du message (HTML, si fourni)
+    if email.get("html_body"):
+        msg.attach(MIMEText(email["html_body"], 'html'))
+    return msg
+
+class SMTPConnection:
+    """
+    Connexion SMTP persistante, réutilisée entre les envois
+
+    Cette classe est bloquante : elle doit être utilisée depuis un thread unique.
+    """
+
+    def __init__(self):
+        self._server: Optional[smtplib.SMTP] = None
+
+    def send(self, email: Dict[str, Any]) -> Optional[str]:
+        """
+        Envoie un email sur la connexion courante
+
+        Args:
+            email: Document de la boîte d'envoi
+
+        Returns:
+            L'erreur rencontrée, ou None si l'email a été envoyé
+        """
+        try:
+            self._send(email)
+            return None
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # Connexion perdue : une reconnexion est tentée une fois
+            self.close()
+            try:
+                self._send(email)
+                return None
+            except Exception as e:
+                self.close()
+                return str(e)
+        except Exception as e:
+            return str(e)
+
+    def close(self) -> None:
+        """Ferme la connexion SMTP"""
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+    def _send(self, email: Dict[str, Any]) -> None:
+        """Envoie un email, en ouvrant la connexion si nécessaire"""
+        if self._server is None:
+            server = smtplib.SMTP(settings.SMTP_SERVER, settings.SMTP_PORT, timeout=settings.SMTP_TIMEOUT)
+            if settings.SMTP_STARTTLS:
+                server.starttls()
+            if settings.SMTP_USERNAME:
+                server.login(settings.SMTP_USERNAME, settings.SMTP_PASSWORD)
+            self._server = server
+        self._server.sendmail(settings.EMAIL_FROM, email["to"], build_message(email).as_string())
+
+class EmailQueue:
+    """
+    File d'envoi d'emails asynchrone adossée à la boîte d'envoi MongoDB
+
+    Statuts des emails : pending (en attente), sending (pris en charge par un
+    worker), sent (envoyé), failed (abandonné après EMAIL_MAX_ATTEMPTS tentatives).
+    Chaque email est marqué dès son envoi : un arrêt en cours de lot ne laisse pas
+    d'email envoyé au statut sending, qui serait renvoyé après EMAIL_CLAIM_TIMEOUT.
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # Envoi en cours, mené à son terme (statut compris) même si la tâche d'envoi est annulée
+        self._sending: Optional[asyncio.Task] = None
+        self._smtp = SMTPConnection()
+        self._executor = BoundedExecutor("smtp", max_workers=1, max_queue=1)
+        self.sent = 0
+        self.failed = 0
+
+    async def start(self) -> None:
+        """Démarre les tâches d'envoi et de reprise des emails en attente"""
+        self._queue = asyncio.Queue(maxsize=settings.EMAIL_QUEUE_SIZE)
+        self._tasks = [asyncio.create_task(self._deliver()), asyncio.create_task(self._sweep())]
+
+    async def stop(self) -> None:
+        """Envoie les emails déjà en file puis arrête les tâches"""
+        if self._queue is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=settings.SMTP_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning("Emails non envoyés à l'arrêt, ils seront repris au prochain démarrage")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._sending is not None:
+            await asyncio.gather(self._sending, return_exceptions=True)
+        # Fermeture dans le thread SMTP, après l'envoi éventuellement en cours sur la même connexion
+        await self._executor.run(self._smtp.close)
+        self._executor.shutdown()
+
+    async def enqueue(self, to: str, subject: str, body: str, html_body: str = None) -> Any:
+        """
+        Enregistre un email dans la boîte d'envoi et le place dans la file
+
+        Args:
+            to: Destinataire
+            subject: Sujet
+            body: Corps du message (texte)
+            html_body: Corps du message (HTML, optionnel)
+
+        Returns:
+            L'identifiant de l'email dans la boîte d'envoi
+        """
+        now = datetime.utcnow()
+        email = {
+            "to": to,
+            "subject": subject,
+            "body": body,
+            "html_body": html_body,
+            "status": "sending",
+            "attempts": 0,
+            "created_at": now,
+            "claimed_at": now,
+            "next_attempt_at": now,
+        }
+        result = await email_outbox_collection.insert_one(email)
+        email["_id"] = result.inserted_id
+
+        # File pleine ou non démarrée : l'email sera repris depuis la boîte d'envoi
+        try:
+            if self._queue is None:
+                raise asyncio.QueueFull
+            self._queue.put_nowait(email)
+        except asyncio.QueueFull:
+            await email_outbox_collection.update_one({"_id": email["_id"]}, {"$set": {"status": "pending"}})
+        return email["_id"]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Retourne les métriques de la file d'envoi
+
+        Returns:
+            Taille de la file, emails envoyés et en échec
+        """
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "sent": self.sent,
+            "failed": self.failed,
+        }
+
+    async def _deliver(self) -> None:
+        """Envoie les emails de la file par lots"""
+        while True:
+            try:
+                email = await asyncio.wait_for(self._queue.get(), timeout=settings.SMTP_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                # Connexion inutilisée : elle est fermée jusqu'au prochain envoi
+                await self._executor.run(self._smtp.close)
+                continue
+
+            batch = [email]
+            while len(batch) < settings.EMAIL_BATCH_SIZE and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                for email in batch:
+                    self._sending = asyncio.ensure_future(self._send(email))
+                    await asyncio.shield(self._sending)
+            except Exception as e:
+                logger.error(f"Erreur lors de l'envoi d'un lot d'emails: {str(e)}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _send(self, email: Dict[str, Any]) -> None:
+        """Envoie un email puis met à jour son statut dans la boîte d'envoi"""
+        error = await self._executor.run(self._smtp.send, email)
+        now = datetime.utcnow()
+        attempts = email.get("attempts", 0) + 1
+        if error is None:
+            self.sent += 1
+            update = {"status": "sent", "sent_at": now, "attempts": attempts}
+        elif attempts >= settings.EMAIL_MAX_ATTEMPTS:
+            self.failed += 1
+            logger.error(f"Abandon de l'envoi de l'email {email['_id']}: {error}")
+            update = {"status": "failed", "last_error": error, "attempts": attempts}
+        else:
+            delay = settings.EMAIL_RETRY_BASE_DELAY * 2 ** (attempts - 1)
+            logger.warning(f"Échec de l'envoi de l'email {email['_id']}, nouvelle tentative dans {delay}s: {error}")
+            update = {
+                "status": "pending",
+                "last_error": error,
+                "attempts": attempts,
+                "next_attempt_at": now + timedelta(seconds=delay),
+            }
+        await email_outbox_collection.update_one({"_id": email["_id"]}, {"$set": update})
+
+    async def _sweep(self) -> None:
+        """Reprend périodiquement les emails en attente dont l'échéance est passée"""
+        while True:
+            try:
+                await self._claim_due()
+            except Exception as e:
+                logger.error(f"Erreur lors de la reprise des emails en attente: {str(e)}")
+            await asyncio.sleep(settings.EMAIL_SWEEP_INTERVAL)
+
+    async def _claim_due(self) -> None:
+        """Prend en charge atomiquement les emails à (re)tenter, dans la limite de la file"""
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=settings.EMAIL_CLAIM_TIMEOUT)
+        while not self._queue.full():
+            email = await email_outbox_collection.find_one_and_update(
+                {"$or": [
+                    {"status": "pending", "next_attempt_at": {"$lte": now}},
+                    {"status": "sending", "claimed_at": {"$lt": stale}},
+                ]},
+                {"$set": {"status": "sending", "claimed_at": now}},
+                sort=[("next_attempt_at", 1)]
+            )
+            if email is None:
+                break
+            self._queue.put_nowait(email)
+
+# Instance partagée de la file d'envoi
+email_queue = EmailQueue()
+
 async def send_email(to: str, subject: str, body: str, html_body: str = None) -> bool:
     """
-    Envoie un email
+    Envoie un email en arrière-plan
+
+    L'email est enregistré dans la boîte d'envoi et délivré par la file d'envoi :
+    l'appel retourne sans attendre le serveur SMTP.
     
     Args:
         to: Destinataire
@@ -23,43 +281,20 @@ async def send_email(to: str, subject: str, body: str, html_body: str = None) ->
         html_body: Corps du message (HTML, optionnel)
         
     Returns:
-        True si l'email a été envoyé avec succès, False sinon
+        True si l'email a été placé dans la boîte d'envoi, False sinon
     """
     # Vérification des paramètres SMTP
-    if not all([settings.SMTP_SERVER, settings.SMTP_PORT, settings.SMTP_USERNAME, settings.SMTP_PASSWORD, settings.EMAIL_FROM]):
+    if not all([settings.SMTP_SERVER, settings.SMTP_PORT, settings.EMAIL_FROM]):
         logger.warning("Paramètres SMTP incomplets, impossible d'envoyer l'email")
         return False
     
     try:
-        # Création du message
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = subject
-        msg['From'] = settings.EMAIL_FROM
-        msg['To'] = to
-        
-        # Ajout du corps du message (texte)
-        part1 = MIMEText(body, 'plain')
-        msg.attach(part1)
-        
-        # Ajout du corps du message (HTML, si fourni)
-        if html_body:
-            part2 = MIMEText(html_body, 'html')
-            msg.attach(part2)
-        
-        # Connexion au serveur SMTP
-        server = smtplib.SMTP(settings.SMTP_SERVER, settings.SMTP_PORT)
-        server.starttls()
-        server.login(settings.SMTP_USERNAME, settings.SMTP_PASSWORD)
-        
-        # Envoi de l'email
-        server.sendmail(settings.EMAIL_FROM, to, msg.as_string())
-        server.quit()
-        
-        logger.info(f"Email envoyé à {to}")
+        await email_queue.enqueue(to, subject, body, html_body)
+        logger.info(f"Email pour {to} placé dans la boîte d'envoi")
         return True
         
     except Exception as e:
-        logger.error(f"Erreur lors de l'envoi de l'email: {str(e)}")
+        logger.error(f"Erreur lors de l'enregistrement de l'email: {str(e)}")
         return False
 
 async def send_quota_alert_email(client: Client) -> bool:
@@ -122,3 +357,76 @@ L'équipe IAfluence
 """
     
     return await send_email(settings.ADMIN_EMAIL, subject, body, html_body)
+
+async def send_quota_digest_email(alerts: List[Dict[str, Any]]) -> bool:
+    """
+    Envoie un email récapitulatif des seuils de quota franchis
+
+    Args:
+        alerts: Alertes (client_id, name, threshold, monthly_quota, used)
+
+    Returns:
+        True si l'email a été placé dans la boîte d'envoi, False sinon
+    """
+    subject = f"[IAfluence] Alertes quota - {len(alerts)} seuil(s) franchi(s)"
+
+    lines = "\n".join(
+        f"- {a['name']} (ID: {a['client_id']}) : {a['threshold']} % du quota atteint "
+        f"({a['used']} / {a['monthly_quota']} requêtes)"
+        for a in alerts
+    )
+    body = f"""
+Bonjour,
+
+Les clients suivants ont franchi un seuil de leur quota mensuel de requêtes LLM :
+
+{lines}
+
+Au-delà de 100 %, le système bascule automatiquement vers le LLM de secours pour assurer la continuité du service.
+
+Cordialement,
+L'équipe IAfluence
+"""
+
+    rows = "".join(
+        f"<tr><td>{html.escape(a['name'])}</td><td><code>{html.escape(a['client_id'])}</code></td>"
+        f"<td>{a['threshold']} %</td><td>{a['used']} / {a['monthly_quota']}</td></tr>"
+        for a in alerts
+    )
+    html_body = f"""
+<html>
+<head>
+    <style>
+        body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
+        .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
+        .header {{ background-color: #4f46e5; color: white; padding: 10px 20px; border-radius: 5px 5px 0 0; }}
+        .content {{ padding: 20px; border: 1px solid #ddd; border-top: none; border-radius: 0 0 5px 5px; }}
+        .footer {{ margin-top: 20px; font-size: 12px; color: #777; }}
+        table {{ width: 100%; border-collapse: collapse; }}
+        td, th {{ padding: 6px; border-bottom: 1px solid #eee; text-align: left; }}
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h2>Alertes quota</h2>
+        </div>
+        <div class="content">
+            <p>Bonjour,</p>
+            <p>Les clients suivants ont franchi un seuil de leur quota mensuel de requêtes LLM :</p>
+            <table>
+                <tr><th>Client</th><th>ID</th><th>Seuil</th><th>Consommation</th></tr>
+                {rows}
+            </table>
+            <p>Au-delà de 100 %, le système bascule automatiquement vers le LLM de secours pour assurer la continuité du service.</p>
+            <p>Cordialement,<br>L'équipe IAfluence</p>
+        </div>
+        <div class="footer">
+            <p>Cet email a été envoyé automatiquement par le système IAfluence. Merci de ne pas y répondre.</p>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+    return await send_email(settings.ADMIN_EMAIL, subject, body, html_body)
@@ -0,0 +1,354 @@
+"""
+Métriques de l'application au format d'exposition Prometheus
+
+Le module fournit des compteurs, jauges et histogrammes avec étiquettes, un
+middleware ASGI mesurant la latence de chaque route, un écouteur des commandes
+MongoDB et un échantillonneur du retard de la boucle d'événements. Les métriques
+sont exposées par la route /metrics.
+
+Les valeurs peuvent être mises à jour depuis des threads (événements pymongo) :
+elles sont protégées par un verrou.
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+from app.config import settings
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Bornes par défaut des histogrammes de latence (secondes)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_value(value: float) -> str:
+    """Formate une valeur numérique selon le format d'exposition"""
+    if value == math.inf:
+        return "+Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    """Formate les étiquettes d'un échantillon"""
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+class Metric:
+    """
+    Classe de base d'une métrique avec étiquettes
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._function: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None
+
+    def set_function(self, function: Callable[[], Dict[Tuple[str, ...], float]]) -> None:
+        """
+        Calcule les valeurs de la métrique à chaque lecture, à partir de compteurs tenus ailleurs
+
+        Args:
+            function: Fonction retournant les valeurs par tuple de valeurs d'étiquettes
+        """
+        self._function = function
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        """Retourne la clé des valeurs d'étiquettes dans l'ordre déclaré"""
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, Tuple[str, ...], Tuple[str, ...], float]]:
+        """Retourne les échantillons (suffixe, noms et valeurs des étiquettes, valeur)"""
+        if self._function is not None:
+            return [("", self.labelnames, key, value) for key, value in self._function().items()]
+        with self._lock:
+            return [("", self.labelnames, key, value) for key, value in self._values.items()]
+
+    def render(self) -> str:
+        """Retourne la métrique au format d'exposition Prometheus"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(Metric):
+    """Compteur monotone"""
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        """
+        Incrémente le compteur
+
+        Args:
+            amount: Valeur ajoutée
+            **labels: Valeurs des étiquettes
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """Jauge"""
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        """
+        Fixe la valeur de la jauge
+
+        Args:
+            value: Nouvelle valeur
+            **labels: Valeurs des étiquettes
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        """
+        Incrémente (ou décrémente si amount est négatif) la jauge
+
+        Args:
+            amount: Valeur ajoutée
+            **labels: Valeurs des étiquettes
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Histogram(Metric):
+    """Histogramme cumulatif à bornes fixes"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        """
+        Enregistre une observation
+
+        Args:
+            value: Valeur observée
+            **labels: Valeurs des étiquettes
+        """
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = state[0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """
+        Mesure la durée d'un bloc de code
+
+        Args:
+            **labels: Valeurs des étiquettes
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[Tuple[str, Tuple[str, ...], Tuple[str, ...], float]]:
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        samples = []
+        names = self.labelnames + ("le",)
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", names, key + (_format_value(bound),), cumulative))
+            samples.append(("_sum", self.labelnames, key, total))
+            samples.append(("_count", self.labelnames, key, count))
+        return samples
+
+class Registry:
+    """
+    Ensemble des métriques exposées
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """Déclare (ou retourne) un compteur"""
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        """Déclare (ou retourne) une jauge"""
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """Déclare (ou retourne) un histogramme"""
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        Retourne toutes les métriques au format d'exposition Prometheus
+
+        Returns:
+            Le texte à servir sur /metrics
+        """
+        blocks = []
+        for metric in self._metrics.values():
+            try:
+                blocks.append(metric.render())
+            except Exception as e:
+                logger.error(f"Erreur lors du calcul de la métrique {metric.name}: {str(e)}")
+        return "\n".join(blocks) + "\n"
+
+# Registre partagé des métriques
+registry = Registry()
+
+http_requests = registry.counter(
+    "http_requests_total", "Requêtes HTTP traitées", ("method", "route", "status"))
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "Durée des requêtes HTTP, jusqu'à la fin de la réponse", ("method", "route"))
+http_requests_in_progress = registry.gauge(
+    "http_requests_in_progress", "Requêtes HTTP en cours")
+mongo_command_duration = registry.histogram(
+    "mongodb_command_duration_seconds", "Durée des commandes MongoDB", ("command", "outcome"))
+llm_request_duration = registry.histogram(
+    "llm_request_duration_seconds", "Durée des appels aux fournisseurs LLM", ("provider", "operation", "outcome"),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0))
+llm_time_to_first_token = registry.histogram(
+    "llm_time_to_first_token_seconds", "Délai avant le premier fragment de réponse des fournisseurs LLM", ("provider",),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 20.0))
+llm_tokens = registry.counter(
+    "llm_tokens_total", "Tokens envoyés et reçus des fournisseurs LLM", ("provider", "kind"))
+event_loop_lag = registry.histogram(
+    "event_loop_lag_seconds", "Retard de la boucle d'événements",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+event_loop_lag_last = registry.gauge(
+    "event_loop_lag_last_seconds", "Dernier retard mesuré de la boucle d'événements")
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI mesurant le nombre et la durée des requêtes HTTP par route
+
+    Les routes sont identifiées par leur modèle de chemin (par exemple
+    /api/conversations/{conversation_id}) afin de borner le nombre de séries.
+    La durée inclut l'envoi complet des réponses en streaming.
+    """
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    def _route(self, scope: Dict[str, Any]) -> str:
+        """
+        Retourne le modèle de chemin de la route renseignée par le routeur lors de la correspondance
+
+        Les versions récentes de FastAPI n'y placent que la route du routeur inclus,
+        sans son préfixe : le modèle complet est alors lu dans le contexte de la route.
+        """
+        context = (scope.get("fastapi") or {}).get("effective_route_context")
+        path = getattr(context, "path_format", None) or getattr(scope.get("route"), "path", None)
+        return path or "unmatched"
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_progress.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_progress.inc(-1)
+            route = self._route(scope)
+            http_request_duration.observe(time.perf_counter() - start, method=scope["method"], route=route)
+            http_requests.inc(method=scope["method"], route=route, status=status_code)
+
+class CommandTimer(monitoring.CommandListener):
+    """
+    Écouteur pymongo mesurant la durée des commandes MongoDB (appelé depuis les threads de pymongo)
+    """
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        mongo_command_duration.observe(event.duration_micros / 1e6, command=event.command_name, outcome="success")
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        mongo_command_duration.observe(event.duration_micros / 1e6, command=event.command_name, outcome="failure")
+
+class EventLoopMonitor:
+    """
+    Échantillonnage du retard de la boucle d'événements
+
+    Une tâche se met en sommeil pour un intervalle fixe : le dépassement mesuré au
+    réveil correspond au temps pendant lequel la boucle était bloquée.
+    """
+
+    def __init__(self, interval: float = settings.EVENT_LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Démarre l'échantillonnage"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Arrête l'échantillonnage"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        """Mesure périodiquement le retard de la boucle"""
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            event_loop_lag.observe(lag)
+            event_loop_lag_last.set(lag)
+
+# Instance partagée de l'échantillonneur
+event_loop_monitor = EventLoopMonitor()
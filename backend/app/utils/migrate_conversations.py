@@ -0,0 +1,134 @@
+"""
+Migration des conversations vers le stockage par compartiments
+
+Usage :
+    python -m app.utils.migrate_conversations [--client-id ID]
+
+Les messages stockés dans le tableau `messages` des documents de la collection
+conversations sont répartis dans des compartiments (collection
+conversation_messages), puis le tableau est retiré de l'en-tête et remplacé par
+`message_count`.
+
+Les messages déjà écrits dans des compartiments pour la même session (par une
+version récente de l'application démarrée avant la migration) sont conservés à
+la suite des anciens messages et renumérotés. La migration est idempotente et peut
+être relancée ; elle doit toutefois être exécutée application arrêtée, ou avant
+le déploiement, pour qu'aucun message ne soit écrit pendant la renumérotation.
+"""
+import argparse
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReplaceOne
+
+from app.config import settings
+from app.utils.db import conversation_buckets_collection, conversations_collection
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+
+def build_buckets(client_id: str, session_id: str, messages: List[Dict[str, Any]],
+                  bucket_size: int = settings.CONVERSATION_BUCKET_SIZE) -> List[Dict[str, Any]]:
+    """
+    Répartit les messages d'une session dans des compartiments
+
+    Args:
+        client_id: Identifiant du client
+        session_id: Identifiant de session
+        messages: Messages de la session, du plus ancien au plus récent
+        bucket_size: Nombre de messages par compartiment
+
+    Returns:
+        Les documents des compartiments, les messages étant numérotés à partir de 0
+    """
+    buckets = []
+    for seq, start in enumerate(range(0, len(messages), bucket_size)):
+        chunk = [dict(message, position=start + offset)
+                 for offset, message in enumerate(messages[start:start + bucket_size])]
+        buckets.append({
+            "session_id": session_id,
+            "seq": seq,
+            "client_id": client_id,
+            "messages": chunk,
+            "count": len(chunk),
+            "first_timestamp": chunk[0]["timestamp"],
+            "last_timestamp": chunk[-1]["timestamp"],
+        })
+    return buckets
+
+async def migrate_conversation(conversation: Dict[str, Any]) -> int:
+    """
+    Migre une conversation vers le stockage par compartiments
+
+    Args:
+        conversation: Document de la conversation (avec son tableau messages)
+
+    Returns:
+        Nombre de messages de la conversation après migration
+    """
+    client_id, session_id = conversation["client_id"], conversation["session_id"]
+    legacy = conversation.get("messages") or []
+    known = {message["id"] for message in legacy}
+    existing = await conversation_buckets_collection.find(
+        {"session_id": session_id, "client_id": client_id}
+    ).sort("seq", 1).to_list(None)
+    recent = [
+        {key: value for key, value in message.items() if key != "position"}
+        for bucket in existing
+        for message in sorted(bucket["messages"], key=lambda item: item["position"])
+        if message["id"] not in known
+    ]
+
+    buckets = build_buckets(client_id, session_id, legacy + recent)
+    if buckets:
+        await conversation_buckets_collection.bulk_write([
+            ReplaceOne({"session_id": session_id, "seq": bucket["seq"], "client_id": client_id}, bucket, upsert=True)
+            for bucket in buckets
+        ], ordered=False)
+    await conversation_buckets_collection.delete_many(
+        {"session_id": session_id, "client_id": client_id, "seq": {"$gte": len(buckets)}}
+    )
+    await conversations_collection.update_one(
+        {"_id": conversation["_id"]},
+        {"$set": {"message_count": len(legacy) + len(recent)}, "$unset": {"messages": ""}}
+    )
+    return len(legacy) + len(recent)
+
+async def migrate(client_id: Optional[str] = None) -> int:
+    """
+    Migre toutes les conversations encore au format d'origine
+
+    Args:
+        client_id: Client à migrer (tous par défaut)
+
+    Returns:
+        Nombre de conversations migrées
+    """
+    query: Dict[str, Any] = {"messages": {"$exists": True}}
+    if client_id:
+        query["client_id"] = client_id
+
+    migrated = 0
+    messages = 0
+    cursor = conversations_collection.find(query).batch_size(BATCH_SIZE)
+    async for conversation in cursor:
+        messages += await migrate_conversation(conversation)
+        migrated += 1
+        if migrated % BATCH_SIZE == 0:
+            logger.info(f"{migrated} conversation(s) migrées")
+    logger.info(f"Migration terminée: {migrated} conversation(s), {messages} message(s)")
+    return migrated
+
+def main() -> None:
+    """Point d'entrée en ligne de commande"""
+    parser = argparse.ArgumentParser(description="Migration des conversations vers le stockage par compartiments")
+    parser.add_argument("--client-id", help="Migre les conversations d'un seul client")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.client_id))
+
+if __name__ == "__main__":
+    main()
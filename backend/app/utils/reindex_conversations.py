@@ -0,0 +1,66 @@
+"""
+Reconstruction de l'index de recherche des messages de conversation
+
+Usage :
+    python -m app.utils.reindex_conversations [--client-id ID] [--drop]
+
+Les messages sont relus depuis les compartiments (collection conversation_messages)
+et ajoutés à la collection conversation_search. L'opération est idempotente : les
+messages déjà indexés sont ignorés. Avec --drop, l'index du client (ou l'index
+complet) est vidé au préalable.
+"""
+import argparse
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from app.conversations.search import conversation_search, search_document
+from app.utils.db import conversation_buckets_collection, conversation_search_collection
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+async def reindex(client_id: Optional[str] = None, drop: bool = False) -> int:
+    """
+    Indexe les messages d'un ou de tous les clients
+
+    Args:
+        client_id: Client à indexer (tous par défaut)
+        drop: Vide l'index avant de le reconstruire
+
+    Returns:
+        Nombre de messages parcourus
+    """
+    query: Dict[str, Any] = {"client_id": client_id} if client_id else {}
+    if drop:
+        await conversation_search_collection.delete_many(query)
+
+    indexed = 0
+    batch: List[Dict[str, Any]] = []
+    async for bucket in conversation_buckets_collection.find(query):
+        for message in bucket["messages"]:
+            batch.append(search_document(bucket["client_id"], bucket["session_id"], message))
+        if len(batch) >= BATCH_SIZE:
+            await conversation_search.index_documents(batch)
+            indexed += len(batch)
+            batch = []
+            logger.info(f"{indexed} message(s) indexés")
+    if batch:
+        await conversation_search.index_documents(batch)
+        indexed += len(batch)
+    logger.info(f"Indexation terminée: {indexed} message(s)")
+    return indexed
+
+def main() -> None:
+    """Point d'entrée en ligne de commande"""
+    parser = argparse.ArgumentParser(description="Reconstruction de l'index de recherche des conversations")
+    parser.add_argument("--client-id", help="Indexe les conversations d'un seul client")
+    parser.add_argument("--drop", action="store_true", help="Vide l'index avant de le reconstruire")
+    args = parser.parse_args()
+    asyncio.run(reindex(args.client_id, args.drop))
+
+if __name__ == "__main__":
+    main()
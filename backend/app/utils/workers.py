@@ -0,0 +1,124 @@
+"""
+Utilitaires pour l'exécution de tâches bloquantes hors de la boucle d'événements
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class WorkerPoolFull(Exception):
+    """Erreur levée lorsque la file d'attente d'un pool de workers est pleine"""
+
+class BoundedExecutor:
+    """
+    Pool de threads de taille fixe, avec une file d'attente bornée et des métriques
+
+    Les tâches soumises au-delà de la capacité de la file sont refusées
+    immédiatement plutôt que d'accumuler de la latence.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        """
+        Args:
+            name: Nom du pool (préfixe des threads)
+            max_workers: Nombre de threads
+            max_queue: Nombre maximum de tâches en attente d'un thread
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+    @property
+    def queued(self) -> int:
+        """Nombre de tâches en attente d'un thread"""
+        return self.in_flight - self.running
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        Exécute une fonction bloquante dans le pool
+
+        Args:
+            func: Fonction à exécuter
+            *args: Arguments de la fonction
+
+        Returns:
+            Le résultat de la fonction
+
+        Raises:
+            WorkerPoolFull: Si la file d'attente est pleine
+        """
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise WorkerPoolFull(f"File d'attente du pool {self.name} pleine")
+
+        submitted_at = time.perf_counter()
+
+        def task() -> Any:
+            started_at = time.perf_counter()
+            wait = started_at - submitted_at
+            with self._lock:
+                self.running += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            succeeded = False
+            try:
+                result = func(*args)
+                succeeded = True
+                return result
+            finally:
+                # Comptabilisée dans le thread : l'annulation de l'appelant n'interrompt pas la tâche
+                with self._lock:
+                    self.running -= 1
+                    self.total_run += time.perf_counter() - started_at
+                    if succeeded:
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, task)
+        finally:
+            self.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Retourne les métriques du pool
+
+        Returns:
+            Taille, occupation, file d'attente, tâches terminées (réussies ou en échec),
+            refusées et temps moyens d'attente et d'exécution (ms)
+        """
+        finished = self.completed + self.failed
+        return {
+            "workers": self.max_workers,
+            "running": self.running,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_wait_ms": (self.total_wait / finished) * 1000 if finished else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+            "avg_run_ms": (self.total_run / finished) * 1000 if finished else 0.0,
+        }
+
+    def shutdown(self) -> None:
+        """Arrête le pool en attendant la fin des tâches en cours"""
+        self._executor.shutdown(wait=True)
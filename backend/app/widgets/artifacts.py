@@ -0,0 +1,283 @@
+"""
+Génération en cache des fichiers d'intégration du widget
+
+Le snippet HTML et le plugin WordPress (archive zip) d'un client sont générés à
+partir des modèles de WIDGET_DIR/templates. Chaque fichier est identifié par
+l'empreinte de tout ce qui détermine son contenu : modèle, client, URL du serveur
+et options du chatbot (couleurs, nom, message de bienvenue...). Il est généré une
+seule fois, écrit dans WIDGET_ARTIFACT_DIR sous le nom de cette empreinte, qui
+sert aussi d'ETag, puis servi tel quel aux téléchargements suivants.
+
+Une modification du chatbot, propagée par le cache des clients
+(app.clients.tenants), change l'empreinte : le fichier suivant est régénéré et
+l'ancien n'est plus servi. Les fichiers les moins récemment utilisés sont
+supprimés au-delà de WIDGET_ARTIFACT_CACHE_MB. Le dossier peut être partagé par
+plusieurs workers : un fichier supprimé par l'un d'eux est régénéré par les autres.
+Les fichiers, de quelques kilo-octets, sont lus en mémoire avant d'être servis :
+une suppression pendant l'envoi de la réponse ne l'interrompt pas.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import zipfile
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.clients.tenants import tenant_cache
+from app.config import settings
+from app.widgets.options import widget_options
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Fichiers générés : modèle dans WIDGET_DIR, nom de téléchargement et type de contenu
+ARTIFACTS = {
+    "snippet": ("templates/generic/snippet.html", "snippet.html", "text/html; charset=utf-8"),
+    "plugin": ("templates/wordpress/iafluence-widget.php", "iafluence-chatbot.zip", "application/zip"),
+}
+
+# Dossier et fichier principal du plugin dans l'archive
+PLUGIN_SLUG = "iafluence-chatbot"
+
+# Caractères interdits dans les valeurs insérées telles quelles (attributs HTML, chaînes JS et PHP)
+UNSAFE_CHARACTERS = set("'\"<>\\` \t\r\n")
+
+def php_literal(value: Any) -> str:
+    """
+    Convertit une valeur en littéral PHP (le guillemet simple des chaînes est fourni par le modèle)
+
+    Args:
+        value: Chaîne, booléen ou entier
+
+    Returns:
+        Le littéral
+    """
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return str(int(value))
+    return str(value).replace("\\", "\\\\").replace("'", "\\'")
+
+def render(template: str, values: Dict[str, str]) -> str:
+    """
+    Remplace les marqueurs {{NOM}} d'un modèle
+
+    Args:
+        template: Contenu du modèle
+        values: Valeur de chaque marqueur
+
+    Returns:
+        Le contenu généré
+    """
+    for name, value in values.items():
+        template = template.replace("{{" + name + "}}", value)
+    return template
+
+class WidgetArtifacts:
+    """
+    Cache sur disque, borné en taille, des snippets et plugins générés
+    """
+
+    def __init__(self, directory: str = settings.WIDGET_ARTIFACT_DIR,
+                 max_bytes: int = settings.WIDGET_ARTIFACT_CACHE_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._templates: Dict[str, Tuple[str, str]] = {}
+        # Taille des fichiers présents, du moins au plus récemment utilisé
+        self._files: "OrderedDict[str, int]" = OrderedDict()
+        self._size = 0
+        self._building: Dict[str, asyncio.Future] = {}
+
+    async def start(self) -> None:
+        """Lit les modèles et recense les fichiers déjà générés"""
+        await asyncio.get_running_loop().run_in_executor(None, self._load)
+
+    async def get(self, kind: str, client_id: str, server_url: str) -> Optional[Dict[str, str]]:
+        """
+        Retourne le fichier d'intégration d'un client, généré si nécessaire
+
+        Les générations concurrentes d'un même fichier sont regroupées.
+
+        Args:
+            kind: Type de fichier (snippet ou plugin)
+            client_id: Identifiant du client
+            server_url: URL publique du serveur
+
+        Returns:
+            Dictionnaire (content, etag, filename, media_type), ou None si le client ou son chatbot est inactif
+
+        Raises:
+            ValueError: Si le type est inconnu ou si l'identifiant du client ou l'URL contient des caractères interdits
+        """
+        if kind not in ARTIFACTS:
+            raise ValueError(f"Fichier d'intégration inconnu: {kind}")
+        for value in (client_id, server_url):
+            if UNSAFE_CHARACTERS.intersection(value):
+                raise ValueError(f"Valeur non autorisée dans un fichier d'intégration: {value}")
+        _, chatbot = await tenant_cache.get(client_id)
+        if chatbot is None:
+            return None
+
+        template, template_hash = self._templates[kind]
+        options = widget_options(chatbot)
+        key = hashlib.sha256(json.dumps(
+            [kind, template_hash, client_id, server_url, options], sort_keys=True, default=str
+        ).encode("utf-8")).hexdigest()[:32]
+        _, filename, media_type = ARTIFACTS[kind]
+        artifact = {"etag": f'"{key}"', "filename": filename, "media_type": media_type}
+        path = self._path(key, filename)
+
+        loop = asyncio.get_running_loop()
+        # Fichier déjà généré, par ce worker ou par un autre
+        content = await loop.run_in_executor(None, self._read, path)
+        if content is not None:
+            if key in self._files:
+                self._files.move_to_end(key)
+            else:
+                self._add(key, len(content))
+            return dict(artifact, content=content)
+
+        future = self._building.get(key)
+        if future is None:
+            future = loop.create_future()
+            self._building[key] = future
+            try:
+                content = self._generate(kind, template, client_id, server_url, options)
+                await loop.run_in_executor(None, self._write, path, content)
+            except BaseException as e:
+                # Les requêtes en attente sont libérées même si cette génération est annulée
+                if isinstance(e, Exception):
+                    future.set_exception(e)
+                    # Évite l'avertissement "exception never retrieved" sans requête en attente
+                    future.exception()
+                else:
+                    future.cancel()
+                raise
+            finally:
+                self._building.pop(key, None)
+            self._add(key, len(content))
+            future.set_result(content)
+            return dict(artifact, content=content)
+        try:
+            return dict(artifact, content=await asyncio.shield(future))
+        except asyncio.CancelledError:
+            # Génération annulée avec la requête qui la menait : nouvelle tentative
+            if future.cancelled():
+                return await self.get(kind, client_id, server_url)
+            raise
+
+    def available(self, kind: str) -> bool:
+        """
+        Indique si le modèle d'un type de fichier a pu être lu
+
+        Args:
+            kind: Type de fichier (snippet ou plugin)
+
+        Returns:
+            True si le fichier peut être généré
+        """
+        return kind in self._templates
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Retourne l'occupation du cache
+
+        Returns:
+            Nombre de fichiers et taille totale (octets)
+        """
+        return {"files": len(self._files), "bytes": self._size, "max_bytes": self.max_bytes}
+
+    @staticmethod
+    def _generate(kind: str, template: str, client_id: str, server_url: str, options: Dict[str, Any]) -> bytes:
+        """Génère le contenu d'un fichier d'intégration"""
+        values = {"CLIENT_ID": client_id, "SERVER_URL": server_url}
+        if kind == "snippet":
+            return render(template, values).encode("utf-8")
+
+        values.update({
+            "POSITION": php_literal(options["position"]),
+            "PRIMARY_COLOR": php_literal(options["primaryColor"]),
+            "SECONDARY_COLOR": php_literal(options["secondaryColor"]),
+            "CHATBOT_NAME": php_literal(options["chatbotName"]),
+            "WELCOME_MESSAGE": php_literal(options["welcomeMessage"]),
+            "LOGO_URL": php_literal(options["logoUrl"]),
+            "SHOW_BRANDING": php_literal(bool(options["showBranding"])),
+            "AUTO_OPEN": php_literal(bool(options["autoOpen"])),
+            "DELAY_AUTO_OPEN": php_literal(int(options["delayAutoOpen"] or 0)),
+        })
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            # Date fixe : une même configuration produit toujours la même archive
+            entry = zipfile.ZipInfo(f"{PLUGIN_SLUG}/{PLUGIN_SLUG}.php", date_time=(1980, 1, 1, 0, 0, 0))
+            entry.compress_type = zipfile.ZIP_DEFLATED
+            archive.writestr(entry, render(template, values))
+        return buffer.getvalue()
+
+    def _path(self, key: str, filename: str) -> str:
+        """Chemin du fichier généré d'empreinte donnée"""
+        return os.path.join(self.directory, f"{key}{os.path.splitext(filename)[1]}")
+
+    @staticmethod
+    def _read(path: str) -> Optional[bytes]:
+        """Lit un fichier généré, ou retourne None s'il est absent (jamais généré ou supprimé)"""
+        try:
+            with open(path, "rb") as artifact:
+                return artifact.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path: str, content: bytes) -> None:
+        """Écrit un fichier généré (de manière atomique)"""
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as output:
+            output.write(content)
+        os.replace(temporary, path)
+
+    def _add(self, key: str, size: int) -> None:
+        """Enregistre un fichier généré et supprime les moins récemment utilisés au-delà de la taille maximale"""
+        self._size += size - self._files.pop(key, 0)
+        self._files[key] = size
+        while self._size > self.max_bytes and len(self._files) > 1:
+            old_key, old_size = self._files.popitem(last=False)
+            self._size -= old_size
+            for _, filename, _ in ARTIFACTS.values():
+                path = self._path(old_key, filename)
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    logger.warning(f"Impossible de supprimer {path}: {str(e)}")
+
+    def _load(self) -> None:
+        """Lit les modèles et recense les fichiers présents, du plus ancien au plus récent"""
+        templates = {}
+        for kind, (path, _, _) in ARTIFACTS.items():
+            try:
+                with open(os.path.join(settings.WIDGET_DIR, path), encoding="utf-8") as source:
+                    template = source.read()
+            except OSError as e:
+                logger.error(f"Modèle du fichier d'intégration introuvable ({path}): {str(e)}")
+                continue
+            templates[kind] = (template, hashlib.sha256(template.encode("utf-8")).hexdigest())
+        self._templates = templates
+
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            entries.append((stat.st_mtime, os.path.splitext(name)[0], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._add(key, size)
+        logger.info(f"Cache des fichiers d'intégration: {len(self._files)} fichier(s), {self._size} octet(s)")
+
+# Instance partagée des fichiers d'intégration générés
+widget_artifacts = WidgetArtifacts()
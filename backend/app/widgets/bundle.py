@@ -0,0 +1,281 @@
+"""
+Diffusion du widget de chatbot
+
+Les ressources du widget (script et feuille de style du dossier WIDGET_DIR) sont
+lues une fois au démarrage, nommées d'après une empreinte de leur contenu
+(`chatbot-widget.<empreinte>.js`) et compressées à l'avance en gzip et en brotli.
+Une nouvelle version change de nom : les ressources sont donc servies avec un
+Cache-Control immuable d'un an.
+
+Chaque version publiée est aussi conservée dans WIDGET_ASSET_HISTORY_DIR : après
+un déploiement, les WIDGET_ASSET_VERSIONS versions précédentes restent servies,
+pour les pages et les chargeurs encore en cache qui les référencent.
+
+Le point d'entrée des sites clients est un chargeur de quelques centaines
+d'octets (`/api/widgets/loader.js`), mis en cache WIDGET_LOADER_MAX_AGE secondes
+puis revalidé par ETag : il référence les noms courants des ressources et lit la
+configuration du chatbot sur `/api/widgets/{client_id}/config`. Une page déjà
+visitée ne transfère ainsi plus que des réponses 304.
+"""
+import asyncio
+import contextlib
+import gzip
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.config import settings
+
+try:
+    import brotli
+except ImportError:  # Installé avec requirements.txt ; sans lui, ressources servies en gzip uniquement
+    brotli = None
+
+# Configuration du logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Ressources du widget : chemin source dans WIDGET_DIR et type de contenu
+SOURCES = {
+    "js": ("js/chatbot-widget.js", "application/javascript; charset=utf-8"),
+    "css": ("css/chatbot-widget.css", "text/css; charset=utf-8"),
+}
+
+IMMUTABLE = f"public, max-age={365 * 24 * 60 * 60}, immutable"
+
+LOADER = """(function () {
+    var assets = %(assets)s;
+    var script = document.currentScript;
+    var config = window.iafluenceConfig || {};
+    config.clientId = config.clientId || (script && script.getAttribute('data-client-id'));
+    config.serverUrl = config.serverUrl || (script ? new URL(script.src).origin : '');
+    if (!config.clientId || window.iafluenceLoaded) {
+        return;
+    }
+    window.iafluenceLoaded = true;
+
+    // Le conteneur peut être fourni par la page (plugin WordPress), avec ses options en attributs data-*
+    if (!document.getElementById('iafluence-chatbot-container')) {
+        var container = document.createElement('div');
+        container.id = 'iafluence-chatbot-container';
+        document.body.appendChild(container);
+    }
+
+    var link = document.createElement('link');
+    link.rel = 'stylesheet';
+    link.href = config.serverUrl + assets.css;
+    document.head.appendChild(link);
+
+    var options = fetch(config.serverUrl + '/api/widgets/' + encodeURIComponent(config.clientId) + '/config')
+        .then(function (response) { return response.ok ? response.json() : {}; })
+        .catch(function () { return {}; });
+    var loaded = new Promise(function (resolve, reject) {
+        var widget = document.createElement('script');
+        widget.src = config.serverUrl + assets.js;
+        widget.async = true;
+        widget.onload = resolve;
+        widget.onerror = reject;
+        document.body.appendChild(widget);
+    });
+
+    Promise.all([options, loaded]).then(function (results) {
+        // Les options du snippet priment sur la configuration du chatbot
+        config.options = Object.assign({}, results[0], config.options || {});
+        window.IAfluenceChatbot.init(config);
+    });
+})();
+"""
+
+def make_etag(body: bytes) -> str:
+    """
+    Calcule l'ETag d'un contenu
+
+    Args:
+        body: Contenu
+
+    Returns:
+        L'ETag, entre guillemets
+    """
+    return '"' + hashlib.sha256(body).hexdigest()[:20] + '"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    Indique si la requête porte déjà la version courante (en-tête If-None-Match)
+
+    Args:
+        request: Requête HTTP
+        etag: ETag courant
+
+    Returns:
+        True si une réponse 304 suffit
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    current = etag.strip('"')
+    for tag in header.split(","):
+        tag = tag.strip().removeprefix("W/").strip('"')
+        # Les variantes compressées portent le même ETag, suffixé de leur encodage
+        if tag == "*" or tag.partition("-")[0] == current:
+            return True
+    return False
+
+def accepted_encodings(request: Request) -> Tuple[str, ...]:
+    """
+    Liste les encodages acceptés par le client (en-tête Accept-Encoding)
+
+    Args:
+        request: Requête HTTP
+
+    Returns:
+        Les encodages dont la qualité n'est pas nulle
+    """
+    encodings = []
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        encodings.append(name.strip().lower())
+    return tuple(encodings)
+
+class WidgetAsset:
+    """
+    Ressource du widget, avec ses variantes compressées
+    """
+
+    def __init__(self, body: bytes, media_type: str, cache_control: str):
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.etag = make_etag(body)
+        self.variants: Dict[str, bytes] = {"identity": body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body, quality=11)
+
+    def response(self, request: Request) -> Response:
+        """
+        Construit la réponse à une requête, compressée selon Accept-Encoding
+
+        Args:
+            request: Requête HTTP
+
+        Returns:
+            La ressource, ou une réponse 304 si le client en a déjà la version courante
+        """
+        headers = {"Cache-Control": self.cache_control, "ETag": self.etag, "Vary": "Accept-Encoding"}
+        if etag_matches(request, self.etag):
+            return Response(status_code=304, headers=headers)
+        accepted = accepted_encodings(request)
+        encoding = next((name for name in ("br", "gzip") if name in self.variants and name in accepted), "identity")
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+            headers["ETag"] = f'{self.etag[:-1]}-{encoding}"'
+        return Response(self.variants[encoding], media_type=self.media_type, headers=headers)
+
+class WidgetBundle:
+    """
+    Ressources versionnées du widget et chargeur référençant leur version courante
+    """
+
+    def __init__(self, directory: str = settings.WIDGET_DIR, history: str = settings.WIDGET_ASSET_HISTORY_DIR,
+                 versions: int = settings.WIDGET_ASSET_VERSIONS):
+        self.directory = directory
+        self.history = history
+        self.versions = versions
+        self.assets: Dict[str, WidgetAsset] = {}
+        self.urls: Dict[str, str] = {}
+        self.loader: Optional[WidgetAsset] = None
+
+    async def start(self) -> None:
+        """Construit les ressources du widget (lecture et compression hors de la boucle d'événements)"""
+        await asyncio.get_running_loop().run_in_executor(None, self.build)
+
+    def build(self) -> None:
+        """Lit et compresse les ressources du widget, puis génère le chargeur"""
+        assets: Dict[str, WidgetAsset] = {}
+        urls: Dict[str, str] = {}
+        for kind, (path, media_type) in SOURCES.items():
+            try:
+                with open(os.path.join(self.directory, path), "rb") as source:
+                    body = source.read()
+            except OSError as e:
+                logger.error(f"Ressource du widget introuvable ({path}): {str(e)}")
+                continue
+            name = f"chatbot-widget.{hashlib.sha256(body).hexdigest()[:12]}.{kind}"
+            assets[name] = WidgetAsset(body, media_type, IMMUTABLE)
+            urls[kind] = f"/api/widgets/assets/{name}"
+            try:
+                for previous, previous_body in self._archive(kind, name, body):
+                    assets[previous] = WidgetAsset(previous_body, media_type, IMMUTABLE)
+            except OSError as e:
+                logger.warning(f"Versions précédentes du widget indisponibles ({self.history}): {str(e)}")
+
+        loader = LOADER % {"assets": json.dumps(urls)}
+        self.loader = WidgetAsset(
+            loader.encode("utf-8"),
+            SOURCES["js"][1],
+            f"public, max-age={settings.WIDGET_LOADER_MAX_AGE}",
+        )
+        self.assets, self.urls = assets, urls
+        logger.info(f"Widget prêt: {', '.join(assets) or 'aucune ressource'}"
+                    f"{'' if brotli is not None else ' (brotli indisponible, gzip uniquement)'}")
+
+    def asset(self, name: str) -> Optional[WidgetAsset]:
+        """
+        Retourne une ressource versionnée
+
+        Args:
+            name: Nom de la ressource (avec son empreinte)
+
+        Returns:
+            La ressource, ou None si le nom ne correspond ni à la version courante
+            ni à l'une des WIDGET_ASSET_VERSIONS versions précédentes
+        """
+        return self.assets.get(name)
+
+    def _archive(self, kind: str, name: str, body: bytes) -> List[Tuple[str, bytes]]:
+        """
+        Conserve la version courante d'une ressource et retourne les versions précédentes
+
+        La version courante devient la plus récente (date de modification) ; au-delà
+        de `versions` versions précédentes, les plus anciennes sont supprimées.
+
+        Args:
+            kind: Type de ressource (js ou css)
+            name: Nom de la version courante
+            body: Contenu de la version courante
+
+        Returns:
+            Les versions précédentes (nom et contenu), de la plus récente à la plus ancienne
+        """
+        os.makedirs(self.history, exist_ok=True)
+        path = os.path.join(self.history, name)
+        if not os.path.exists(path):
+            temporary = f"{path}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as archived:
+                archived.write(body)
+            os.replace(temporary, path)
+        os.utime(path)
+
+        older = sorted(
+            (entry for entry in os.scandir(self.history)
+             if entry.name != name and entry.name.startswith("chatbot-widget.") and entry.name.endswith(f".{kind}")),
+            key=lambda entry: entry.stat().st_mtime,
+            reverse=True
+        )
+        previous: List[Tuple[str, bytes]] = []
+        # Les autres instances démarrées en même temps suppriment les mêmes versions
+        for entry in older[:self.versions]:
+            with contextlib.suppress(FileNotFoundError), open(entry.path, "rb") as archived:
+                previous.append((entry.name, archived.read()))
+        for entry in older[self.versions:]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(entry.path)
+        return previous
+
+# Instance partagée des ressources du widget
+widget_bundle = WidgetBundle()
@@ -0,0 +1,85 @@
+"""
+Configuration publique du widget de chaque client
+
+Le widget lit au chargement l'apparence de son chatbot (couleurs, position, nom,
+message de bienvenue...) sur `/api/widgets/{client_id}/config`. La réponse est
+construite à partir du cache des clients (app.clients.tenants) puis conservée
+en mémoire, sérialisée et compressée, tant que le document du chatbot en cache
+ne change pas : une modification depuis l'interface d'administration, propagée
+par le cache des clients, produit une nouvelle réponse et un nouvel ETag.
+"""
+import json
+from typing import Any, Dict, Optional
+
+from app.clients.tenants import tenant_cache
+from app.config import settings
+from app.utils.cache import LRUCache
+from app.widgets.bundle import WidgetAsset
+
+# Options du widget et champ correspondant du chatbot, avec leur valeur par défaut
+OPTION_FIELDS = {
+    "position": ("position", "bottom-right"),
+    "primaryColor": ("primary_color", "#4f46e5"),
+    "secondaryColor": ("secondary_color", "#ffffff"),
+    "chatbotName": ("name", "Assistant IA"),
+    "welcomeMessage": ("welcome_message", "Bonjour ! Comment puis-je vous aider aujourd'hui ?"),
+    "logoUrl": ("logo_url", ""),
+    "showBranding": ("show_branding", True),
+    "autoOpen": ("auto_open", False),
+    "delayAutoOpen": ("delay_auto_open", 5000),
+}
+
+def widget_options(chatbot: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Extrait les options publiques du widget d'un chatbot
+
+    Args:
+        chatbot: Document du chatbot
+
+    Returns:
+        Les options attendues par le widget (les instructions et le code personnalisé ne sont pas exposés)
+    """
+    options = {}
+    for option, (field, default) in OPTION_FIELDS.items():
+        value = chatbot.get(field)
+        options[option] = default if value is None else value
+    return options
+
+class WidgetOptionsCache:
+    """
+    Réponses de configuration du widget, par client
+    """
+
+    def __init__(self, maxsize: int = settings.WIDGET_CONFIG_CACHE_SIZE):
+        # Chaque entrée est associée au document du chatbot dont elle est issue
+        self._entries = LRUCache(maxsize=maxsize)
+
+    async def get(self, client_id: str) -> Optional[WidgetAsset]:
+        """
+        Retourne la configuration du widget d'un client
+
+        Args:
+            client_id: Identifiant du client
+
+        Returns:
+            La réponse (JSON, ETag et variantes compressées), ou None si le client ou son chatbot est inactif
+        """
+        _, chatbot = await tenant_cache.get(client_id)
+        if chatbot is None:
+            self._entries.pop(client_id)
+            return None
+        entry = self._entries.get(client_id)
+        if entry is not None and entry[0] is chatbot:
+            return entry[1]
+
+        body = json.dumps(widget_options(chatbot), ensure_ascii=False, separators=(",", ":"))
+        asset = WidgetAsset(
+            body.encode("utf-8"),
+            "application/json",
+            f"public, max-age={settings.WIDGET_CONFIG_MAX_AGE}, stale-while-revalidate={settings.WIDGET_CONFIG_STALE}",
+        )
+        self._entries.set(client_id, (chatbot, asset))
+        return asset
+
+# Instance partagée des configurations du widget
+widget_options_cache = WidgetOptionsCache()
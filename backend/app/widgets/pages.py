@@ -0,0 +1,83 @@
+"""
+Pages HTML de l'API : accueil et prévisualisation du widget
+
+Les modèles Jinja2 de app/templates sont compilés une seule fois, avec
+échappement automatique du HTML ; les valeurs insérées dans le JavaScript passent
+par le filtre `tojson`. La page d'accueil est rendue au premier appel, la
+prévisualisation d'un client à partir de son chatbot (cache des clients) puis
+conservée en mémoire tant que ce chatbot et la version du widget ne changent pas.
+Les pages sont servies compressées, avec ETag.
+"""
+import os
+from typing import Optional
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from app.clients.tenants import tenant_cache
+from app.config import settings
+from app.utils.cache import LRUCache
+from app.widgets.bundle import WidgetAsset, widget_bundle
+from app.widgets.options import widget_options
+
+HTML = "text/html; charset=utf-8"
+
+environment = Environment(
+    loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.dirname(__file__)), "templates")),
+    autoescape=select_autoescape(["html"]),
+    auto_reload=False,
+)
+
+class Pages:
+    """
+    Rendu des pages HTML, mis en cache par page et par client
+    """
+
+    def __init__(self, maxsize: int = settings.PREVIEW_CACHE_SIZE):
+        self._root: Optional[WidgetAsset] = None
+        # Chaque prévisualisation est associée au chatbot et aux ressources du widget dont elle est issue
+        self._previews = LRUCache(maxsize=maxsize)
+
+    def root(self) -> WidgetAsset:
+        """
+        Retourne la page d'accueil
+
+        Returns:
+            La page rendue
+        """
+        if self._root is None:
+            body = environment.get_template("root.html").render(app_name=settings.APP_NAME)
+            self._root = WidgetAsset(body.encode("utf-8"), HTML, "public, max-age=3600")
+        return self._root
+
+    async def preview(self, client_id: str) -> Optional[WidgetAsset]:
+        """
+        Retourne la prévisualisation du chatbot d'un client
+
+        Args:
+            client_id: Identifiant du client
+
+        Returns:
+            La page rendue, ou None si le client ou son chatbot est inactif
+        """
+        _, chatbot = await tenant_cache.get(client_id)
+        if chatbot is None:
+            self._previews.pop(client_id)
+            return None
+        urls = widget_bundle.urls
+        entry = self._previews.get(client_id)
+        if entry is not None and entry[0] is chatbot and entry[1] is urls:
+            return entry[2]
+
+        options = dict(widget_options(chatbot), autoOpen=True, delayAutoOpen=0)
+        body = environment.get_template("preview.html").render(
+            client_id=client_id,
+            options=options,
+            css_url=urls.get("css", "/widgets/css/chatbot-widget.css"),
+            js_url=urls.get("js", "/widgets/js/chatbot-widget.js"),
+        )
+        page = WidgetAsset(body.encode("utf-8"), HTML, "private, no-cache")
+        self._previews.set(client_id, (chatbot, urls, page))
+        return page
+
+# Instance partagée des pages HTML
+pages = Pages()
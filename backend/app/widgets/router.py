@@ -0,0 +1,111 @@
+"""
+Routes de diffusion du widget
+"""
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from starlette.responses import Response
+
+from app.auth.models import User
+from app.auth.service import get_admin_user
+from app.config import settings
+from app.widgets.artifacts import widget_artifacts
+from app.widgets.bundle import etag_matches, widget_bundle
+from app.widgets.options import widget_options_cache
+
+router = APIRouter()
+
+@router.get("/loader.js")
+async def widget_loader(request: Request) -> Response:
+    """
+    Chargeur du widget, inclus par le snippet des sites clients
+
+    Args:
+        request: Requête HTTP
+
+    Returns:
+        Le chargeur, revalidé par ETag après WIDGET_LOADER_MAX_AGE secondes
+
+    Raises:
+        HTTPException: Si les ressources du widget n'ont pas été construites
+    """
+    if widget_bundle.loader is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Widget indisponible")
+    return widget_bundle.loader.response(request)
+
+@router.get("/assets/{name}")
+async def widget_asset(name: str, request: Request) -> Response:
+    """
+    Ressource versionnée du widget (script ou feuille de style)
+
+    Args:
+        name: Nom de la ressource, avec l'empreinte de son contenu
+        request: Requête HTTP
+
+    Returns:
+        La ressource, mise en cache sans limite par les navigateurs et les CDN
+
+    Raises:
+        HTTPException: Si la ressource ne correspond pas à la version courante
+    """
+    asset = widget_bundle.asset(name)
+    if asset is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Ressource introuvable")
+    return asset.response(request)
+
+@router.get("/{client_id}/config")
+async def widget_config(client_id: str, request: Request) -> Response:
+    """
+    Configuration publique du widget d'un client (apparence du chatbot)
+
+    Args:
+        client_id: Identifiant du client
+        request: Requête HTTP
+
+    Returns:
+        Les options du widget en JSON, avec ETag
+
+    Raises:
+        HTTPException: Si le client ou son chatbot est introuvable ou inactif
+    """
+    config = await widget_options_cache.get(client_id)
+    if config is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chatbot introuvable")
+    response = config.response(request)
+    # Lue depuis les sites des clients, sans cookie
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
+
+@router.get("/{client_id}/{kind}")
+async def widget_artifact(kind: str, client_id: str, request: Request, admin_user: User = Depends(get_admin_user)) -> Response:
+    """
+    Télécharge le snippet HTML (snippet) ou le plugin WordPress (plugin) d'un client (réservé aux administrateurs)
+
+    Args:
+        kind: Type de fichier (snippet ou plugin)
+        client_id: Identifiant du client
+        request: Requête HTTP
+        admin_user: Utilisateur administrateur (injecté par la dépendance)
+
+    Returns:
+        Le fichier, généré une seule fois par configuration du chatbot, ou une réponse 304
+
+    Raises:
+        HTTPException: Si le type est inconnu, si le client ou son chatbot est introuvable ou si le modèle est indisponible
+    """
+    if kind not in ("snippet", "plugin"):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Fichier d'intégration inconnu")
+    if not widget_artifacts.available(kind):
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Modèle indisponible")
+    server_url = settings.PUBLIC_URL or str(request.base_url).rstrip("/")
+    try:
+        artifact = await widget_artifacts.get(kind, client_id, server_url)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if artifact is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chatbot introuvable")
+
+    # Revalidation à chaque téléchargement : l'ETag change avec la configuration du chatbot
+    headers = {"ETag": artifact["etag"], "Cache-Control": "private, no-cache"}
+    if etag_matches(request, artifact["etag"]):
+        return Response(status_code=304, headers=headers)
+    headers["Content-Disposition"] = f'attachment; filename="{artifact["filename"]}"'
+    return Response(artifact["content"], media_type=artifact["media_type"], headers=headers)
@@ -0,0 +1,32 @@
+"""
+Fixtures partagées des tests
+
+Les bancs d'essai qui mesurent des requêtes MongoDB utilisent une base dédiée sur
+le serveur de BENCHMARK_MONGODB_URL (par défaut MONGODB_URL), supprimée à la fin
+du test ; ils sont ignorés si aucun serveur ne répond.
+"""
+import os
+
+import motor.motor_asyncio
+import pytest
+import pytest_asyncio
+from pymongo.errors import PyMongoError
+
+from app.config import settings
+
+@pytest_asyncio.fixture
+async def benchmark_db():
+    url = os.getenv("BENCHMARK_MONGODB_URL", settings.MONGODB_URL)
+    client = motor.motor_asyncio.AsyncIOMotorClient(url, serverSelectionTimeoutMS=2000)
+    try:
+        await client.admin.command("ping")
+    except PyMongoError:
+        client.close()
+        pytest.skip(f"Aucun serveur MongoDB sur {url}")
+    name = f"{settings.MONGODB_DB_NAME}_benchmark"
+    await client.drop_database(name)
+    try:
+        yield client[name]
+    finally:
+        await client.drop_database(name)
+        client.close()
@@ -0,0 +1,119 @@
+"""
+Tests du résumé glissant de la fenêtre de contexte
+"""
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from app.conversations.llm import context as context_module
+from app.conversations.llm import providers
+from app.conversations.llm.context import ContextBuilder
+from app.conversations.llm.providers import LLMProvider
+
+CHATBOT = {"_id": "bot", "client_id": "acme", "default_llm": "gpt-4", "context_token_budget": 100000}
+
+class SummaryProvider(LLMProvider):
+    """Fournisseur factice qui résume en listant les contenus reçus"""
+    name = "openai"
+
+    def __init__(self):
+        super().__init__("http://fake")
+        self.prompts = []
+
+    async def stream(self, model, messages, max_tokens=0, temperature=0.0):
+        self.prompts.append(messages[-1]["content"])
+        yield f"résumé {len(self.prompts)}"
+
+class FakeConversations:
+    """Collection conversations réduite aux en-têtes et à leur résumé"""
+
+    def __init__(self):
+        self.summaries = {}
+
+    async def find_one(self, query, projection=None):
+        summary = self.summaries.get(query["session_id"])
+        return {"summary": summary} if summary else None
+
+    async def update_one(self, query, update):
+        self.summaries[query["session_id"]] = update["$set"]["summary"]
+
+def message(position: int) -> dict:
+    sender = "user" if position % 2 == 0 else "bot"
+    return {"id": f"m{position}", "sender": sender, "content": f"message {position}",
+            "timestamp": datetime(2024, 1, 1), "position": position}
+
+@pytest.fixture
+def setup(monkeypatch):
+    provider = SummaryProvider()
+    stored = [message(position) for position in range(130)]
+    recorded = []
+
+    async def between(client_id, session_id, after, before, limit):
+        return [m for m in stored if after < m["position"] < before][:limit]
+
+    monkeypatch.setitem(providers._providers, "openai", provider)
+    monkeypatch.setattr(context_module, "conversations_collection", FakeConversations())
+    monkeypatch.setattr(context_module.conversation_store, "between", between)
+    monkeypatch.setattr(context_module.quota_engine, "record",
+                        lambda client_id, llm_name, tokens=0, cache_hit=False: recorded.append(tokens))
+    return provider, stored, recorded
+
+async def wait_folds(builder: ContextBuilder) -> None:
+    while builder._pending:
+        await asyncio.gather(*builder._pending.values())
+
+@pytest.mark.asyncio
+async def test_messages_older_than_history_are_folded(setup):
+    provider, stored, recorded = setup
+    builder = ContextBuilder()
+    history = stored[-50:]
+
+    messages = await builder.build(CHATBOT, "s1", history, "Nouvelle question")
+    # Tout l'historique tient dans le budget : il est transmis tel quel
+    assert [m["content"] for m in messages[:-1]] == [m["content"] for m in history]
+    await wait_folds(builder)
+
+    # Les 80 messages antérieurs à l'historique sont résumés par tranches de 50
+    folded = "\n".join(provider.prompts)
+    for position in range(80):
+        assert f"message {position}\n" in folded + "\n"
+    assert "message 80\n" not in folded + "\n"
+    assert len(provider.prompts) == 2
+    summary = await builder._get_summary(("acme", "s1"))
+    assert summary["until"] == "m79" and summary["until_position"] == 79
+    # Chaque appel de résumé est comptabilisé
+    assert len(recorded) == 2 and all(tokens > 0 for tokens in recorded)
+
+    # Le résumé est repris au tour suivant, sans nouvel appel
+    messages = await builder.build(CHATBOT, "s1", stored[-48:] + [message(130), message(131)], "Question suivante")
+    await wait_folds(builder)
+    assert messages[0]["content"].startswith("Résumé de la conversation précédente")
+    assert len(provider.prompts) == 3
+    assert "message 80\n" in provider.prompts[-1] + "\n" and "message 81" in provider.prompts[-1]
+
+@pytest.mark.asyncio
+async def test_short_session_is_not_summarized(setup):
+    provider, stored, _ = setup
+    builder = ContextBuilder()
+
+    await builder.build(CHATBOT, "s2", stored[:10], "Question")
+    await wait_folds(builder)
+    assert provider.prompts == []
+
+@pytest.mark.asyncio
+async def test_fold_failure_is_logged(setup, monkeypatch, caplog):
+    _, stored, _ = setup
+
+    def record(client_id, llm_name, tokens=0, cache_hit=False):
+        raise RuntimeError("compteur indisponible")
+
+    monkeypatch.setattr(context_module.quota_engine, "record", record)
+    builder = ContextBuilder()
+    await builder.build(CHATBOT, "s3", stored[-50:], "Question")
+    tasks = list(builder._pending.values())
+    await asyncio.gather(*tasks)
+
+    # L'erreur est journalisée au lieu de rester dans une tâche que personne n'attend
+    assert all(task.exception() is None for task in tasks)
+    assert "compteur indisponible" in caplog.text
@@ -0,0 +1,126 @@
+"""
+Tests du répartiteur LLM (bascule et requêtes couvertes) contre des serveurs factices
+
+Les fournisseurs OpenAI et Anthropic réels sont utilisés ; leurs requêtes HTTP sont
+servies par de petites applications qui imitent les API de streaming, avec un
+délai configurable avant la réponse.
+"""
+import asyncio
+import json
+from typing import List
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.config import settings
+from app.conversations.llm import providers
+from app.conversations.llm.dispatcher import LLMDispatcher
+from app.conversations.llm.providers import AnthropicProvider, OpenAIProvider
+
+PRIMARY = "gpt-4"
+FALLBACK = "claude-3-haiku"
+MESSAGES = [{"role": "user", "content": "Bonjour"}]
+
+class FakeServer:
+    """Serveur imitant l'API de streaming d'un fournisseur ; les délais sont consommés dans l'ordre"""
+
+    def __init__(self, kind: str, delays: List[float], status: int = 200, truncated: bool = False):
+        self.kind = kind
+        self.delays = list(delays)
+        self.status = status
+        # Réponse interrompue par une ligne illisible après le premier fragment
+        self.truncated = truncated
+        self.requests = 0
+        self.app = FastAPI()
+        path = "/chat/completions" if kind == "openai" else "/messages"
+        self.app.post(path)(self.handle)
+
+    def lines(self, text: str) -> List[str]:
+        if self.kind == "openai":
+            return [f"data: {json.dumps({'choices': [{'delta': {'content': text}}]})}\n\n", "data: [DONE]\n\n"]
+        return [f"data: {json.dumps({'type': 'content_block_delta', 'delta': {'text': text}})}\n\n",
+                f"data: {json.dumps({'type': 'message_stop'})}\n\n"]
+
+    async def handle(self):
+        self.requests += 1
+        delay = self.delays.pop(0) if len(self.delays) > 1 else self.delays[0]
+        await asyncio.sleep(delay)
+        if self.status >= 400:
+            return JSONResponse({"error": "indisponible"}, status_code=self.status)
+        lines = self.lines(self.kind)
+        if self.truncated:
+            lines = lines[:1] + ["data: {\"choices\": [\n\n"]
+        return StreamingResponse(iter(lines), media_type="text/event-stream")
+
+    def provider(self):
+        provider_class = OpenAIProvider if self.kind == "openai" else AnthropicProvider
+        provider = provider_class("http://fake")
+        provider._http = httpx.AsyncClient(transport=httpx.ASGITransport(app=self.app))
+        return provider
+
+@pytest.fixture
+def servers(monkeypatch):
+    """Installe un serveur factice par fournisseur ; retourne une fonction de configuration"""
+    monkeypatch.setattr(settings, "LLM_HEDGE_DEFAULT_DELAY", 0.1)
+    monkeypatch.setattr(settings, "LLM_HEDGE_MIN_DELAY", 0.01)
+    monkeypatch.setattr(settings, "LLM_HEDGE_MIN_SAMPLES", 10)
+
+    def install(primary: FakeServer, fallback: FakeServer):
+        monkeypatch.setitem(providers._providers, "openai", primary.provider())
+        monkeypatch.setitem(providers._providers, "anthropic", fallback.provider())
+        return primary, fallback
+
+    return install
+
+async def answer(dispatcher: LLMDispatcher) -> tuple:
+    chunks = [item async for item in dispatcher.stream(MESSAGES, PRIMARY, FALLBACK)]
+    return chunks[0][0], "".join(chunk for _, chunk in chunks)
+
+@pytest.mark.asyncio
+async def test_failover_when_primary_errors(servers):
+    primary, fallback = servers(FakeServer("openai", [0.0], status=500), FakeServer("anthropic", [0.0]))
+    dispatcher = LLMDispatcher(hedging=False)
+
+    assert await answer(dispatcher) == (FALLBACK, "anthropic")
+    assert dispatcher.breaker("openai").failures == 1
+    assert primary.requests == 1 and fallback.requests == 1
+
+@pytest.mark.asyncio
+async def test_hedge_wins_and_records_primary_delay(servers):
+    servers(FakeServer("openai", [0.5]), FakeServer("anthropic", [0.01]))
+    dispatcher = LLMDispatcher(hedging=True)
+
+    assert await answer(dispatcher) == (FALLBACK, "anthropic")
+    # Le principal, devancé, est compté au moins jusqu'au déclenchement de la requête couverte
+    primary_delays = list(dispatcher._first_chunk_delays[PRIMARY])
+    assert len(primary_delays) == 1 and primary_delays[0] >= settings.LLM_HEDGE_DEFAULT_DELAY
+
+@pytest.mark.asyncio
+async def test_hedge_delay_does_not_drift_down(servers):
+    # Un principal lent une fois sur cinq : son 95e centile est la latence lente
+    delays = [0.3 if index % 5 == 4 else 0.02 for index in range(40)]
+    primary, fallback = servers(FakeServer("openai", delays), FakeServer("anthropic", [0.01]))
+    dispatcher = LLMDispatcher(hedging=True)
+
+    winners = [(await answer(dispatcher))[0] for _ in range(40)]
+
+    assert winners.count(FALLBACK) == 8
+    # Sans les mesures censurées des requêtes devancées, seules les réponses rapides
+    # seraient conservées et le délai de couverture descendrait vers 0,02 s
+    assert dispatcher.hedge_delay(PRIMARY) >= 0.1
+    assert len(dispatcher._first_chunk_delays[PRIMARY]) == 40
+
+@pytest.mark.asyncio
+async def test_unreadable_stream_counts_as_a_failure(servers):
+    servers(FakeServer("openai", [0.0], truncated=True), FakeServer("anthropic", [0.0]))
+    dispatcher = LLMDispatcher(hedging=False)
+
+    chunks = []
+    with pytest.raises(providers.LLMError):
+        async for chunk in dispatcher.stream(MESSAGES, PRIMARY, FALLBACK):
+            chunks.append(chunk)
+    assert chunks == [(PRIMARY, "openai")]
+    # L'erreur de décodage est signalée comme un échec du LLM et comptée par son disjoncteur
+    assert dispatcher.breaker("openai").failures == 1
@@ -0,0 +1,129 @@
+"""
+Banc d'essai : débit de la file d'envoi d'emails
+
+Un serveur SMTP local (aiosmtpd) reçoit les emails. Le débit de la file d'envoi,
+qui réutilise une connexion SMTP, est comparé à l'ouverture d'une connexion par
+email. Un second test vérifie qu'un arrêt en cours de lot ne laisse aucun email
+déjà délivré au statut sending.
+
+    python -m pytest -s tests/test_email_benchmark.py
+"""
+import asyncio
+import os
+import smtplib
+import socket
+import time
+from typing import Any, Dict
+
+import pytest
+
+aiosmtpd = pytest.importorskip("aiosmtpd.controller")
+
+from app.config import settings
+from app.utils import email as email_module
+from app.utils.email import EmailQueue, build_message
+
+EMAILS = int(os.getenv("BENCHMARK_EMAILS", "300"))
+
+class Handler:
+    """Serveur SMTP qui conserve les destinataires reçus"""
+
+    def __init__(self, delay: float = 0.0):
+        self.received = []
+        self.delay = delay
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.received.append(envelope.rcpt_tos[0])
+        return "250 OK"
+
+class FakeOutbox:
+    """Boîte d'envoi en mémoire"""
+
+    def __init__(self):
+        self.emails: Dict[Any, Dict[str, Any]] = {}
+
+    async def insert_one(self, document):
+        document["_id"] = len(self.emails)
+        self.emails[document["_id"]] = dict(document)
+        return type("InsertOneResult", (), {"inserted_id": document["_id"]})()
+
+    async def update_one(self, query, update):
+        self.emails[query["_id"]].update(update["$set"])
+
+    async def find_one_and_update(self, *args, **kwargs):
+        return None
+
+@pytest.fixture
+def smtp(monkeypatch):
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    handler = Handler()
+    controller = aiosmtpd.Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    outbox = FakeOutbox()
+    monkeypatch.setattr(settings, "SMTP_SERVER", "127.0.0.1")
+    monkeypatch.setattr(settings, "SMTP_PORT", port)
+    monkeypatch.setattr(settings, "SMTP_STARTTLS", False)
+    monkeypatch.setattr(settings, "SMTP_USERNAME", "")
+    monkeypatch.setattr(email_module, "email_outbox_collection", outbox)
+    yield handler, outbox
+    controller.stop()
+
+def email(index: int) -> Dict[str, Any]:
+    return {"to": f"user{index}@example.com", "subject": "Test", "body": "Bonjour", "html_body": None}
+
+def send_one_connection_per_email(count: int) -> None:
+    """Référence : une connexion SMTP ouverte et fermée pour chaque email"""
+    for index in range(count):
+        with smtplib.SMTP(settings.SMTP_SERVER, settings.SMTP_PORT, timeout=settings.SMTP_TIMEOUT) as server:
+            server.sendmail(settings.EMAIL_FROM, email(index)["to"], build_message(email(index)).as_string())
+
+@pytest.mark.asyncio
+async def test_queue_throughput(smtp):
+    handler, outbox = smtp
+
+    start = time.perf_counter()
+    await asyncio.get_running_loop().run_in_executor(None, send_one_connection_per_email, EMAILS)
+    baseline = EMAILS / (time.perf_counter() - start)
+
+    queue = EmailQueue()
+    await queue.start()
+    start = time.perf_counter()
+    for index in range(EMAILS):
+        await queue.enqueue(**email(index))
+    await queue._queue.join()
+    pooled = EMAILS / (time.perf_counter() - start)
+    await queue.stop()
+
+    print(f"\nune connexion par email: {baseline:.0f} emails/s")
+    print(f"file d'envoi (connexion réutilisée, lots de {settings.EMAIL_BATCH_SIZE}): {pooled:.0f} emails/s")
+
+    assert len(handler.received) == 2 * EMAILS
+    assert queue.sent == EMAILS
+    assert all(e["status"] == "sent" for e in outbox.emails.values())
+    assert pooled > baseline
+
+@pytest.mark.asyncio
+async def test_stop_mid_batch_marks_delivered_emails(smtp, monkeypatch):
+    handler, outbox = smtp
+    handler.delay = 0.01
+    # La file n'est pas vidée après l'annulation : attente de vidage écourtée
+    monkeypatch.setattr(settings, "SMTP_TIMEOUT", 1.0)
+
+    queue = EmailQueue()
+    await queue.start()
+    for index in range(settings.EMAIL_BATCH_SIZE):
+        await queue.enqueue(**email(index))
+    await asyncio.sleep(0.05)
+    # Arrêt immédiat : la tâche d'envoi est annulée au milieu du lot
+    for task in queue._tasks:
+        task.cancel()
+    await queue.stop()
+
+    delivered = set(handler.received)
+    assert 0 < len(delivered) < settings.EMAIL_BATCH_SIZE
+    for document in outbox.emails.values():
+        assert (document["status"] == "sent") == (document["to"] in delivered)
@@ -0,0 +1,124 @@
+"""
+Tests des exports en tâche de fond
+
+La collection export_jobs est remplacée par une collection en mémoire ; les
+messages exportés sont produits par un générateur qui remplace export_rows.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Any, Dict
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.auth.service import get_admin_user
+from app.config import settings
+from app.conversations import export as export_module
+from app.conversations import router as router_module
+from app.conversations.export import ExportJobs
+
+class FakeJobs:
+    """Collection export_jobs réduite aux filtres utilisés par ExportJobs"""
+
+    def __init__(self):
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+
+    @staticmethod
+    def _matches(job, query) -> bool:
+        for field, condition in query.items():
+            value = job.get(field)
+            if not isinstance(condition, dict):
+                if value != condition:
+                    return False
+            elif ("$in" in condition and value not in condition["$in"]) \
+                    or ("$nin" in condition and value in condition["$nin"]) \
+                    or ("$lt" in condition and not (value is not None and value < condition["$lt"])):
+                return False
+        return True
+
+    async def insert_one(self, job):
+        self.jobs[job["_id"]] = dict(job)
+
+    async def find_one(self, query):
+        return next((dict(job) for job in self.jobs.values() if self._matches(job, query)), None)
+
+    async def update_one(self, query, update):
+        await self.update_many(query, update)
+
+    async def update_many(self, query, update):
+        matched = [job for job in self.jobs.values() if self._matches(job, query)]
+        for job in matched:
+            job.update(update["$set"])
+        return SimpleNamespace(modified_count=len(matched))
+
+@pytest.fixture
+def jobs(monkeypatch, tmp_path):
+    collection = FakeJobs()
+    monkeypatch.setattr(export_module, "export_jobs_collection", collection)
+
+    async def export_rows(client_id, date_from=None, date_to=None, chatbot_id=None, after=None):
+        for position in range(3):
+            yield {"session_id": "s1", "position": position, "content": "bonjour"}
+
+    monkeypatch.setattr(export_module, "export_rows", export_rows)
+    return ExportJobs(directory=str(tmp_path)), collection
+
+@pytest.mark.asyncio
+async def test_start_fails_jobs_left_by_a_stopped_instance(jobs):
+    exports, collection = jobs
+    old = datetime.utcnow() - timedelta(seconds=settings.EXPORT_STALE_AFTER + 60)
+    collection.jobs = {
+        "stale": {"_id": "stale", "status": "running", "heartbeat_at": old},
+        "queued": {"_id": "queued", "status": "pending", "heartbeat_at": old},
+        "alive": {"_id": "alive", "status": "running", "heartbeat_at": datetime.utcnow()},
+        "done": {"_id": "done", "status": "done", "heartbeat_at": old},
+    }
+
+    await exports.start()
+    await exports.stop()
+
+    assert {job_id: job["status"] for job_id, job in collection.jobs.items()} == \
+        {"stale": "failed", "queued": "failed", "alive": "running", "done": "done"}
+
+@pytest.mark.asyncio
+async def test_heartbeat_keeps_own_jobs_alive(jobs, monkeypatch):
+    exports, collection = jobs
+    monkeypatch.setattr(settings, "EXPORT_HEARTBEAT_INTERVAL", 0.01)
+    gate = asyncio.Event()
+    release = export_module.export_rows
+
+    async def slow_rows(*args, **kwargs):
+        await gate.wait()
+        async for row in release(*args, **kwargs):
+            yield row
+
+    monkeypatch.setattr(export_module, "export_rows", slow_rows)
+    await exports.start()
+    job = await exports.submit("acme", gzip=False)
+    # Export démarré il y a longtemps selon son document : le signal de vie le renouvelle
+    collection.jobs[job["_id"]]["heartbeat_at"] = datetime(2000, 1, 1)
+    await asyncio.sleep(0.05)
+    assert collection.jobs[job["_id"]]["heartbeat_at"] > datetime(2000, 1, 1)
+    assert collection.jobs[job["_id"]]["status"] == "running"
+
+    gate.set()
+    await asyncio.gather(*exports._tasks.values())
+    await exports.stop()
+    assert collection.jobs[job["_id"]]["status"] == "done"
+    assert collection.jobs[job["_id"]]["rows"] == 3
+
+def test_download_reports_a_file_missing_from_export_dir(jobs, monkeypatch):
+    exports, collection = jobs
+    collection.jobs["j1"] = {"_id": "j1", "status": "done", "filename": "export.ndjson",
+                             "media_type": "application/x-ndjson"}
+    monkeypatch.setattr(router_module, "export_jobs", exports)
+    app = FastAPI()
+    app.include_router(router_module.router, prefix="/api/conversations")
+    app.dependency_overrides[get_admin_user] = lambda: None
+
+    response = TestClient(app).get("/api/conversations/export/jobs/j1/download")
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Fichier d'export introuvable"
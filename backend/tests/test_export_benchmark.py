@@ -0,0 +1,126 @@
+"""
+Banc d'essai : mémoire d'un export d'un million de messages
+
+Exécute un export en tâche de fond (ExportJobs, NDJSON compressé) vers un fichier,
+les conversations et leurs compartiments étant produits à la demande par des
+curseurs simulés, et mesure le pic de mémoire allouée (tracemalloc) pour
+BENCHMARK_EXPORT_MESSAGES messages (un million par défaut) et pour un dixième de
+ce volume : le pic ne doit pas croître avec le nombre de messages.
+
+    python -m pytest -s tests/test_export_benchmark.py
+"""
+import asyncio
+import gzip
+import os
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.conversations import export as export_module
+from app.conversations.export import ExportJobs
+
+MESSAGES = int(os.getenv("BENCHMARK_EXPORT_MESSAGES", "1000000"))
+SESSION_LENGTH = 20
+BUCKET_SIZE = 10
+START = datetime(2024, 1, 1)
+
+class Cursor:
+    """Curseur asynchrone produisant ses documents à la demande"""
+
+    def __init__(self, documents):
+        self._documents = documents
+
+    def sort(self, *args, **kwargs):
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._documents)
+        except StopIteration:
+            raise StopAsyncIteration
+
+class Headers:
+    """Collection conversations : une session de SESSION_LENGTH messages par en-tête"""
+
+    def __init__(self, sessions: int):
+        self.sessions = sessions
+
+    def find(self, query, projection=None):
+        return Cursor({"session_id": f"s{index:08d}", "chatbot_id": "bot"} for index in range(self.sessions))
+
+class Buckets:
+    """Collection conversation_messages : compartiments générés pour les sessions demandées"""
+
+    def find(self, query, projection=None):
+        return Cursor(self._buckets(sorted(query["session_id"]["$in"])))
+
+    @staticmethod
+    def _buckets(session_ids):
+        for session_id in session_ids:
+            opened = START + timedelta(minutes=int(session_id[1:]))
+            for seq in range(SESSION_LENGTH // BUCKET_SIZE):
+                yield {
+                    "session_id": session_id,
+                    "seq": seq,
+                    "messages": [
+                        {"id": f"{session_id}-{position}", "position": position,
+                         "sender": "user" if position % 2 == 0 else "bot",
+                         "content": f"Message {position} de la conversation {session_id}, avec un peu de texte.",
+                         "llm_used": None if position % 2 == 0 else "gpt-4",
+                         "timestamp": opened + timedelta(seconds=position)}
+                        for position in range(seq * BUCKET_SIZE, (seq + 1) * BUCKET_SIZE)
+                    ],
+                }
+
+class Jobs:
+    """Collection export_jobs"""
+
+    def __init__(self):
+        self.jobs = {}
+
+    async def insert_one(self, job):
+        self.jobs[job["_id"]] = dict(job)
+
+    async def update_one(self, query, update):
+        self.jobs[query["_id"]].update(update["$set"])
+
+async def run_export(messages: int, directory: str, monkeypatch) -> tuple:
+    jobs = Jobs()
+    monkeypatch.setattr(export_module, "conversations_collection", Headers(messages // SESSION_LENGTH))
+    monkeypatch.setattr(export_module, "conversation_buckets_collection", Buckets())
+    monkeypatch.setattr(export_module, "export_jobs_collection", jobs)
+    exports = ExportJobs(directory=directory)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    job = await exports.submit("acme", "ndjson", gzip=True)
+    await asyncio.gather(*exports._tasks.values())
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return jobs.jobs[job["_id"]], exports.path(job), peak, elapsed
+
+@pytest.mark.asyncio
+async def test_export_memory_does_not_grow_with_volume(tmp_path, monkeypatch):
+    small, small_path, small_peak, _ = await run_export(MESSAGES // 10, str(tmp_path / "small"), monkeypatch)
+    job, path, peak, elapsed = await run_export(MESSAGES, str(tmp_path / "large"), monkeypatch)
+
+    print(f"\n{MESSAGES // 10} messages: pic {small_peak / 2**20:.1f} Mo")
+    print(f"{MESSAGES} messages: pic {peak / 2**20:.1f} Mo, {elapsed:.1f} s "
+          f"({MESSAGES / elapsed:.0f} messages/s), fichier {os.path.getsize(path) / 2**20:.1f} Mo")
+
+    assert small["status"] == job["status"] == "done"
+    assert job["rows"] == MESSAGES
+    with gzip.open(path, "rt", encoding="utf-8") as exported:
+        assert sum(1 for _ in exported) == MESSAGES
+    # Mémoire bornée par les lots de sessions et les blocs encodés, pas par le volume
+    assert peak < small_peak * 1.5 + 2**20
+    assert peak < 32 * 2**20
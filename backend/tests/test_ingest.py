@@ -0,0 +1,255 @@
+"""
+Tests de l'écriture différée et du rejeu des messages de conversation
+
+Les collections MongoDB sont remplacées par des collections en mémoire qui
+appliquent les mises à jour produites par ConversationStore ; des pannes y sont
+injectées pour provoquer le débordement puis le rejeu.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from app.conversations import storage as storage_module
+from app.conversations.ingest import MessageIngestor
+
+CHATBOT = {"_id": "bot", "client_id": "acme"}
+START = datetime(2024, 1, 1)
+
+class Outage(Exception):
+    """Panne MongoDB simulée"""
+
+class FakeHeaders:
+    """Collection conversations réduite à la réservation des positions"""
+
+    def __init__(self):
+        self.headers: Dict[tuple, Dict[str, Any]] = {}
+        self.down = False
+
+    async def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=None):
+        if self.down:
+            raise Outage("conversations indisponible")
+        key = (query["client_id"], query["session_id"])
+        before = dict(self.headers[key]) if key in self.headers else None
+        header = self.headers.setdefault(key, {"message_count": 0})
+        header["message_count"] += update["$inc"]["message_count"]
+        if return_document == storage_module.ReturnDocument.BEFORE:
+            return before
+        return dict(header)
+
+class FakeBuckets:
+    """Collection conversation_messages : compartiments triés par position"""
+
+    def __init__(self):
+        self.buckets: Dict[tuple, List[Dict[str, Any]]] = {}
+        self.down = False
+        # Numéros de compartiments dont l'écriture échoue (erreur d'écriture partielle)
+        self.rejected_seqs: set = set()
+        # Durée d'une écriture (secondes)
+        self.delay = 0.0
+
+    async def bulk_write(self, operations, ordered=True):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.down:
+            raise Outage("conversation_messages indisponible")
+        errors = []
+        for index, operation in enumerate(operations):
+            query, update = operation._filter, operation._doc
+            if query["seq"] in self.rejected_seqs:
+                errors.append({"index": index, "code": 1, "errmsg": "rejeté"})
+                if ordered:
+                    break
+                continue
+            bucket = self.buckets.setdefault((query["client_id"], query["session_id"], query["seq"]), [])
+            bucket.extend(update["$push"]["messages"]["$each"])
+            bucket.sort(key=lambda message: message["position"])
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+    def _matching(self, query):
+        for (client_id, session_id, seq), messages in self.buckets.items():
+            if client_id != query["client_id"] or session_id != query["session_id"]:
+                continue
+            ids = query["messages.id"]
+            ids = set(ids["$in"]) if isinstance(ids, dict) else {ids}
+            if any(message["id"] in ids for message in messages):
+                yield {"seq": seq, "messages": messages}
+
+    async def find_one(self, query, projection=None):
+        if self.down:
+            raise Outage("conversation_messages indisponible")
+        return next(self._matching(query), None)
+
+    def find(self, query, projection=None):
+        if self.down:
+            raise Outage("conversation_messages indisponible")
+        buckets = list(self._matching(query))
+
+        class Cursor:
+            def __aiter__(self):
+                async def iterate():
+                    for bucket in buckets:
+                        yield bucket
+                return iterate()
+
+        return Cursor()
+
+    def session(self, session_id: str) -> List[Dict[str, Any]]:
+        """Messages d'une session dans l'ordre de lecture (compartiment puis position)"""
+        return [
+            message
+            for key in sorted(k for k in self.buckets if k[1] == session_id)
+            for message in self.buckets[key]
+        ]
+
+class RecordedStats:
+    """Statistiques comptabilisées, par appel"""
+
+    def __init__(self):
+        self.calls: List[tuple] = []
+
+    def record(self, client_id, chatbot_id, messages, new_conversation=False):
+        self.calls.append(([m["id"] for m in messages], new_conversation))
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    headers, buckets, stats = FakeHeaders(), FakeBuckets(), RecordedStats()
+
+    async def index_documents(documents):
+        return None
+
+    monkeypatch.setattr(storage_module, "conversations_collection", headers)
+    monkeypatch.setattr(storage_module, "conversation_buckets_collection", buckets)
+    monkeypatch.setattr(storage_module, "stats_rollups", stats)
+    monkeypatch.setattr(storage_module.conversation_search, "index_documents", index_documents)
+    ingestor = MessageIngestor(interval=3600, spill_path=str(tmp_path / "spill.jsonl"))
+    return ingestor, headers, buckets, stats
+
+def message(name: str, minute: int) -> Dict[str, Any]:
+    return {"id": name, "sender": "user", "content": name, "timestamp": START + timedelta(minutes=minute)}
+
+async def started(ingestor: MessageIngestor) -> None:
+    # Tâche d'écriture simulée : les écritures sont déclenchées explicitement par flush
+    ingestor._task = object()
+
+@pytest.mark.asyncio
+async def test_replayed_messages_keep_their_order_after_reservation_outage(store):
+    ingestor, headers, buckets, _ = store
+    await started(ingestor)
+
+    await ingestor.submit(CHATBOT, "s1", message("a1", 0), message("a2", 0))
+    headers.down = True
+    await ingestor.flush()
+    # Écritures reprises, mais la session attend le rejeu de ses messages antérieurs
+    headers.down = False
+    await ingestor.submit(CHATBOT, "s1", message("b1", 1), message("b2", 1))
+    await ingestor.submit(CHATBOT, "s2", message("x1", 1))
+    await ingestor.flush()
+
+    assert [m["id"] for m in buckets.session("s1")] == ["a1", "a2", "b1", "b2"]
+    assert [m["position"] for m in buckets.session("s1")] == [0, 1, 2, 3]
+    assert [m["id"] for m in buckets.session("s2")] == ["x1"]
+    assert ingestor._spilled == {}
+
+@pytest.mark.asyncio
+async def test_replayed_messages_reuse_their_positions(store):
+    ingestor, headers, buckets, _ = store
+    await started(ingestor)
+
+    await ingestor.submit(CHATBOT, "s1", message("a1", 0), message("a2", 0))
+    buckets.down = True
+    await ingestor.flush()
+    buckets.down = False
+    await ingestor.submit(CHATBOT, "s1", message("b1", 1))
+    await ingestor.flush()
+
+    # Les positions réservées avant la panne sont réutilisées : a1 et a2 précèdent b1
+    assert [(m["id"], m["position"]) for m in buckets.session("s1")] == [("a1", 0), ("a2", 1), ("b1", 2)]
+    assert headers.headers[("acme", "s1")]["message_count"] == 3
+
+@pytest.mark.asyncio
+async def test_start_counts_sessions_left_in_the_spill_file(store):
+    ingestor, headers, buckets, _ = store
+    headers.down = True
+    await started(ingestor)
+    await ingestor.submit(CHATBOT, "s1", message("a1", 0))
+    await ingestor.flush()
+
+    # Redémarrage : le décompte est reconstruit depuis le fichier de débordement
+    restarted = MessageIngestor(interval=3600, spill_path=ingestor.spill_path)
+    await restarted._count_spilled()
+    assert restarted._spilled == {("acme", "s1"): 1}
+    headers.down = False
+    await restarted._replay()
+    assert [m["id"] for m in buckets.session("s1")] == ["a1"]
+    assert restarted._spilled == {}
+
+@pytest.mark.asyncio
+async def test_partial_bulk_error_spills_only_rejected_buckets(store, monkeypatch):
+    ingestor, _, buckets, stats = store
+    monkeypatch.setattr(storage_module.conversation_store, "bucket_size", 2)
+    await started(ingestor)
+
+    await ingestor.submit(CHATBOT, "s1", *(message(f"m{index}", 0) for index in range(4)))
+    buckets.rejected_seqs = {1}
+    await ingestor.flush()
+    assert [m["id"] for m in buckets.session("s1")] == ["m0", "m1"]
+
+    buckets.rejected_seqs = set()
+    await ingestor.submit(CHATBOT, "s2", message("x1", 1))
+    await ingestor.flush()
+
+    # Chaque message est écrit et comptabilisé une seule fois
+    assert [(m["id"], m["position"]) for m in buckets.session("s1")] == [("m0", 0), ("m1", 1), ("m2", 2), ("m3", 3)]
+    counted = [message_id for ids, _ in stats.calls for message_id in ids]
+    assert sorted(counted) == ["m0", "m1", "m2", "m3", "x1"]
+
+@pytest.mark.asyncio
+async def test_append_once_writes_only_missing_messages(store):
+    _, _, buckets, _ = store
+    entry = {"client_id": "acme", "session_id": "s1", "chatbot_id": "bot", "updated_at": START,
+             "messages": [dict(message("m0", 0), position=0), dict(message("m1", 0), position=1)]}
+    buckets.buckets[("acme", "s1", 0)] = [dict(entry["messages"][0])]
+
+    assert await storage_module.conversation_store.append_once(entry) is True
+    assert [m["id"] for m in buckets.session("s1")] == ["m0", "m1"]
+    assert await storage_module.conversation_store.append_once(entry) is False
+    assert [m["id"] for m in buckets.session("s1")] == ["m0", "m1"]
+
+@pytest.mark.asyncio
+async def test_conversation_is_counted_once_with_its_first_message(store, monkeypatch):
+    ingestor, _, buckets, stats = store
+    monkeypatch.setattr(storage_module.conversation_store, "bucket_size", 2)
+    await started(ingestor)
+
+    await ingestor.submit(CHATBOT, "s1", *(message(f"m{index}", 0) for index in range(4)))
+    buckets.rejected_seqs = {0}
+    await ingestor.flush()
+    buckets.rejected_seqs = set()
+    await ingestor.submit(CHATBOT, "s2", message("x1", 1))
+    await ingestor.flush()
+    await ingestor.submit(CHATBOT, "s1", message("m4", 2))
+    await ingestor.flush()
+
+    # L'en-tête de s1 a été créé à la première écriture, mais la conversation est comptée avec m0, rejoué
+    assert [m["id"] for m in buckets.session("s1")] == ["m0", "m1", "m2", "m3", "m4"]
+    assert [(ids, new) for ids, new in stats.calls if new] == [(["x1"], True), (["m0", "m1"], True)]
+    assert sum(new for _, new in stats.calls) == 2
+
+@pytest.mark.asyncio
+async def test_stop_during_a_flush_keeps_the_batch(store):
+    ingestor, _, buckets, _ = store
+    buckets.delay = 0.2
+    ingestor.interval = 0.01
+    await ingestor.start()
+    await ingestor.submit(CHATBOT, "s1", message("a1", 0), message("a2", 0))
+    # Écriture périodique en cours : l'arrêt attend sa fin au lieu de l'annuler
+    await asyncio.sleep(0.05)
+    assert ingestor._flushing
+
+    await ingestor.stop()
+
+    assert [m["id"] for m in buckets.session("s1")] == ["a1", "a2"]
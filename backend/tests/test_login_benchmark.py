@@ -0,0 +1,98 @@
+"""
+Banc d'essai : latence du chat pendant une rafale de connexions
+
+Une rafale de requêtes /api/auth/token est envoyée pendant que des requêtes de
+chat (simulées par une attente d'entrée/sortie) sont servies par la même boucle
+d'événements. Le p99 du chat est mesuré sans connexion, pendant la rafale avec
+le pool de hachage, puis avec une vérification bcrypt exécutée dans la boucle.
+
+    python -m pytest -s tests/test_login_benchmark.py
+"""
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import List
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from passlib.context import CryptContext
+
+from app.auth import service
+from app.auth.models import UserInDB
+from app.auth.router import router as auth_router
+
+# Le backend os_crypt de passlib garde le GIL pendant le hachage : seul le module bcrypt le libère
+pytest.importorskip("bcrypt")
+
+LOGINS = int(os.getenv("BENCHMARK_LOGINS", "16"))
+CHAT_REQUESTS = int(os.getenv("BENCHMARK_CHAT_REQUESTS", "200"))
+CHAT_IO = 0.005  # Attente simulée du fournisseur LLM (secondes)
+LOGIN_SPACING = 0.05  # Intervalle entre deux connexions de la rafale (secondes)
+PASSWORD = "motdepassefort"
+
+def p99(latencies: List[float]) -> float:
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+
+@pytest.fixture
+def app(monkeypatch):
+    # Coût bcrypt réduit (10 au lieu de 12) pour garder le banc d'essai court
+    hashed = CryptContext(schemes=["bcrypt"], bcrypt__rounds=10).hash(PASSWORD)
+    user = UserInDB(id="u1", email="admin@iafluence.fr", hashed_password=hashed, is_admin=True,
+                    created_at=datetime.utcnow(), updated_at=datetime.utcnow())
+
+    async def get_user(email):
+        return user
+
+    monkeypatch.setattr(service, "get_user", get_user)
+    app = FastAPI()
+    app.include_router(auth_router, prefix="/api/auth")
+
+    @app.get("/chat")
+    async def chat():
+        await asyncio.sleep(CHAT_IO)
+        return {"response": "ok"}
+
+    return app
+
+async def measure(app: FastAPI, logins: int) -> tuple:
+    """Envoie la rafale de connexions et les requêtes de chat ; retourne (p99 du chat, latence maximale du chat)"""
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        latencies: List[float] = []
+
+        async def chat_traffic() -> None:
+            for _ in range(CHAT_REQUESTS):
+                start = time.perf_counter()
+                response = await client.get("/chat")
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code == 200
+
+        async def login(index: int) -> None:
+            await asyncio.sleep(index * LOGIN_SPACING)
+            response = await client.post("/api/auth/token",
+                                         data={"username": "admin@iafluence.fr", "password": PASSWORD})
+            assert response.status_code == 200
+
+        await asyncio.gather(chat_traffic(), *(login(index) for index in range(logins)))
+        return p99(latencies), max(latencies)
+
+@pytest.mark.asyncio
+async def test_chat_p99_stays_flat_during_login_burst(app, monkeypatch):
+    baseline, baseline_max = await measure(app, 0)
+    pooled, pooled_max = await measure(app, LOGINS)
+
+    async def inline(func, *args):
+        return func(*args)
+
+    monkeypatch.setattr(service, "run_password_task", inline)
+    blocking, blocking_max = await measure(app, LOGINS)
+
+    print(f"\nchat sans connexion: p99 {baseline * 1000:.1f} ms, max {baseline_max * 1000:.1f} ms")
+    print(f"chat, {LOGINS} connexions via le pool: p99 {pooled * 1000:.1f} ms, max {pooled_max * 1000:.1f} ms")
+    print(f"chat, {LOGINS} connexions dans la boucle: p99 {blocking * 1000:.1f} ms, max {blocking_max * 1000:.1f} ms")
+    print(f"pool: {service.password_hasher.stats()}")
+
+    assert pooled < baseline + 0.05
+    assert blocking > pooled
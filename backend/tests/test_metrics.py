@@ -0,0 +1,29 @@
+"""
+Tests du middleware de mesure des requêtes HTTP
+"""
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+
+from app.utils.metrics import MetricsMiddleware, http_requests
+
+def test_requests_are_labelled_by_route_template():
+    router = APIRouter()
+
+    @router.get("/items/{item_id}")
+    async def item(item_id: str):
+        return {"id": item_id}
+
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+    app.add_middleware(MetricsMiddleware)
+    before = dict(http_requests._values)
+    client = TestClient(app)
+
+    client.get("/api/items/1")
+    client.get("/api/items/2")
+    client.get("/api/missing")
+
+    counted = {key: value - before.get(key, 0) for key, value in http_requests._values.items()
+               if value != before.get(key, 0)}
+    # Une série par modèle de chemin ; les chemins sans route partagent une étiquette fixe
+    assert counted == {("GET", "/api/items/{item_id}", "200"): 2, ("GET", "unmatched", "404"): 1}
@@ -0,0 +1,116 @@
+"""
+Tests des alertes de quota
+"""
+import asyncio
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from app.clients import alerts as alerts_module
+from app.clients.alerts import QuotaAlerter
+from app.utils import email as email_module
+
+CLIENT = {"client_id": "acme", "name": "<b>Acme</b>", "monthly_quota": 100}
+
+class FakeAlerts:
+    """Collection quota_alerts avec son index unique (client_id, month, threshold)"""
+
+    def __init__(self):
+        self.keys = set()
+
+    async def insert_one(self, document):
+        key = (document["client_id"], document["month"], document["threshold"])
+        if key in self.keys:
+            raise DuplicateKeyError("E11000")
+        self.keys.add(key)
+
+    async def delete_many(self, query):
+        for condition in query["$or"]:
+            self.keys.discard((condition["client_id"], condition["month"], condition["threshold"]))
+
+@pytest.fixture
+def collection(monkeypatch):
+    collection = FakeAlerts()
+    monkeypatch.setattr(alerts_module, "quota_alerts_collection", collection)
+    return collection
+
+@pytest.mark.asyncio
+async def test_failed_digest_is_retried(collection, monkeypatch):
+    results = [False, True]
+    digests = []
+
+    async def send(alerts):
+        digests.append([a["threshold"] for a in alerts])
+        return results.pop(0)
+
+    monkeypatch.setattr(alerts_module, "send_quota_digest_email", send)
+    alerter = QuotaAlerter(thresholds=[80, 100])
+    alerter.notify_usage(CLIENT, 100)
+
+    # Boîte d'envoi indisponible : les alertes ne sont pas marquées comme envoyées
+    assert await alerter.flush() == 0
+    assert collection.keys == set()
+    assert await alerter.flush() == 2
+    assert len(collection.keys) == 2
+    # Une alerte envoyée ne l'est qu'une fois
+    alerter.notify_usage(CLIENT, 100)
+    assert await alerter.flush() == 0
+    assert digests == [[80, 100], [80, 100]]
+
+@pytest.mark.asyncio
+async def test_stop_during_a_flush_sends_the_digest(collection, monkeypatch):
+    digests = []
+
+    async def send(alerts):
+        await asyncio.sleep(0.2)
+        digests.append([a["threshold"] for a in alerts])
+        return True
+
+    monkeypatch.setattr(alerts_module, "send_quota_digest_email", send)
+    alerter = QuotaAlerter(thresholds=[80, 100], interval=0.01)
+    alerter._task = asyncio.create_task(alerter._run())
+    alerter.notify_usage(CLIENT, 100)
+    # Récapitulatif en cours d'envoi : l'arrêt attend sa fin au lieu de l'annuler
+    await asyncio.sleep(0.05)
+    assert not alerter._pending
+
+    await alerter.stop()
+
+    assert digests == [[80, 100]]
+    assert len(collection.keys) == 2
+
+@pytest.mark.asyncio
+async def test_cancelled_flush_releases_its_alerts(collection, monkeypatch):
+    digests = []
+
+    async def send(alerts):
+        await asyncio.sleep(0.2)
+        digests.append([a["threshold"] for a in alerts])
+        return True
+
+    monkeypatch.setattr(alerts_module, "send_quota_digest_email", send)
+    alerter = QuotaAlerter(thresholds=[80, 100])
+    alerter.notify_usage(CLIENT, 100)
+    flush = asyncio.create_task(alerter.flush())
+    await asyncio.sleep(0.05)
+    flush.cancel()
+    await asyncio.gather(flush, return_exceptions=True)
+
+    # Récapitulatif non placé : les alertes sont désenregistrées puis renvoyées
+    assert digests == []
+    assert collection.keys == set()
+    assert await alerter.flush() == 2
+    assert digests == [[80, 100]]
+
+@pytest.mark.asyncio
+async def test_digest_escapes_client_name(monkeypatch):
+    sent = {}
+
+    async def send_email(to, subject, body, html_body=None):
+        sent["html"] = html_body
+        return True
+
+    monkeypatch.setattr(email_module, "send_email", send_email)
+    await email_module.send_quota_digest_email([dict(CLIENT, threshold=80, used=80)])
+    assert "&lt;b&gt;Acme&lt;/b&gt;" in sent["html"]
+    assert "<b>Acme</b>" not in sent["html"]
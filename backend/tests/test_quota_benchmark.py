@@ -0,0 +1,170 @@
+"""
+Banc d'essai : contention sur les compteurs de quota
+
+Plusieurs workers (une instance de QuotaEngine chacun) servent des tours de chat
+concurrents pour quelques clients partagés. Chaque tour vérifie le quota puis
+comptabilise la requête. La collection llm_usage est simulée en mémoire avec une
+latence par opération et un verrou par document, comme l'écriture concurrente
+d'un même document MongoDB.
+
+La référence interroge llm_usage à chaque tour (agrégation puis $inc) ; le moteur
+de quota décide en mémoire et écrit ses incréments par lots.
+
+    python -m pytest -s tests/test_quota_benchmark.py
+"""
+import asyncio
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List
+
+import pytest
+
+from app.clients import quota as quota_module
+from app.clients.quota import QuotaEngine, month_start
+
+WORKERS = int(os.getenv("BENCHMARK_WORKERS", "4"))
+TURNS = int(os.getenv("BENCHMARK_TURNS", "500"))  # Tours de chat par worker
+CLIENTS = int(os.getenv("BENCHMARK_CLIENTS", "3"))
+CONCURRENCY = 50  # Tours simultanés par worker
+LATENCY = 0.002  # Aller-retour MongoDB simulé (secondes)
+
+def p99(latencies: List[float]) -> float:
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+
+class FakeUsage:
+    """Collection llm_usage en mémoire : latence par opération et verrou par document"""
+
+    def __init__(self):
+        self.documents: Dict[tuple, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._locks: Dict[tuple, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self.operations = 0
+
+    async def _write(self, query, increments) -> None:
+        key = (query["client_id"], query["date"], query["llm"])
+        async with self._locks[key]:
+            await asyncio.sleep(LATENCY)
+            for field, value in increments.items():
+                self.documents[key][field] += value
+
+    async def update_one(self, query, update, upsert=False):
+        self.operations += 1
+        await self._write(query, update["$inc"])
+
+    async def bulk_write(self, operations, ordered=True):
+        self.operations += 1
+        for operation in operations:
+            await self._write(operation._filter, operation._doc["$inc"])
+
+    def aggregate(self, pipeline):
+        self.operations += 1
+        match = pipeline[0]["$match"]
+        client_ids = match["client_id"]["$in"] if isinstance(match["client_id"], dict) else [match["client_id"]]
+        documents = self.documents
+
+        class Cursor:
+            async def _results(self):
+                await asyncio.sleep(LATENCY)
+                totals = defaultdict(int)
+                for (client_id, day, _), fields in documents.items():
+                    if client_id in client_ids and day >= match["date"]["$gte"]:
+                        totals[client_id] += fields["requests"]
+                return [{"_id": client_id, "requests": requests} for client_id, requests in totals.items()]
+
+            async def to_list(self, length):
+                results = await self._results()
+                return [{"_id": None, "requests": sum(r["requests"] for r in results)}] if results else []
+
+            def __aiter__(self):
+                async def iterate():
+                    for result in await self._results():
+                        yield result
+                return iterate()
+
+        return Cursor()
+
+    def total(self) -> int:
+        return sum(fields["requests"] for fields in self.documents.values())
+
+class DirectQuota:
+    """Référence : lecture et écriture de llm_usage à chaque tour"""
+
+    def __init__(self, collection: FakeUsage):
+        self.collection = collection
+
+    async def is_over_quota(self, client) -> bool:
+        used = await self.collection.aggregate([
+            {"$match": {"client_id": client["client_id"], "date": {"$gte": month_start()}}},
+        ]).to_list(1)
+        return (used[0]["requests"] if used else 0) >= client["monthly_quota"]
+
+    async def record(self, client_id: str, llm_name: str) -> None:
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        await self.collection.update_one({"client_id": client_id, "date": today, "llm": llm_name},
+                                         {"$inc": {"requests": 1}}, upsert=True)
+
+async def run_workers(turn) -> List[float]:
+    """Exécute les tours de chat de tous les workers ; retourne les latences"""
+    latencies: List[float] = []
+
+    async def worker(index: int) -> None:
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+
+        async def one(number: int) -> None:
+            async with semaphore:
+                client = {"client_id": f"client-{number % CLIENTS}", "monthly_quota": 10 ** 9}
+                start = time.perf_counter()
+                await turn(index, client)
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(one(number) for number in range(TURNS)))
+
+    await asyncio.gather(*(worker(index) for index in range(WORKERS)))
+    return latencies
+
+@pytest.mark.asyncio
+async def test_quota_engine_under_contention(monkeypatch):
+    # Référence : une agrégation et un $inc par tour
+    direct_collection = FakeUsage()
+    direct = DirectQuota(direct_collection)
+
+    async def direct_turn(index, client):
+        await direct.is_over_quota(client)
+        await direct.record(client["client_id"], "gpt-4")
+
+    start = time.perf_counter()
+    direct_latencies = await run_workers(direct_turn)
+    direct_elapsed = time.perf_counter() - start
+
+    # Moteur de quota : un par worker, écritures groupées toutes les 50 ms
+    collection = FakeUsage()
+    monkeypatch.setattr(quota_module, "llm_usage_collection", collection)
+    engines = [QuotaEngine(interval=0.05) for _ in range(WORKERS)]
+    for engine in engines:
+        await engine.start()
+
+    async def engine_turn(index, client):
+        await engines[index].is_over_quota(client)
+        engines[index].record(client["client_id"], "gpt-4")
+
+    start = time.perf_counter()
+    engine_latencies = await run_workers(engine_turn)
+    engine_elapsed = time.perf_counter() - start
+    for engine in engines:
+        await engine.stop()
+
+    total = WORKERS * TURNS
+    print(f"\nréférence: {total / direct_elapsed:.0f} tours/s, p99 {p99(direct_latencies) * 1000:.1f} ms, "
+          f"{direct_collection.operations} opérations MongoDB")
+    print(f"moteur de quota: {total / engine_elapsed:.0f} tours/s, p99 {p99(engine_latencies) * 1000:.1f} ms, "
+          f"{collection.operations} opérations MongoDB")
+
+    # Aucun incrément perdu, et chaque worker voit le total de tous les workers après écriture
+    assert collection.total() == direct_collection.total() == total
+    for engine in engines:
+        await engine.flush()
+        assert sum([await engine.used(f"client-{number}") for number in range(CLIENTS)]) == total
+    assert p99(engine_latencies) < p99(direct_latencies)
+    assert collection.operations < direct_collection.operations
@@ -0,0 +1,74 @@
+"""
+Tests du cache de réponses LLM
+"""
+import asyncio
+import math
+from array import array
+
+import pytest
+
+from app.conversations.llm.cache import ResponseCache
+
+DIMENSIONS = 1536
+
+def chatbot(client_id: str, instructions: str = "") -> dict:
+    return {"client_id": client_id, "default_llm": "gpt-4", "custom_instructions": instructions}
+
+def unit_vector(seed: int) -> array:
+    values = [math.sin(seed * 7.0 + index) for index in range(DIMENSIONS)]
+    norm = math.sqrt(sum(x * x for x in values))
+    return array("f", (x / norm for x in values))
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = ResponseCache(maxsize=1000, ttl=60, semantic=True)
+
+    async def embed(question):
+        return unit_vector(sum(map(ord, question)))
+
+    monkeypatch.setattr(cache, "_embed", embed)
+    return cache
+
+async def settle(cache: ResponseCache) -> None:
+    await asyncio.gather(*list(cache._tasks))
+
+@pytest.mark.asyncio
+async def test_exact_and_semantic_hits(cache):
+    cache.set(chatbot("acme"), "Quels sont vos horaires ?", "De 9h à 18h")
+    await settle(cache)
+
+    assert await cache.get(chatbot("acme"), "quels sont vos  HORAIRES") == "De 9h à 18h"
+    # Même embedding, question formulée autrement : succès sémantique
+    cache._exact.clear()
+    assert await cache.get(chatbot("acme"), "Quels sont vos horaires ?") == "De 9h à 18h"
+    assert cache.hits_exact == 1 and cache.hits_semantic == 1
+    # Nouvelle configuration du chatbot : entrées inaccessibles
+    assert await cache.get(chatbot("acme", "Sois bref"), "Quels sont vos horaires ?") is None
+
+@pytest.mark.asyncio
+async def test_semantic_tier_is_bounded_in_bytes(cache):
+    cache.max_vector_bytes = 100 * DIMENSIONS * 4
+    for client in range(30):
+        for question in range(10):
+            cache.set(chatbot(f"client-{client}"), f"question {question}", "réponse")
+    await settle(cache)
+
+    stats = cache.stats()
+    assert stats["semantic_entries"] == 100
+    assert stats["semantic_bytes"] == 100 * DIMENSIONS * 4
+    # Les entrées les plus anciennes sont évincées, avec l'index de leur client
+    assert len(cache._client_vectors) == 10
+    assert sum(len(keys) for keys in cache._client_vectors.values()) == 100
+
+@pytest.mark.asyncio
+async def test_invalidation_releases_vectors(cache):
+    for question in range(5):
+        cache.set(chatbot("acme"), f"question {question}", "réponse")
+        cache.set(chatbot("other"), f"question {question}", "réponse")
+    await settle(cache)
+
+    cache.invalidate_chatbot("acme")
+    assert "acme" not in cache._client_vectors
+    assert cache.stats()["semantic_entries"] == 5
+    assert cache.stats()["semantic_bytes"] == 5 * DIMENSIONS * 4
+    assert await cache.get(chatbot("acme"), "question 1") is None
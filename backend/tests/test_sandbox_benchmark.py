@@ -0,0 +1,112 @@
+"""
+Banc d'essai : débit et surcoût de la sandbox du code personnalisé
+
+Mesure le nombre d'appels par seconde et le p99 du surcoût d'un appel à la
+sandbox par rapport à l'exécution directe de la même fonction, puis vérifie
+qu'un script qui boucle indéfiniment ne bloque pas la boucle d'événements.
+
+Le pool démarre ses processus avec forkserver : ils importent app.sandbox.worker
+depuis ce fichier de test, sans dépendre du module __main__ du lanceur.
+
+    python -m pytest -s tests/test_sandbox_benchmark.py
+"""
+import asyncio
+import os
+import time
+from typing import List
+
+import pytest
+import pytest_asyncio
+
+pytest.importorskip("RestrictedPython")
+
+from app.sandbox.executor import SandboxError, SandboxPool
+
+CALLS = int(os.getenv("BENCHMARK_SANDBOX_CALLS", "2000"))
+CONCURRENCY = 8
+
+SOURCE = '''
+def pre_process(message):
+    return message.strip().capitalize()
+'''
+
+RUNAWAY = '''
+def pre_process(message):
+    while True:
+        pass
+'''
+
+def p99(latencies: List[float]) -> float:
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+
+def direct(message: str) -> str:
+    return message.strip().capitalize()
+
+@pytest_asyncio.fixture
+async def pool():
+    pool = SandboxPool(size=2, timeout=0.5)
+    await pool.start()
+    yield pool
+    await pool.stop()
+
+@pytest.mark.asyncio
+async def test_invocations_per_second(pool):
+    # Premier appel : compilation et transmission du code à chaque processus
+    for _ in range(pool.size):
+        assert await pool.run(SOURCE, "pre_process", " bonjour ") == "Bonjour"
+
+    start = time.perf_counter()
+    for _ in range(CALLS):
+        direct(" bonjour ")
+    direct_cost = (time.perf_counter() - start) / CALLS
+
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def call() -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await pool.run(SOURCE, "pre_process", " bonjour ")
+            latencies.append(time.perf_counter() - started)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(CALLS)))
+    elapsed = time.perf_counter() - start
+
+    # Le surcoût est mesuré sans attente d'un processus libre : appels séquentiels
+    sequential: List[float] = []
+    for _ in range(min(CALLS, 500)):
+        started = time.perf_counter()
+        await pool.run(SOURCE, "pre_process", " bonjour ")
+        sequential.append(time.perf_counter() - started - direct_cost)
+
+    print(f"\n{pool.size} processus, {CONCURRENCY} appels simultanés: {CALLS / elapsed:.0f} appels/s, "
+          f"p99 {p99(latencies) * 1000:.2f} ms")
+    print(f"surcoût d'un appel: p99 {p99(sequential) * 1000:.3f} ms (exécution directe {direct_cost * 1e6:.1f} µs)")
+
+    assert len(latencies) == CALLS
+    assert p99(sequential) < 0.05
+
+@pytest.mark.asyncio
+async def test_runaway_script_does_not_stall_the_loop(pool):
+    ticks: List[float] = []
+
+    async def chat_traffic() -> None:
+        # Requêtes de chat simulées : 10 ms d'attente, la latence mesure le blocage de la boucle
+        for _ in range(100):
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            ticks.append(time.perf_counter() - started)
+
+    async def runaway() -> None:
+        with pytest.raises(SandboxError):
+            await pool.run(RUNAWAY, "pre_process", "bonjour")
+
+    await asyncio.gather(chat_traffic(), runaway(), runaway())
+
+    print(f"\nchat pendant deux scripts bloqués: max {max(ticks) * 1000:.1f} ms")
+    assert max(ticks) < 0.1
+    # Les processus bloqués ont été remplacés : la sandbox répond de nouveau
+    assert await pool.run(SOURCE, "pre_process", " bonjour ") == "Bonjour"
+    assert pool.stats()["workers"] == pool.size
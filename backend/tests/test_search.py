@@ -0,0 +1,30 @@
+"""
+Tests de la route de recherche dans les conversations
+"""
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.auth.service import get_admin_user
+from app.conversations import router as router_module
+
+def test_search_route_is_not_taken_for_a_session_id(monkeypatch):
+    calls = []
+
+    async def search(client_id, query=None, **filters):
+        calls.append((client_id, query))
+        return {"total": 0, "truncated": False, "results": [], "facets": {"dates": [], "llms": [], "tags": []}}
+
+    async def page(*args, **kwargs):
+        raise AssertionError("/search servi comme une session")
+
+    monkeypatch.setattr(router_module.conversation_search, "search", search)
+    monkeypatch.setattr(router_module.conversation_store, "page", page)
+    app = FastAPI()
+    app.include_router(router_module.router, prefix="/api/conversations")
+    app.dependency_overrides[get_admin_user] = lambda: None
+
+    response = TestClient(app).get("/api/conversations/search", params={"client_id": "acme", "q": "horaires"})
+
+    assert response.status_code == 200
+    assert response.json()["total"] == 0
+    assert calls == [("acme", "horaires")]
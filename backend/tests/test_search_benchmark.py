@@ -0,0 +1,100 @@
+"""
+Banc d'essai : recherche dans un million de messages
+
+Remplit une base MongoDB dédiée avec BENCHMARK_SEARCH_MESSAGES messages (un
+million par défaut) répartis sur 100 clients, dont un gros client qui en détient
+un dixième, puis compare pour ce client la recherche par l'index texte préfixé
+par client_id (ConversationSearch.search, avec les facettes) à un parcours de
+ses messages par expression régulière.
+
+Nécessite un serveur MongoDB (voir tests/conftest.py) ; le remplissage prend
+quelques minutes.
+
+    python -m pytest -s tests/test_search_benchmark.py
+"""
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+import pytest
+from pymongo import ASCENDING, DESCENDING
+
+from app.config import settings
+from app.conversations import search as search_module
+from app.conversations.search import ConversationSearch, search_document
+
+MESSAGES = int(os.getenv("BENCHMARK_SEARCH_MESSAGES", "1000000"))
+CLIENTS = 100
+QUERIES = ["horaires livraison", "remboursement", "mot de passe oublié", "facture", "\"suivi de commande\""]
+ROUNDS = 10
+
+WORDS = ("bonjour merci commande livraison horaires facture remboursement retour produit compte mot passe "
+         "oublié suivi colis adresse paiement carte abonnement résiliation garantie magasin stock prix promotion "
+         "délai réclamation échange taille couleur disponible").split()
+
+def p95(latencies: List[float]) -> float:
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+async def seed(collection) -> None:
+    rng = random.Random(0)
+    start = datetime(2024, 1, 1)
+    batch = []
+    for index in range(MESSAGES):
+        # Un message sur dix appartient au gros client, les autres sont répartis sur les 99 restants
+        client_id = "client-0" if index % 10 == 0 else f"client-{1 + rng.randrange(CLIENTS - 1)}"
+        message = {
+            "id": f"m{index}",
+            "position": index % 20,
+            "sender": "user" if index % 2 == 0 else "bot",
+            "content": " ".join(rng.choice(WORDS) for _ in range(12)),
+            "tags": [rng.choice(["vente", "support", "sav"])],
+            "llm_used": None if index % 2 == 0 else rng.choice(["gpt-4", "claude-3-haiku"]),
+            "timestamp": start + timedelta(seconds=index * 30),
+        }
+        batch.append(search_document(client_id, f"s{index // 20}", message))
+        if len(batch) == 10000:
+            await collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await collection.insert_many(batch, ordered=False)
+
+@pytest.mark.asyncio
+async def test_million_message_search(benchmark_db, monkeypatch):
+    collection = benchmark_db["conversation_search"]
+    # Index créés par init_db
+    await collection.create_index([("client_id", ASCENDING), ("message_id", ASCENDING)], unique=True)
+    await collection.create_index([("client_id", ASCENDING), ("timestamp", DESCENDING)])
+    await collection.create_index(
+        [("client_id", 1), ("content", "text"), ("tags", "text"), ("llm_used", "text")],
+        name="client_text",
+        weights={"content": 10, "tags": 5, "llm_used": 1},
+        default_language="french",
+        language_override="search_language"
+    )
+    start = time.perf_counter()
+    await seed(collection)
+    print(f"\n{MESSAGES} messages indexés en {time.perf_counter() - start:.0f} s")
+
+    monkeypatch.setattr(search_module, "conversation_search_collection", collection)
+    search = ConversationSearch()
+    indexed: List[float] = []
+    scanned: List[float] = []
+    for _ in range(ROUNDS):
+        for query in QUERIES:
+            started = time.perf_counter()
+            found = await search.search("client-0", query)
+            indexed.append(time.perf_counter() - started)
+            assert found["results"]
+
+            # Sans index texte : expression régulière sur chaque message du client
+            pattern = query.strip('"').split()[0]
+            started = time.perf_counter()
+            await collection.count_documents({"client_id": "client-0", "content": {"$regex": pattern, "$options": "i"}})
+            scanned.append(time.perf_counter() - started)
+
+    print(f"gros client ({MESSAGES // 10} messages): index texte et facettes p95 {p95(indexed) * 1000:.0f} ms, "
+          f"parcours par expression régulière p95 {p95(scanned) * 1000:.0f} ms")
+    assert p95(indexed) * 1000 < settings.SEARCH_TIMEOUT_MS
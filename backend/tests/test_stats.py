@@ -0,0 +1,67 @@
+"""
+Tests des compteurs de statistiques pré-agrégées
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.clients import stats as stats_module
+from app.clients.stats import StatsRollups
+
+START = datetime(2024, 1, 1, 10)
+
+def message(position: int, minute: int = 0) -> dict:
+    return {"id": f"m{position}", "position": position, "sender": "user", "timestamp": START + timedelta(minutes=minute)}
+
+def conversations(rollups: StatsRollups) -> float:
+    return sum(delta["conversations"] for (_, _, _, granularity, _), delta in rollups._deltas.items()
+               if granularity == "day")
+
+def test_conversations_follow_header_creation_not_positions():
+    rollups = StatsRollups()
+    # Positions réservées puis perdues : la session commence à la position 3
+    rollups.record("acme", "bot", [message(3), message(4)], new_conversation=True)
+    # Position 0 d'une session dont l'en-tête existait déjà
+    rollups.record("acme", "bot", [message(0)])
+
+    assert conversations(rollups) == 1
+
+def test_conversation_opened_before_live_since_is_left_to_backfill():
+    rollups = StatsRollups()
+    rollups.live_since = START + timedelta(minutes=1)
+    rollups.record("acme", "bot", [message(0, minute=0), message(1, minute=2)], new_conversation=True)
+
+    assert conversations(rollups) == 0
+    assert sum(delta["messages"] for key, delta in rollups._deltas.items() if key[3] == "day") == 1
+
+class SlowRollups:
+    """Collection stats_rollups dont les écritures durent 0,2 seconde"""
+
+    def __init__(self):
+        self.operations = []
+
+    async def bulk_write(self, operations, ordered=True):
+        await asyncio.sleep(0.2)
+        self.operations.extend(operations)
+
+@pytest.mark.asyncio
+async def test_stop_during_a_flush_keeps_the_counters(monkeypatch):
+    collection = SlowRollups()
+    monkeypatch.setattr(stats_module, "stats_rollups_collection", collection)
+
+    async def prices():
+        return {}
+
+    monkeypatch.setattr(stats_module.llm_prices, "get", prices)
+    rollups = StatsRollups(interval=0.01)
+    rollups._task = asyncio.create_task(rollups._run())
+    rollups.record("acme", "bot", [message(0)], new_conversation=True)
+    # Écriture périodique en cours : l'arrêt attend sa fin au lieu de l'annuler
+    await asyncio.sleep(0.05)
+    assert not rollups._deltas
+
+    await rollups.stop()
+
+    days = [operation._doc["$inc"] for operation in collection.operations if operation._filter["granularity"] == "day"]
+    assert days == [{"messages": 1, "user_messages": 1, "conversations": 1}]
@@ -0,0 +1,124 @@
+"""
+Banc d'essai : statistiques pré-agrégées contre agrégation à la volée
+
+Remplit une base MongoDB dédiée avec BENCHMARK_STATS_MESSAGES messages (un million
+par défaut) sur 90 jours, rangés en compartiments comme par ConversationStore et
+comptabilisés dans stats_rollups comme par StatsRollups. Compare ensuite, pour le
+client le plus actif, la lecture des compteurs par StatsRollups.summary à une
+agrégation des compartiments calculée à chaque requête, et vérifie que les deux
+donnent les mêmes totaux.
+
+Nécessite un serveur MongoDB (voir tests/conftest.py).
+
+    python -m pytest -s tests/test_stats_benchmark.py
+"""
+import os
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import List
+
+import pytest
+
+from app.clients import stats as stats_module
+from app.clients.stats import StatsRollups, accumulate, rollup_operations
+from app.conversations.storage import ConversationStore
+
+MESSAGES = int(os.getenv("BENCHMARK_STATS_MESSAGES", "1000000"))
+CLIENTS = 20
+SESSION_LENGTH = 10
+DAYS = 90
+ROUNDS = 10
+START = datetime(2024, 1, 1)
+
+def p95(latencies: List[float]) -> float:
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+async def seed(buckets, rollups) -> None:
+    rng = random.Random(0)
+    store = ConversationStore()
+    deltas = defaultdict(lambda: defaultdict(float))
+    documents = []
+    for session in range(MESSAGES // SESSION_LENGTH):
+        # Le client 0 reçoit un quart des sessions
+        client_id = "client-0" if session % 4 == 0 else f"client-{1 + rng.randrange(CLIENTS - 1)}"
+        opened = START + timedelta(seconds=rng.randrange(DAYS * 86400))
+        messages = [
+            {
+                "id": f"s{session}-{position}",
+                "position": position,
+                "sender": "user" if position % 2 == 0 else "bot",
+                "content": "message",
+                "llm_used": None if position % 2 == 0 else "gpt-4",
+                "metadata": {} if position % 2 == 0 else {"tokens": 100 + rng.randrange(400)},
+                "response_time": None if position % 2 == 0 else rng.random() * 3,
+                "timestamp": opened + timedelta(seconds=20 * position),
+            }
+            for position in range(SESSION_LENGTH)
+        ]
+        accumulate(deltas, client_id, "bot", messages, new_conversation=True)
+        # Compartiments tels qu'écrits par ConversationStore.bucket_operation
+        documents.extend(
+            {"session_id": f"s{session}", "seq": seq, "client_id": client_id, "messages": bucket,
+             "count": len(bucket), "first_timestamp": bucket[0]["timestamp"], "last_timestamp": bucket[-1]["timestamp"]}
+            for seq, bucket in store._buckets(messages).items()
+        )
+        if len(documents) >= 5000:
+            await buckets.insert_many(documents, ordered=False)
+            documents = []
+    if documents:
+        await buckets.insert_many(documents, ordered=False)
+    await rollups.bulk_write(rollup_operations(deltas, {}, "live"), ordered=False)
+
+def on_the_fly(client_id: str, date_from: datetime, date_to: datetime) -> list:
+    """Agrégation des compartiments par jour, sans compteurs pré-calculés"""
+    return [
+        {"$match": {"client_id": client_id, "first_timestamp": {"$lt": date_to},
+                    "last_timestamp": {"$gte": date_from}}},
+        {"$unwind": "$messages"},
+        {"$match": {"messages.timestamp": {"$gte": date_from, "$lt": date_to}}},
+        {"$group": {
+            "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$messages.timestamp"}},
+            "messages": {"$sum": 1},
+            "conversations": {"$sum": {"$cond": [{"$eq": ["$messages.position", 0]}, 1, 0]}},
+            "tokens": {"$sum": {"$ifNull": ["$messages.metadata.tokens", 0]}},
+            "response_time": {"$avg": "$messages.response_time"},
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+
+@pytest.mark.asyncio
+async def test_rollups_against_on_the_fly_aggregation(benchmark_db, monkeypatch):
+    buckets, rollups = benchmark_db["conversation_messages"], benchmark_db["stats_rollups"]
+    await buckets.create_index([("session_id", 1), ("seq", 1), ("client_id", 1)], unique=True)
+    await buckets.create_index([("client_id", 1), ("first_timestamp", 1)])
+    await rollups.create_index(
+        [("client_id", 1), ("granularity", 1), ("period", 1), ("chatbot_id", 1), ("llm", 1), ("source", 1)],
+        unique=True
+    )
+    start = time.perf_counter()
+    await seed(buckets, rollups)
+    print(f"\n{MESSAGES} messages et compteurs écrits en {time.perf_counter() - start:.0f} s")
+
+    monkeypatch.setattr(stats_module, "stats_rollups_collection", rollups)
+    date_from, date_to = START, START + timedelta(days=DAYS)
+    summaries = StatsRollups()
+    precomputed: List[float] = []
+    aggregated: List[float] = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        summary = await summaries.summary("client-0", "day", date_from, date_to)
+        precomputed.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        days = await buckets.aggregate(on_the_fly("client-0", date_from, date_to)).to_list(None)
+        aggregated.append(time.perf_counter() - started)
+
+    print(f"client-0 sur {DAYS} jours: compteurs pré-agrégés p95 {p95(precomputed) * 1000:.1f} ms, "
+          f"agrégation à la volée p95 {p95(aggregated) * 1000:.1f} ms")
+    assert summary["totals"]["messages"] == sum(day["messages"] for day in days)
+    assert summary["totals"]["conversations"] == sum(day["conversations"] for day in days)
+    assert summary["totals"]["tokens"] == sum(day["tokens"] for day in days)
+    assert p95(precomputed) < p95(aggregated)
@@ -0,0 +1,160 @@
+"""
+Tests du streaming des réponses (SSE) avec un fournisseur LLM factice
+"""
+import json
+from typing import List, Optional
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.conversations import router as conversations_router
+from app.conversations import service
+from app.conversations.llm import providers
+from app.conversations.llm.dispatcher import llm_dispatcher
+from app.conversations.llm.providers import LLMError, LLMProvider
+
+CLIENT = {"client_id": "acme", "name": "Acme", "monthly_quota": 1000}
+CHATBOT = {"_id": "bot", "client_id": "acme", "default_llm": "gpt-4"}
+
+class FakeProvider(LLMProvider):
+    """Fournisseur qui produit des fragments prédéfinis, puis échoue éventuellement"""
+    name = "openai"
+
+    def __init__(self, chunks: List[str], fail_after: Optional[int] = None):
+        super().__init__("http://fake")
+        self.chunks = chunks
+        self.fail_after = fail_after
+        self.calls = 0
+
+    async def stream(self, model, messages, max_tokens=0, temperature=0.0):
+        self.calls += 1
+        for index, chunk in enumerate(self.chunks):
+            if index == self.fail_after:
+                raise LLMError(f"{self.name}: connexion interrompue")
+            yield chunk
+        if self.fail_after is not None and self.fail_after >= len(self.chunks):
+            raise LLMError(f"{self.name}: connexion interrompue")
+
+def parse_sse(body: str) -> List[tuple]:
+    """Découpe un flux SSE en tuples (événement, données)"""
+    events = []
+    for block in body.split("\n\n"):
+        if not block:
+            continue
+        lines = block.split("\n")
+        assert lines[0].startswith("event: ") and lines[1].startswith("data: ") and len(lines) == 2
+        events.append((lines[0][len("event: "):], json.loads(lines[1][len("data: "):])))
+    return events
+
+@pytest.fixture
+def chat(monkeypatch):
+    """Application de test : fournisseur factice et dépendances MongoDB remplacées"""
+    saved = []
+
+    async def get_tenant(client_id):
+        return CLIENT, CHATBOT
+
+    async def no_history(client_id, session_id, last_message_id=None):
+        return []
+
+    async def used(client_id):
+        return 0
+
+    async def submit(chatbot, session_id, *messages):
+        saved.append(messages)
+
+    async def no_cache(chatbot, prompt):
+        return None
+
+    async def build(chatbot, session_id, history, message):
+        return [{"role": "user", "content": message}]
+
+    monkeypatch.setattr(conversations_router, "get_tenant", get_tenant)
+    monkeypatch.setattr(service.history_store, "get", no_history)
+    monkeypatch.setattr(service.context_builder, "build", build)
+    monkeypatch.setattr(service.quota_engine, "used", used)
+    monkeypatch.setattr(service.quota_engine, "record", lambda *args, **kwargs: None)
+    monkeypatch.setattr(service.quota_alerter, "notify_usage", lambda client, used: None)
+    monkeypatch.setattr(service.message_ingestor, "submit", submit)
+    monkeypatch.setattr(service.response_cache, "get", no_cache)
+    monkeypatch.setattr(service.response_cache, "set", lambda *args: None)
+    # Disjoncteurs propres à chaque test
+    monkeypatch.setattr(llm_dispatcher, "_breakers", {})
+
+    app = FastAPI()
+    app.include_router(conversations_router.router, prefix="/api/conversations")
+
+    def install(provider: FakeProvider) -> TestClient:
+        monkeypatch.setitem(providers._providers, "openai", provider)
+        return TestClient(app)
+
+    install.saved = saved
+    return install
+
+def post_stream(client: TestClient, message: str = "Bonjour") -> List[tuple]:
+    response = client.post("/api/conversations/chat/stream",
+                           json={"client_id": "acme", "session_id": "s1", "message": message})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.headers["cache-control"] == "no-cache"
+    return parse_sse(response.text)
+
+def test_format_sse_frames_one_event():
+    frame = conversations_router.format_sse("token", {"t": "é\nà"})
+    assert frame.endswith("\n\n")
+    assert frame.count("\n") == 3
+    assert parse_sse(frame) == [("token", {"t": "é\nà"})]
+
+def test_provider_must_implement_stream():
+    with pytest.raises(TypeError):
+        LLMProvider("http://fake")
+
+@pytest.mark.asyncio
+async def test_complete_joins_chunks_in_order():
+    assert await FakeProvider(["Bon", "jour", " !"]).complete("m", []) == "Bonjour !"
+
+def test_tokens_are_relayed_in_order_then_done(chat):
+    chunks = ["Le ", "chat", " est", " sur", " le", " tapis", "."]
+    provider = FakeProvider(chunks)
+    events = post_stream(chat(provider))
+
+    assert [name for name, _ in events] == ["token"] * len(chunks) + ["done"]
+    assert [data["t"] for _, data in events[:-1]] == chunks
+    done = events[-1][1]
+    assert done["response"] == "".join(chunks)
+    assert done["llm_used"] == "gpt-4"
+    assert done["session_id"] == "s1"
+    assert provider.calls == 1
+    # La réponse complète est enregistrée une seule fois, avec la question
+    assert len(chat.saved) == 1
+    user_message, bot_message = chat.saved[0]
+    assert user_message["content"] == "Bonjour"
+    assert bot_message["content"] == "".join(chunks)
+    assert bot_message["id"] == done["message_id"]
+
+def test_provider_error_mid_stream_ends_with_error_event(chat):
+    events = post_stream(chat(FakeProvider(["Un", " début", " de", " réponse"], fail_after=2)), "Question interrompue")
+
+    assert [name for name, _ in events] == ["token", "token", "error"]
+    assert [data["t"] for _, data in events[:2]] == ["Un", " début"]
+    assert "indisponible" in events[-1][1]["detail"]
+    assert chat.saved == []
+
+def test_provider_error_before_first_token(chat):
+    events = post_stream(chat(FakeProvider(["jamais"], fail_after=0)), "Question sans réponse")
+
+    assert [name for name, _ in events] == ["error"]
+    assert chat.saved == []
+
+def test_blocking_endpoint_returns_full_response(chat):
+    client = chat(FakeProvider(["Réponse", " complète"]))
+    response = client.post("/api/conversations/chat",
+                           json={"client_id": "acme", "session_id": "s2", "message": "Autre question"})
+    assert response.status_code == 200
+    assert response.json()["response"] == "Réponse complète"
+
+    client = chat(FakeProvider(["Réponse"], fail_after=1))
+    response = client.post("/api/conversations/chat",
+                           json={"client_id": "acme", "session_id": "s3", "message": "Encore une question"})
+    assert response.status_code == 502
@@ -0,0 +1,79 @@
+"""
+Tests du cache de la configuration des clients
+"""
+import asyncio
+
+import pytest
+
+from app.clients import tenants as tenants_module
+from app.clients.tenants import TenantCache
+
+class FakeCollection:
+    """Collection clients ou chatbots en mémoire, avec un délai de lecture optionnel"""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.delay = 0.0
+        self.reads = 0
+
+    async def find_one(self, query):
+        self.reads += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return next((d for d in self.documents if d["client_id"] == query["client_id"]), None)
+
+@pytest.fixture
+def collections(monkeypatch):
+    clients = FakeCollection([{"_id": f"c{i}", "client_id": f"client-{i}", "active": True} for i in range(10)])
+    chatbots = FakeCollection([{"_id": f"b{i}", "client_id": f"client-{i}"} for i in range(10)])
+    monkeypatch.setattr(tenants_module, "clients_collection", clients)
+    monkeypatch.setattr(tenants_module, "chatbots_collection", chatbots)
+    return clients, chatbots
+
+@pytest.mark.asyncio
+async def test_cancelled_leader_does_not_strand_followers(collections):
+    clients, _ = collections
+    clients.delay = 0.05
+    cache = TenantCache()
+
+    leader = asyncio.create_task(cache.get("client-1"))
+    await asyncio.sleep(0.01)
+    follower = asyncio.create_task(cache.get("client-1"))
+    await asyncio.sleep(0.01)
+    leader.cancel()
+
+    client, chatbot = await asyncio.wait_for(follower, timeout=1)
+    assert client["_id"] == "c1" and chatbot["_id"] == "b1"
+    assert leader.cancelled()
+
+@pytest.mark.asyncio
+async def test_owners_follow_evictions(collections):
+    cache = TenantCache(maxsize=3)
+    for i in range(10):
+        await cache.get(f"client-{i}")
+
+    assert len(cache._entries) == 3
+    assert set(cache._owners.values()) == {"client-7", "client-8", "client-9"}
+    assert len(cache._owners) == 6
+
+@pytest.mark.asyncio
+async def test_unknown_ids_do_not_evict_tenants(collections):
+    clients, _ = collections
+    cache = TenantCache(maxsize=3)
+    for i in range(3):
+        await cache.get(f"client-{i}")
+    for i in range(100):
+        assert await cache.get(f"inconnu-{i}") == (None, None)
+
+    reads = clients.reads
+    for i in range(3):
+        assert (await cache.get(f"client-{i}"))[0] is not None
+    assert clients.reads == reads
+    # Les identifiants inconnus sont eux aussi servis depuis le cache
+    await cache.get("inconnu-99")
+    assert clients.reads == reads
+
+    # Un client créé entre-temps est visible dès l'invalidation
+    clients.documents.append({"_id": "new", "client_id": "inconnu-99", "active": True})
+    cache.invalidate("inconnu-99")
+    assert (await cache.get("inconnu-99"))[0]["_id"] == "new"
@@ -0,0 +1,51 @@
+"""
+Banc d'essai : références aux bases des clients à 10, 100 et 1000 clients
+
+Compare le coût de get_client_db (références réutilisées) à la construction d'une
+nouvelle référence Motor à chaque appel, pour un trafic réparti sur 10, 100 puis
+1000 clients, et vérifie que le nombre de références conservées reste borné.
+
+    python -m pytest -s tests/test_tenant_db_benchmark.py
+"""
+import os
+import random
+import time
+
+import pytest
+
+from app.config import settings
+from app.utils import db as db_module
+from app.utils.cache import LRUCache
+from app.utils.db import client, get_client_db
+
+LOOKUPS = int(os.getenv("BENCHMARK_TENANT_LOOKUPS", "50000"))
+
+@pytest.mark.parametrize("tenants", [10, 100, 1000])
+def test_client_db_handles(tenants, monkeypatch):
+    monkeypatch.setattr(db_module, "client_databases", LRUCache(maxsize=settings.TENANT_DB_CACHE_SIZE))
+    rng = random.Random(tenants)
+    client_ids = [f"client-{rng.randrange(tenants)}" for _ in range(LOOKUPS)]
+
+    start = time.perf_counter()
+    for client_id in client_ids:
+        client[f"{settings.MONGODB_DB_NAME}_{client_id}"]
+    fresh = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for client_id in client_ids:
+        get_client_db(client_id)
+    cached = time.perf_counter() - start
+
+    print(f"\n{tenants} clients: nouvelle référence {fresh / LOOKUPS * 1e6:.2f} µs/appel, "
+          f"référence réutilisée {cached / LOOKUPS * 1e6:.2f} µs/appel, "
+          f"{len(db_module.client_databases)} références conservées")
+
+    assert len(db_module.client_databases) <= min(tenants, settings.TENANT_DB_CACHE_SIZE)
+    assert get_client_db(client_ids[0]) is get_client_db(client_ids[0])
+    assert cached < fresh
+
+def test_client_db_handles_are_bounded(monkeypatch):
+    monkeypatch.setattr(db_module, "client_databases", LRUCache(maxsize=100))
+    for index in range(1000):
+        get_client_db(f"client-{index}")
+    assert len(db_module.client_databases) == 100
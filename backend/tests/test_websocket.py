@@ -0,0 +1,31 @@
+"""
+Tests du transport WebSocket du widget
+"""
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.conversations import router as router_module
+from app.conversations import websocket as websocket_module
+from app.conversations.websocket import ChatSockets
+
+@pytest.fixture
+def client(monkeypatch):
+    async def get_tenant(client_id):
+        return {"client_id": client_id}, {"_id": "bot", "client_id": client_id}
+
+    monkeypatch.setattr(websocket_module, "get_tenant", get_tenant)
+    monkeypatch.setattr(router_module, "chat_sockets", ChatSockets())
+    app = FastAPI()
+    app.include_router(router_module.router, prefix="/api/conversations")
+    return TestClient(app)
+
+def test_binary_frame_is_rejected_without_closing(client):
+    with client.websocket_connect("/api/conversations/ws?client_id=acme&session_id=s1") as websocket:
+        assert websocket.receive_json()["t"] == "r"
+
+        websocket.send_bytes(b'{"t":"p"}')
+        assert websocket.receive_json() == {"t": "e", "d": "Trame invalide"}
+        # La connexion reste utilisable
+        websocket.send_text('{"t":"p"}')
+        assert websocket.receive_json() == {"t": "p"}
@@ -0,0 +1,130 @@
+"""
+Banc d'essai : mémoire des connexions WebSocket inactives
+
+Démarre l'application (route /api/conversations/ws, client factice) dans un
+serveur uvicorn séparé, y ouvre BENCHMARK_WS_CONNECTIONS connexions (10 000 par
+défaut) qui restent inactives après leur trame d'ouverture, puis mesure la
+mémoire résidente du serveur par connexion et vérifie que les connexions
+répondent toujours à un battement de cœur.
+
+Le serveur utilise l'implémentation WebSocket du déploiement (`--ws
+websockets-sansio`, voir deployment.md), ou celle de BENCHMARK_WS_IMPL : environ
+70 Ko par connexion, contre 135 Ko avec l'implémentation `websockets`. Le
+traitement des trames par ChatSockets en représente moins de 2 Ko.
+
+    python -m pytest -s tests/test_websocket_benchmark.py
+"""
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+websockets = pytest.importorskip("websockets")
+
+CONNECTIONS = int(os.getenv("BENCHMARK_WS_CONNECTIONS", "10000"))
+IMPLEMENTATION = os.getenv("BENCHMARK_WS_IMPL", "websockets-sansio")
+CONCURRENCY = 200
+
+SERVER = '''
+import sys
+
+import uvicorn
+from fastapi import FastAPI
+
+from app.conversations import router as router_module
+from app.conversations import websocket as websocket_module
+
+async def get_tenant(client_id):
+    return {"client_id": client_id}, {"_id": "bot", "client_id": client_id}
+
+websocket_module.get_tenant = get_tenant
+app = FastAPI()
+app.include_router(router_module.router, prefix="/api/conversations")
+uvicorn.run(app, host="127.0.0.1", port=int(sys.argv[1]), log_level="warning", ws=sys.argv[2], backlog=4096)
+'''
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+def resident_memory(pid: int) -> int:
+    """Mémoire résidente d'un processus (octets)"""
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError("VmRSS absent")
+
+async def wait_until_listening(port: int, server: subprocess.Popen) -> None:
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("Le serveur s'est arrêté au démarrage")
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("Le serveur ne répond pas")
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/status"), reason="Mesure de la mémoire par /proc")
+@pytest.mark.asyncio
+async def test_idle_connections_memory():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and hard < CONNECTIONS + 100:
+        pytest.skip(f"Limite de descripteurs de fichiers trop basse ({hard})")
+    resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, CONNECTIONS + 100), hard))
+
+    port = free_port()
+    # Le serveur hérite de la limite relevée ; les connexions inactives ne sont pas fermées pendant la mesure
+    server = subprocess.Popen(
+        [sys.executable, "-c", SERVER, str(port), IMPLEMENTATION],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=dict(os.environ, WS_IDLE_TIMEOUT="600"),
+    )
+    connections = []
+    try:
+        await wait_until_listening(port, server)
+        url = f"ws://127.0.0.1:{port}/api/conversations/ws?client_id=acme&session_id="
+        # Une connexion ouverte et fermée : les imports et les caches sont chargés avant la mesure
+        async with websockets.connect(url + "warmup") as warmup:
+            await warmup.recv()
+        await asyncio.sleep(0.5)
+        baseline = resident_memory(server.pid)
+
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+
+        async def open_session(index: int) -> None:
+            async with semaphore:
+                connection = await websockets.connect(url + f"s{index}", open_timeout=60, ping_interval=None)
+                assert json.loads(await connection.recv())["t"] == "r"
+                connections.append(connection)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(open_session(index) for index in range(CONNECTIONS)))
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(1)
+        loaded = resident_memory(server.pid)
+
+        # Les connexions inactives répondent toujours
+        for connection in connections[::max(1, CONNECTIONS // 100)]:
+            await connection.send('{"t":"p"}')
+            assert json.loads(await connection.recv()) == {"t": "p"}
+
+        per_connection = (loaded - baseline) / CONNECTIONS
+        print(f"\n{CONNECTIONS} connexions ({IMPLEMENTATION}) ouvertes en {elapsed:.1f} s; mémoire du serveur "
+              f"{baseline / 2**20:.0f} Mo -> {loaded / 2**20:.0f} Mo, soit {per_connection / 1024:.1f} Ko par connexion")
+        assert server.poll() is None
+        assert per_connection < 200 * 1024
+    finally:
+        await asyncio.gather(*(connection.close() for connection in connections), return_exceptions=True)
+        server.terminate()
+        server.wait(timeout=30)
@@ -0,0 +1,71 @@
+"""
+Tests du cache des fichiers d'intégration du widget
+
+Le cache des clients est remplacé par un dictionnaire de chatbots ; le modèle du
+snippet est fourni directement.
+"""
+import asyncio
+import os
+import time
+
+import pytest
+
+from app.widgets import artifacts as artifacts_module
+from app.widgets.artifacts import WidgetArtifacts
+
+TEMPLATE = "<script src='{{SERVER_URL}}/api/widgets/loader.js' data-client-id='{{CLIENT_ID}}'></script>"
+SERVER_URL = "https://chat.example.com"
+
+class FakeTenants:
+    """Cache des clients : un chatbot actif par client"""
+
+    async def get(self, client_id):
+        return {"client_id": client_id}, {"client_id": client_id, "name": f"Bot {client_id}"}
+
+@pytest.fixture
+def artifacts(monkeypatch, tmp_path):
+    monkeypatch.setattr(artifacts_module, "tenant_cache", FakeTenants())
+    artifacts = WidgetArtifacts(directory=str(tmp_path), max_bytes=150)
+    artifacts._templates = {"snippet": (TEMPLATE, "modèle")}
+    return artifacts
+
+@pytest.mark.asyncio
+async def test_cancelled_generation_releases_waiting_requests(artifacts, monkeypatch):
+    write = artifacts._write
+
+    def slow_write(path, content):
+        time.sleep(0.1)
+        write(path, content)
+
+    monkeypatch.setattr(artifacts, "_write", slow_write)
+    leader = asyncio.create_task(artifacts.get("snippet", "acme", SERVER_URL))
+    await asyncio.sleep(0.01)
+    follower = asyncio.create_task(artifacts.get("snippet", "acme", SERVER_URL))
+    await asyncio.sleep(0.01)
+    leader.cancel()
+
+    artifact = await asyncio.wait_for(follower, timeout=2)
+    assert b"data-client-id='acme'" in artifact["content"]
+    assert artifacts._building == {}
+
+@pytest.mark.asyncio
+async def test_served_content_survives_eviction(artifacts, tmp_path):
+    first = await artifacts.get("snippet", "acme", SERVER_URL)
+    # Deux autres fichiers dépassent la taille maximale : le premier est supprimé
+    await artifacts.get("snippet", "globex", SERVER_URL)
+    await artifacts.get("snippet", "initech", SERVER_URL)
+    assert f"{first['etag'].strip(chr(34))}.html" not in os.listdir(tmp_path)
+
+    # La réponse déjà préparée ne dépend pas du fichier
+    assert b"data-client-id='acme'" in first["content"]
+    again = await artifacts.get("snippet", "acme", SERVER_URL)
+    assert again["content"] == first["content"] and again["etag"] == first["etag"]
+
+@pytest.mark.asyncio
+async def test_file_removed_by_another_worker_is_regenerated(artifacts, tmp_path):
+    first = await artifacts.get("snippet", "acme", SERVER_URL)
+    for name in os.listdir(tmp_path):
+        os.remove(tmp_path / name)
+
+    assert (await artifacts.get("snippet", "acme", SERVER_URL))["content"] == first["content"]
+    assert len(os.listdir(tmp_path)) == 1
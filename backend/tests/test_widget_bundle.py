@@ -0,0 +1,50 @@
+"""
+Tests des versions du widget servies après un déploiement
+"""
+import os
+
+from app.widgets.bundle import WidgetBundle
+
+def deploy(tmp_path, version: int) -> WidgetBundle:
+    """Publie une version du widget puis démarre une nouvelle instance, comme un déploiement"""
+    for path, body in (("js/chatbot-widget.js", f"console.log({version});"), ("css/chatbot-widget.css", "div{}")):
+        os.makedirs(tmp_path / "widget" / os.path.dirname(path), exist_ok=True)
+        (tmp_path / "widget" / path).write_text(body)
+    bundle = WidgetBundle(str(tmp_path / "widget"), history=str(tmp_path / "history"), versions=2)
+    bundle.build()
+    return bundle
+
+def script(bundle: WidgetBundle) -> str:
+    return bundle.urls["js"].rsplit("/", 1)[1]
+
+def test_previous_versions_stay_addressable(tmp_path):
+    first = script(deploy(tmp_path, 1))
+    second = script(deploy(tmp_path, 2))
+    bundle = deploy(tmp_path, 3)
+
+    assert script(bundle) not in (first, second)
+    # Pages et chargeurs encore en cache : les versions précédentes sont servies
+    assert bundle.asset(first).variants["identity"] == b"console.log(1);"
+    assert bundle.asset(second).variants["identity"] == b"console.log(2);"
+    assert "gzip" in bundle.asset(first).variants
+    # La feuille de style n'a pas changé : une seule version
+    assert len([name for name in bundle.assets if name.endswith(".css")]) == 1
+
+def test_versions_beyond_the_limit_are_dropped(tmp_path):
+    first = script(deploy(tmp_path, 1))
+    for version in (2, 3):
+        deploy(tmp_path, version)
+    bundle = deploy(tmp_path, 4)
+
+    assert bundle.asset(first) is None
+    assert not (tmp_path / "history" / first).exists()
+    assert len([name for name in bundle.assets if name.endswith(".js")]) == 3
+
+def test_redeployed_version_becomes_current(tmp_path):
+    first = script(deploy(tmp_path, 1))
+    deploy(tmp_path, 2)
+    # Retour à la version 1 : elle est la plus récente, la version 2 devient la précédente
+    bundle = deploy(tmp_path, 1)
+
+    assert script(bundle) == first
+    assert len([name for name in bundle.assets if name.endswith(".js")]) == 2
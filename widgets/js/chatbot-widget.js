@@ -58,6 +58,42 @@ class IAfluenceChatbot {
      */
     #sessionId = '';
 
+    /**
+     * ID du dernier message enregistré par le serveur
+     * @type {string|null}
+     */
+    #lastMessageId = null;
+
+    /**
+     * Connexion WebSocket au serveur (null si fermée)
+     * @type {WebSocket|null}
+     */
+    #socket = null;
+
+    /**
+     * WebSocket inutilisable (bloqué par le réseau ou le navigateur) : les échanges passent par HTTP
+     * @type {boolean}
+     */
+    #socketBlocked = false;
+
+    /**
+     * Tentatives de connexion WebSocket consécutives sans succès
+     * @type {number}
+     */
+    #socketFailures = 0;
+
+    /**
+     * Minuteur des battements de cœur de la connexion WebSocket
+     * @type {number|null}
+     */
+    #heartbeatTimer = null;
+
+    /**
+     * Réponse en cours de réception sur la connexion WebSocket
+     * @type {Object|null}
+     */
+    #socketTurn = null;
+
     /**
      * Initialise le chatbot avec la configuration fournie
      * @param {Object} config - Configuration du chatbot
@@ -280,6 +316,7 @@ class IAfluenceChatbot {
             this.#window.style.display = 'flex';
             this.#isOpen = true;
             this.#inputField.focus();
+            this.#connectSocket();
         }
     }
 
@@ -318,18 +355,35 @@ class IAfluenceChatbot {
         // Affichage d'un indicateur de chargement
         const loadingId = this.#addLoadingIndicator();
 
-        // Envoi de la requête au serveur
-        fetch(`${this.#config.serverUrl}/api/chat`, {
+        const payload = {
+            client_id: this.#config.clientId,
+            session_id: this.#sessionId,
+            message: message,
+            last_message_id: this.#lastMessageId
+        };
+
+        // Connexion WebSocket si elle est ouverte, sinon streaming HTTP si le navigateur le permet, sinon réponse complète
+        if (this.#socket && this.#socket.readyState === WebSocket.OPEN && !this.#socketTurn) {
+            this.#socketMessage(payload, loadingId);
+        } else if (this.#config.streaming !== false && window.ReadableStream && window.TextDecoder) {
+            this.#streamMessage(payload, loadingId);
+        } else {
+            this.#postMessage(payload, loadingId);
+        }
+    }
+
+    /**
+     * Envoie un message et attend la réponse complète du serveur
+     * @param {Object} payload - Corps de la requête
+     * @param {string} loadingId - ID de l'indicateur de chargement
+     */
+    #postMessage(payload, loadingId) {
+        fetch(`${this.#config.serverUrl}/api/conversations/chat`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({
-                client_id: this.#config.clientId,
-                session_id: this.#sessionId,
-                message: message,
-                conversation_history: this.#conversationHistory
-            })
+            body: JSON.stringify(payload)
         })
         .then(response => {
             if (!response.ok) {
@@ -342,6 +396,7 @@ class IAfluenceChatbot {
             this.#removeLoadingIndicator(loadingId);
             
             // Affichage de la réponse du bot
+            this.#lastMessageId = data.message_id;
             this.#addMessage('bot', data.response);
         })
         .catch(error => {
@@ -354,6 +409,238 @@ class IAfluenceChatbot {
         });
     }
 
+    /**
+     * Envoie un message et affiche la réponse au fil des tokens reçus (server-sent events)
+     * @param {Object} payload - Corps de la requête
+     * @param {string} loadingId - ID de l'indicateur de chargement
+     */
+    async #streamMessage(payload, loadingId) {
+        let messageElement = null;
+        let content = '';
+
+        try {
+            const response = await fetch(`${this.#config.serverUrl}/api/conversations/chat/stream`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream',
+                },
+                body: JSON.stringify(payload)
+            });
+            if (!response.ok || !response.body) {
+                throw new Error('Erreur de communication avec le serveur');
+            }
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+
+                // Découpage du flux en événements séparés par une ligne vide
+                buffer += decoder.decode(value, { stream: true });
+                const rawEvents = buffer.split('\n\n');
+                buffer = rawEvents.pop();
+
+                for (const rawEvent of rawEvents) {
+                    const event = this.#parseServerEvent(rawEvent);
+                    if (event.type === 'token') {
+                        // Le premier token remplace l'indicateur de chargement
+                        if (!messageElement) {
+                            this.#removeLoadingIndicator(loadingId);
+                            messageElement = this.#createMessageElement('bot', '');
+                        }
+                        content += event.data.t;
+                        this.#updateMessageElement(messageElement, content);
+                    } else if (event.type === 'done') {
+                        content = event.data.response;
+                        this.#lastMessageId = event.data.message_id;
+                    } else if (event.type === 'error') {
+                        throw new Error(event.data.detail);
+                    }
+                }
+            }
+
+            this.#removeLoadingIndicator(loadingId);
+            if (!messageElement) {
+                messageElement = this.#createMessageElement('bot', content);
+            }
+            this.#updateMessageElement(messageElement, content);
+
+            // Ajout à l'historique une fois la réponse complète
+            this.#recordMessage(messageElement.id, 'bot', content);
+        } catch (error) {
+            // Suppression de l'indicateur de chargement et de la réponse partielle
+            this.#removeLoadingIndicator(loadingId);
+            if (messageElement) {
+                messageElement.remove();
+            }
+
+            // Affichage d'un message d'erreur
+            this.#addMessage('bot', 'Désolé, une erreur est survenue. Veuillez réessayer plus tard.');
+            console.error('IAfluence Chatbot Error:', error);
+        }
+    }
+
+    /**
+     * Ouvre la connexion WebSocket de la session (sauf si WebSocket est désactivé ou bloqué)
+     *
+     * La connexion est rétablie après une coupure ; le dernier message reçu est alors
+     * transmis au serveur, qui renvoie les messages manqués. Après trois échecs
+     * consécutifs, les échanges passent définitivement par HTTP.
+     */
+    #connectSocket() {
+        if (this.#socket || this.#socketBlocked || this.#config.transport === 'http' || !window.WebSocket) {
+            return;
+        }
+
+        const url = new URL('/api/conversations/ws', this.#config.serverUrl || window.location.origin);
+        url.protocol = url.protocol === 'https:' ? 'wss:' : 'ws:';
+        url.searchParams.set('client_id', this.#config.clientId);
+        url.searchParams.set('session_id', this.#sessionId);
+        if (this.#lastMessageId) {
+            url.searchParams.set('last_message_id', this.#lastMessageId);
+        }
+
+        let opened = false;
+        const socket = new WebSocket(url.toString());
+        this.#socket = socket;
+        socket.onopen = () => {
+            opened = true;
+            this.#socketFailures = 0;
+        };
+        socket.onmessage = (event) => {
+            try {
+                this.#handleSocketFrame(JSON.parse(event.data));
+            } catch (error) {
+                console.error('IAfluence Chatbot Error:', error);
+            }
+        };
+        socket.onclose = () => {
+            clearInterval(this.#heartbeatTimer);
+            this.#socket = null;
+            if (this.#socketTurn) {
+                this.#socketTurn.interrupted = true;
+            }
+            if (!opened) {
+                this.#socketFailures += 1;
+                this.#socketBlocked = this.#socketFailures >= 3;
+            }
+            if (this.#socketBlocked) {
+                if (this.#socketTurn) {
+                    this.#failSocketTurn('Connexion WebSocket interrompue');
+                }
+                return;
+            }
+            // Reconnexion avec un délai croissant
+            setTimeout(() => this.#connectSocket(), Math.min(30000, 1000 * 2 ** this.#socketFailures));
+        };
+    }
+
+    /**
+     * Envoie un message sur la connexion WebSocket
+     * @param {Object} payload - Corps de la requête
+     * @param {string} loadingId - ID de l'indicateur de chargement
+     */
+    #socketMessage(payload, loadingId) {
+        this.#socketTurn = { loadingId: loadingId, element: null, content: '', interrupted: false };
+        this.#socket.send(JSON.stringify({ t: 'm', m: payload.message, l: payload.last_message_id }));
+    }
+
+    /**
+     * Traite une trame reçue sur la connexion WebSocket
+     * @param {Object} frame - Trame (type dans le champ t)
+     */
+    #handleSocketFrame(frame) {
+        const turn = this.#socketTurn;
+        if (frame.t === 'r') {
+            // Ouverture : battements de cœur et messages manqués pendant une coupure
+            clearInterval(this.#heartbeatTimer);
+            this.#heartbeatTimer = setInterval(() => {
+                if (this.#socket && this.#socket.readyState === WebSocket.OPEN) {
+                    this.#socket.send('{"t":"p"}');
+                }
+            }, frame.hb);
+            for (const message of frame.h || []) {
+                this.#lastMessageId = message.i;
+                if (message.s !== 'bot') {
+                    continue;
+                }
+                if (this.#socketTurn) {
+                    this.#finishSocketTurn(message.c);
+                } else {
+                    this.#addMessage('bot', message.c);
+                }
+            }
+            if (this.#socketTurn && this.#socketTurn.interrupted) {
+                this.#failSocketTurn('Réponse perdue pendant la reconnexion');
+            }
+        } else if (frame.t === 'k' && turn) {
+            // Le premier token remplace l'indicateur de chargement
+            if (!turn.element) {
+                this.#removeLoadingIndicator(turn.loadingId);
+                turn.element = this.#createMessageElement('bot', '');
+            }
+            turn.content += frame.d;
+            this.#updateMessageElement(turn.element, turn.content);
+        } else if (frame.t === 'd' && turn) {
+            this.#lastMessageId = frame.i;
+            this.#finishSocketTurn(turn.content);
+        } else if (frame.t === 'e' && turn) {
+            this.#failSocketTurn(frame.d);
+        }
+    }
+
+    /**
+     * Termine la réponse en cours sur la connexion WebSocket
+     * @param {string} content - Contenu complet de la réponse
+     */
+    #finishSocketTurn(content) {
+        const turn = this.#socketTurn;
+        this.#socketTurn = null;
+        this.#removeLoadingIndicator(turn.loadingId);
+        if (!turn.element) {
+            turn.element = this.#createMessageElement('bot', content);
+        }
+        this.#updateMessageElement(turn.element, content);
+        this.#recordMessage(turn.element.id, 'bot', content);
+    }
+
+    /**
+     * Abandonne la réponse en cours sur la connexion WebSocket et affiche un message d'erreur
+     * @param {string} detail - Cause de l'échec
+     */
+    #failSocketTurn(detail) {
+        const turn = this.#socketTurn;
+        this.#socketTurn = null;
+        this.#removeLoadingIndicator(turn.loadingId);
+        if (turn.element) {
+            turn.element.remove();
+        }
+        this.#addMessage('bot', 'Désolé, une erreur est survenue. Veuillez réessayer plus tard.');
+        console.error('IAfluence Chatbot Error:', detail);
+    }
+
+    /**
+     * Analyse un événement server-sent events
+     * @param {string} rawEvent - Événement brut (lignes "event:" et "data:")
+     * @returns {Object} Type et données de l'événement
+     */
+    #parseServerEvent(rawEvent) {
+        let type = 'message';
+        let data = '';
+        rawEvent.split('\n').forEach(line => {
+            if (line.startsWith('event:')) {
+                type = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                data += line.slice(5).trim();
+            }
+        });
+        return { type, data: data ? JSON.parse(data) : {} };
+    }
+
     /**
      * Ajoute un message à la conversation
      * @param {string} sender - Expéditeur du message ('user' ou 'bot')
@@ -361,22 +648,34 @@ class IAfluenceChatbot {
      * @returns {string} ID du message
      */
     #addMessage(sender, content) {
+        const messageElement = this.#createMessageElement(sender, content);
+
+        // Ajout à l'historique de conversation
+        this.#recordMessage(messageElement.id, sender, content);
+
+        return messageElement.id;
+    }
+
+    /**
+     * Crée l'élément DOM d'un message et l'ajoute au conteneur
+     * @param {string} sender - Expéditeur du message ('user' ou 'bot')
+     * @param {string} content - Contenu du message
+     * @returns {HTMLElement} Élément du message
+     */
+    #createMessageElement(sender, content) {
         const messageId = `msg-${Date.now()}-${Math.floor(Math.random() * 1000)}`;
-        const timestamp = new Date().toISOString();
 
         // Création de l'élément de message
         const messageElement = document.createElement('div');
         messageElement.className = `iafluence-chatbot-message iafluence-chatbot-message-${sender}`;
         messageElement.id = messageId;
 
-        // Formatage du contenu avec prise en charge des liens et des sauts de ligne
-        const formattedContent = this.#formatMessageContent(content);
-
         // Ajout du contenu au message
         messageElement.innerHTML = `
-            <div class="iafluence-chatbot-message-content">${formattedContent}</div>
+            <div class="iafluence-chatbot-message-content"></div>
             <div class="iafluence-chatbot-message-time">${this.#formatTime(new Date())}</div>
         `;
+        this.#updateMessageElement(messageElement, content);
 
         // Ajout du message au conteneur
         this.#messagesContainer.appendChild(messageElement);
@@ -384,15 +683,34 @@ class IAfluenceChatbot {
         // Défilement vers le bas
         this.#scrollToBottom();
 
-        // Ajout à l'historique de conversation
+        return messageElement;
+    }
+
+    /**
+     * Met à jour le contenu affiché d'un message
+     * @param {HTMLElement} messageElement - Élément du message
+     * @param {string} content - Contenu du message
+     */
+    #updateMessageElement(messageElement, content) {
+        // Formatage du contenu avec prise en charge des liens et des sauts de ligne
+        const contentElement = messageElement.querySelector('.iafluence-chatbot-message-content');
+        contentElement.innerHTML = this.#formatMessageContent(content);
+        this.#scrollToBottom();
+    }
+
+    /**
+     * Ajoute un message à l'historique de conversation
+     * @param {string} messageId - ID du message
+     * @param {string} sender - Expéditeur du message ('user' ou 'bot')
+     * @param {string} content - Contenu du message
+     */
+    #recordMessage(messageId, sender, content) {
         this.#conversationHistory.push({
             id: messageId,
             sender: sender,
             content: content,
-            timestamp: timestamp
+            timestamp: new Date().toISOString()
         });
-
-        return messageId;
     }
 
     /**
@@ -468,5 +786,10 @@ class IAfluenceChatbot {
      */
     #formatTime(date) {
         const hours = date.getHours().toString().padStart(2, '0');
-        const minutes = date.get
-(Content truncated due to size limit. Use line ranges to read in chunks)
\ No newline at end of file
+        const minutes = date.getMinutes().toString().padStart(2, '0');
+        return `${hours}:${minutes}`;
+    }
+}
+
+// Exposition de la classe pour l'initialisation depuis les snippets d'intégration
+window.IAfluenceChatbot = IAfluenceChatbot;
@@ -48,15 +48,16 @@ class IAfluence_Chatbot {
         
         // Chargement des options depuis la base de données
         $this->options = get_option('iafluence_chatbot_options', array(
-            'position' => 'bottom-right',
-            'primary_color' => '#4f46e5',
-            'secondary_color' => '#ffffff',
-            'chatbot_name' => 'Assistant IA',
-            'welcome_message' => 'Bonjour ! Comment puis-je vous aider aujourd\'hui ?',
-            'logo_url' => '',
-            'show_branding' => true,
-            'auto_open' => false,
-            'delay_auto_open' => 5000,
+            // Valeurs du chatbot lors de la génération du plugin
+            'position' => '{{POSITION}}',
+            'primary_color' => '{{PRIMARY_COLOR}}',
+            'secondary_color' => '{{SECONDARY_COLOR}}',
+            'chatbot_name' => '{{CHATBOT_NAME}}',
+            'welcome_message' => '{{WELCOME_MESSAGE}}',
+            'logo_url' => '{{LOGO_URL}}',
+            'show_branding' => {{SHOW_BRANDING}},
+            'auto_open' => {{AUTO_OPEN}},
+            'delay_auto_open' => {{DELAY_AUTO_OPEN}},
             'custom_css' => '',
         ));
         
@@ -74,33 +75,26 @@ class IAfluence_Chatbot {
      * Enregistre les scripts et styles nécessaires
      */
     public function enqueue_scripts() {
-        // Enregistrement du script principal
+        // Chargeur du widget : il charge les ressources versionnées (script et styles) depuis le serveur
         wp_enqueue_script(
             'iafluence-chatbot-widget',
-            $this->server_url . '/widgets/js/chatbot-widget.min.js',
+            $this->server_url . '/api/widgets/loader.js',
             array(),
-            '1.0.0',
+            null,
             true
         );
         
-        // Enregistrement des styles
-        wp_enqueue_style(
-            'iafluence-chatbot-styles',
-            $this->server_url . '/widgets/css/chatbot-widget.min.css',
-            array(),
-            '1.0.0'
-        );
+        // Styles du site (CSS personnalisé)
+        wp_register_style('iafluence-chatbot-styles', false);
+        wp_enqueue_style('iafluence-chatbot-styles');
         
-        // Passage des options au script
+        // Passage de la configuration au chargeur (les options du site sont portées par le conteneur)
         wp_localize_script(
             'iafluence-chatbot-widget',
-            'iafluenceChatbotOptions',
+            'iafluenceConfig',
             array(
-                'client_id' => $this->client_id,
-                'server_url' => $this->server_url,
-                'options' => $this->options,
-                'wp_rest_nonce' => wp_create_nonce('wp_rest'),
-                'ajax_url' => admin_url('admin-ajax.php'),
+                'clientId' => $this->client_id,
+                'serverUrl' => $this->server_url,
             )
         );
         